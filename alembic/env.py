@@ -18,6 +18,7 @@ from app.core.database import Base
 # 显式导入所有模型，确保它们注册到 Base.metadata
 from app.models.task import Task
 from app.models.system import RegisteredTask, Webhook, User, AuditLog
+from app.models.workflow import Workflow
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -0,0 +1,193 @@
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Callable, Optional
+from app.core.config import config
+from app.core.log_utils import get_logger
+from app.core.metrics import (
+    TASK_POOL_WAIT_SECONDS,
+    TASK_POOL_EXEC_SECONDS,
+    TASK_POOL_ABANDONED,
+    SYNC_DISPATCH_INFLIGHT,
+    SYNC_DISPATCH_WAITING,
+    SYNC_DISPATCH_QUEUE_SECONDS,
+    SYNC_DISPATCH_REJECTED_TOTAL,
+)
+
+logger = get_logger("executors")
+
+EXECUTOR_THREAD = "thread"
+EXECUTOR_PROCESS = "process"
+
+
+def blocking(func: Callable) -> Callable:
+    """
+    标记同步阻塞 (I/O) 的任务处理函数：在线程池中执行
+    """
+    func.__procurator_executor__ = EXECUTOR_THREAD
+    return func
+
+
+def cpu_bound(func: Callable) -> Callable:
+    """
+    标记 CPU 密集型的任务处理函数：在进程池中执行 (函数及参数、返回值需可 pickle)
+    """
+    func.__procurator_executor__ = EXECUTOR_PROCESS
+    return func
+
+
+def resolve_executor(func: Callable) -> Optional[str]:
+    """
+    决定处理函数的执行位置：
+    - 协程函数直接在事件循环中执行，返回 None
+    - 同步函数默认进线程池，标记了 @cpu_bound 的进进程池
+    """
+    if asyncio.iscoroutinefunction(func):
+        return None
+    return getattr(func, "__procurator_executor__", EXECUTOR_THREAD)
+
+
+def _timed_call(func: Callable, data: Any):
+    # 在线程/子进程内执行，使用墙上时间以便跨进程计算排队耗时
+    started = time.time()
+    try:
+        return started, time.time(), func(data), None
+    except Exception as e:
+        return started, time.time(), None, e
+
+
+class TaskExecutors:
+    """
+    同步任务处理函数的有界执行池 (线程池 / 进程池)，按需懒加载
+    """
+
+    def __init__(self):
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+
+    def _get_pool(self, kind: str):
+        if kind == EXECUTOR_PROCESS:
+            if self._process_pool is None:
+                size = int(config.get("TASK_PROCESS_POOL_SIZE", os.cpu_count() or 1))
+                self._process_pool = ProcessPoolExecutor(max_workers=size)
+                logger.info(f"Task process pool started (size={size})")
+            return self._process_pool
+
+        if self._thread_pool is None:
+            size = int(config.get("TASK_THREAD_POOL_SIZE", min(32, (os.cpu_count() or 1) + 4)))
+            self._thread_pool = ThreadPoolExecutor(max_workers=size, thread_name_prefix="task")
+            logger.info(f"Task thread pool started (size={size})")
+        return self._thread_pool
+
+    async def run(self, kind: str, func: Callable, data: Any, task_name: str = "unknown") -> Any:
+        """
+        在指定执行池中运行同步函数，分别记录排队等待与实际执行耗时
+        注意：超时 / 取消只能放弃等待，已开始执行的同步函数无法被中断，会继续占用线程 (或子进程) 直到返回，
+        期间计入 procurator_task_pool_abandoned；可能长时间卡住的同步处理函数应自行设置 I/O 超时
+        """
+        submitted = time.time()
+        future = self._get_pool(kind).submit(_timed_call, func, data)
+        try:
+            started, finished, result, error = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # 尚在排队的调用直接取消；已在执行的只能任其运行结束
+            if not future.cancel():
+                TASK_POOL_ABANDONED.labels(pool=kind).inc()
+                future.add_done_callback(lambda _: TASK_POOL_ABANDONED.labels(pool=kind).dec())
+                logger.warning(f"Sync handler of {task_name} keeps running in the {kind} pool after cancellation")
+            raise
+
+        TASK_POOL_WAIT_SECONDS.labels(pool=kind, task_name=task_name).observe(max(0.0, started - submitted))
+        TASK_POOL_EXEC_SECONDS.labels(pool=kind, task_name=task_name).observe(max(0.0, finished - started))
+
+        if error is not None:
+            raise error
+        return result
+
+    def shutdown(self):
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown(wait=False, cancel_futures=True)
+            self._thread_pool = None
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            self._process_pool = None
+
+
+executors = TaskExecutors()
+
+
+class PoolSaturatedError(Exception):
+    """
+    同步分发池已满 (排队人数达到上限或排队超时)
+    """
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"sync dispatch pool saturated ({reason})")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class SyncDispatchPool:
+    """
+    /dispatch 同步执行 (async=false) 的独立并发池
+    - 最多 SYNC_DISPATCH_CONCURRENCY 个同步任务同时执行，避免突发的慢任务拖垮同一事件循环上的其他接口
+    - 排队人数达到 SYNC_DISPATCH_MAX_QUEUE 时立即拒绝，排队超过 SYNC_DISPATCH_QUEUE_TIMEOUT 秒时拒绝
+    """
+
+    def __init__(self):
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop = None
+        self._waiting = 0
+
+    @staticmethod
+    def size() -> int:
+        return int(config.get("SYNC_DISPATCH_CONCURRENCY", 16))
+
+    @staticmethod
+    def max_queue() -> int:
+        return int(config.get("SYNC_DISPATCH_MAX_QUEUE", 64))
+
+    @staticmethod
+    def queue_timeout() -> float:
+        return float(config.get("SYNC_DISPATCH_QUEUE_TIMEOUT", 1.0))
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # 信号量绑定事件循环，循环变化 (测试 / 重启) 时重建
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.size())
+            self._loop = loop
+        return self._semaphore
+
+    async def acquire(self, task_name: str = "unknown"):
+        """
+        获取执行槽位，池满时抛出 PoolSaturatedError (调用方返回 503)
+        """
+        semaphore = self._get_semaphore()
+        timeout = self.queue_timeout()
+        if semaphore.locked() and self._waiting >= self.max_queue():
+            SYNC_DISPATCH_REJECTED_TOTAL.labels(task_name=task_name, reason="queue_full").inc()
+            raise PoolSaturatedError("queue_full", timeout)
+
+        self._waiting += 1
+        SYNC_DISPATCH_WAITING.set(self._waiting)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=timeout)
+        except asyncio.TimeoutError:
+            SYNC_DISPATCH_REJECTED_TOTAL.labels(task_name=task_name, reason="queue_timeout").inc()
+            raise PoolSaturatedError("queue_timeout", timeout)
+        finally:
+            self._waiting -= 1
+            SYNC_DISPATCH_WAITING.set(self._waiting)
+
+        SYNC_DISPATCH_QUEUE_SECONDS.observe(time.perf_counter() - started)
+        SYNC_DISPATCH_INFLIGHT.inc()
+
+    def release(self):
+        SYNC_DISPATCH_INFLIGHT.dec()
+        self._semaphore.release()
+
+
+sync_dispatch_pool = SyncDispatchPool()
@@ -16,6 +16,36 @@ TASK_QUEUE_SIZE = Gauge(
     ["queue"]
 )
 
+TASK_DEDUPE_TOTAL = Counter(
+    "procurator_task_dedupe_total",
+    "Idempotency key lookups on dispatch (hit = duplicate request, miss = new task, error = store unavailable)",
+    ["task_name", "result"]
+)
+
+RESULT_CACHE_TOTAL = Counter(
+    "procurator_result_cache_total",
+    "Task result cache lookups on dispatch (hit_l1 / hit_l2 / miss)",
+    ["task_name", "result"]
+)
+
+WEBHOOK_CONFIG_CACHE_TOTAL = Counter(
+    "procurator_webhook_config_cache_total",
+    "Webhook config snapshot lookups on dispatch (hit / negative_hit / reload)",
+    ["result"]
+)
+
+ADMISSION_REJECTED_TOTAL = Counter(
+    "procurator_admission_rejected_total",
+    "Async /dispatch requests shed by queue-depth admission control (status = 429 / 503)",
+    ["queue", "priority", "status"]
+)
+
+SYNC_COALESCED_TOTAL = Counter(
+    "procurator_sync_coalesced_total",
+    "Sync dispatch single-flight calls (leader = executed, follower = shared an in-flight execution)",
+    ["task_name", "role"]
+)
+
 # 2. 任务执行指标
 TASK_STARTED_TOTAL = Counter(
     "procurator_task_started_total",
@@ -35,6 +65,24 @@ TASK_FAILED_TOTAL = Counter(
     ["queue", "task_name", "error_type"]
 )
 
+TASK_RETRIED_TOTAL = Counter(
+    "procurator_task_retried_total",
+    "Total number of failed tasks requeued for another attempt (retry_count < max_retries)",
+    ["queue", "task_name"]
+)
+
+TASK_TIMEOUT_TOTAL = Counter(
+    "procurator_task_timeout_total",
+    "Total number of tasks that exceeded their execution timeout",
+    ["queue", "task_name"]
+)
+
+TASK_CANCELLED_TOTAL = Counter(
+    "procurator_task_cancelled_total",
+    "Total number of tasks cancelled, by stage (pending/running)",
+    ["queue", "task_name", "stage"]
+)
+
 TASK_EXECUTION_SECONDS = Histogram(
     "procurator_task_execution_seconds",
     "Time spent executing task scripts",
@@ -42,7 +90,143 @@ TASK_EXECUTION_SECONDS = Histogram(
     buckets=(1, 5, 10, 30, 60, 120, 300, 600, float("inf"))
 )
 
-# 3. HTTP 指标 (可选，FastAPI 通常有中间件，这里先只做业务指标)
+TASK_POOL_WAIT_SECONDS = Histogram(
+    "procurator_task_pool_wait_seconds",
+    "Time sync task handlers spent waiting for a thread/process pool slot",
+    ["pool", "task_name"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, float("inf"))
+)
+
+TASK_POOL_EXEC_SECONDS = Histogram(
+    "procurator_task_pool_exec_seconds",
+    "Time sync task handlers spent executing inside a thread/process pool",
+    ["pool", "task_name"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, float("inf"))
+)
+
+TASK_POOL_ABANDONED = Gauge(
+    "procurator_task_pool_abandoned",
+    "Sync task handler calls still occupying a pool slot after their task timed out or was cancelled",
+    ["pool"]
+)
+
+SYNC_DISPATCH_INFLIGHT = Gauge(
+    "procurator_sync_dispatch_inflight",
+    "Sync /dispatch executions currently holding a pool slot"
+)
+
+SYNC_DISPATCH_WAITING = Gauge(
+    "procurator_sync_dispatch_waiting",
+    "Sync /dispatch requests waiting for a pool slot"
+)
+
+SYNC_DISPATCH_QUEUE_SECONDS = Histogram(
+    "procurator_sync_dispatch_queue_seconds",
+    "Time sync /dispatch requests waited for a pool slot",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, float("inf"))
+)
+
+SYNC_DISPATCH_REJECTED_TOTAL = Counter(
+    "procurator_sync_dispatch_rejected_total",
+    "Sync /dispatch requests rejected with 503 because the pool was saturated",
+    ["task_name", "reason"]
+)
+
+# 3. Worker 生命周期指标
+WORKER_DRAIN_SECONDS = Histogram(
+    "procurator_worker_drain_seconds",
+    "Time spent draining in-flight tasks on worker shutdown",
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, float("inf"))
+)
+
+WORKER_DRAIN_RELEASED_TOTAL = Counter(
+    "procurator_worker_drain_released_total",
+    "Total number of messages released back to the queue during drain",
+    ["queue"]
+)
+
+# 4. 持久化指标
+TASK_PERSIST_FLUSH_SECONDS = Histogram(
+    "procurator_task_persist_flush_seconds",
+    "Time spent writing one batch of task lifecycle events to the database",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, float("inf"))
+)
+
+TASK_PERSIST_BATCH_SIZE = Histogram(
+    "procurator_task_persist_batch_size",
+    "Number of coalesced task rows per persistence flush",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, float("inf"))
+)
+
+TASK_PERSIST_BUFFERED = Gauge(
+    "procurator_task_persist_buffered",
+    "Task rows waiting in the write-behind buffer"
+)
+
+TASK_PERSIST_BACKPRESSURE_TOTAL = Counter(
+    "procurator_task_persist_backpressure_total",
+    "Times a producer waited because the write-behind buffer was full"
+)
+
+# 5. HTTP 指标 (可选，FastAPI 通常有中间件，这里先只做业务指标)
+HTTP_CLIENT_CONNECTIONS_TOTAL = Counter(
+    "procurator_http_client_connections_total",
+    "Outbound requests of the shared HTTP client by connection used (new = fresh TCP/TLS handshake, reused = keep-alive)",
+    ["result"]
+)
+
+HTTP_CLIENT_POOL_WAIT_SECONDS = Histogram(
+    "procurator_http_client_pool_wait_seconds",
+    "Time an outbound request waited for a per-host slot and a pooled connection",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+
+HTTP_CLIENT_RESPONSE_BYTES_TOTAL = Counter(
+    "procurator_http_client_response_bytes_total",
+    "Outbound response body bytes (received = read from the stream, discarded = read beyond the byte cap and dropped)",
+    ["kind"]
+)
+
+HTTP_CLIENT_RESPONSE_ABORTED_TOTAL = Counter(
+    "procurator_http_client_response_aborted_total",
+    "Outbound responses whose body stream was aborted early after exceeding the byte cap"
+)
+
+HTTP_CACHE_TOTAL = Counter(
+    "procurator_http_cache_total",
+    "Shared HTTP response cache lookups for proxied GET/HEAD requests (hit / revalidated = 304 reused cached body / miss)",
+    ["result"]
+)
+
+CIRCUIT_STATE = Gauge(
+    "procurator_circuit_state",
+    "Circuit breaker state per downstream host (0 = closed, 1 = open, 2 = half_open)",
+    ["host"]
+)
+
+CIRCUIT_TRANSITIONS_TOTAL = Counter(
+    "procurator_circuit_transitions_total",
+    "Circuit breaker state transitions per downstream host",
+    ["host", "state"]
+)
+
+CIRCUIT_REJECTED_TOTAL = Counter(
+    "procurator_circuit_rejected_total",
+    "Outbound requests failed fast because the host's circuit was open",
+    ["host"]
+)
+
+PROXY_RETRIES_TOTAL = Counter(
+    "procurator_proxy_retries_total",
+    "Outbound proxy request retries (retried / budget_exhausted = skipped because the retry budget was empty)",
+    ["result"]
+)
+
+PROXY_HEDGES_TOTAL = Counter(
+    "procurator_proxy_hedges_total",
+    "Hedged GET/HEAD proxy requests (sent / won = hedge answered first / budget_exhausted)",
+    ["result"]
+)
 
 def get_metrics_data():
     """
@@ -1,4 +1,5 @@
 import redis
+import redis.asyncio as aioredis
 from app.core.config import config
 from app.core.log_utils import get_logger
 
@@ -6,6 +7,7 @@ logger = get_logger("redis")
 
 class RedisClient:
     _pool = None
+    _async_pool = None
 
     @classmethod
     def get_client(cls):
@@ -24,6 +26,28 @@ class RedisClient:
                 raise
         return redis.Redis(connection_pool=cls._pool)
 
+    @classmethod
+    def get_async_client(cls):
+        """
+        异步客户端：用于 Worker 的阻塞读取 (XREADGROUP BLOCK)
+        不设置 socket_timeout，阻塞时长完全由 BLOCK 参数控制
+        """
+        if cls._async_pool is None:
+            redis_url = config.get("REDIS_URL", "redis://localhost:6379/0")
+            try:
+                cls._async_pool = aioredis.ConnectionPool.from_url(
+                    redis_url,
+                    decode_responses=True,
+                    socket_connect_timeout=3,
+                    socket_timeout=None,
+                    socket_keepalive=True
+                )
+                logger.info(f"Redis async pool initialized: {redis_url}")
+            except Exception as e:
+                logger.error(f"Failed to initialize Redis async pool: {e}")
+                raise
+        return aioredis.Redis(connection_pool=cls._async_pool)
+
     @classmethod
     def get(cls, key):
         try:
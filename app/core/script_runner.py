@@ -4,8 +4,13 @@ import os
 import shutil
 import uuid
 from pathlib import Path
+from typing import Any, Dict
+from typing_extensions import Annotated
+from pydantic import BaseModel, ConfigDict, StringConstraints
 from app.core.config import config
+from app.core.validation import input_schema
 from app.core.log_utils import get_logger
+from app.queues.control import current_task_id
 
 logger = get_logger("script_runner")
 
@@ -20,6 +25,12 @@ class ScriptRunner:
         # 超时时间
         self.timeout = int(config.get("SCRIPT_TIMEOUT_SECONDS", 300))
         
+        # 取消时 SIGTERM 后等待子进程退出的宽限时间
+        self.cancel_grace = float(config.get("SCRIPT_CANCEL_GRACE_SECONDS", 5))
+
+        # 执行中的子进程: 队列任务 ID -> Popen (用于取消)
+        self._processes = {}
+        
         # 临时目录根路径
         self.temp_root = Path(__file__).parent.parent.parent / "data" / "temp_scripts"
         self.temp_root.mkdir(parents=True, exist_ok=True)
@@ -36,6 +47,8 @@ class ScriptRunner:
         """
         task_id = str(uuid.uuid4())
         work_dir = self.temp_root / task_id
+        # 关联到队列任务 ID，取消任务时据此找到子进程
+        owner = current_task_id.get() or task_id
         
         # 1. 申请信号量
         async with self.semaphore:
@@ -92,6 +105,7 @@ class ScriptRunner:
                             # Windows 下不设置 close_fds=True 可能导致文件句柄继承问题
                             # 但在重定向到文件时通常不需要
                         )
+                        self._processes[owner] = process
                         
                         try:
                             exit_code = process.wait(timeout=self.timeout)
@@ -130,9 +144,14 @@ class ScriptRunner:
                 except TimeoutError as e:
                     logger.error(str(e))
                     raise Exception(str(e))
+                except asyncio.CancelledError:
+                    # 协作式取消：先 SIGTERM，宽限期内未退出再强制 kill
+                    await self._terminate(owner)
+                    raise
 
 
             finally:
+                self._processes.pop(owner, None)
                 # 7. 清理工作空间
                 if work_dir.exists():
                     try:
@@ -141,8 +160,46 @@ class ScriptRunner:
                     except Exception as e:
                         logger.error(f"Failed to clean work dir: {e}")
 
+    def kill(self, owner: str) -> bool:
+        """
+        强制结束任务对应的脚本子进程 (强制取消)
+        """
+        process = self._processes.get(owner)
+        if process is None or process.poll() is not None:
+            return False
+        process.kill()
+        logger.warning(f"Killed script process {process.pid} of task {owner}")
+        return True
+
+    async def _terminate(self, owner: str):
+        process = self._processes.get(owner)
+        if process is None or process.poll() is not None:
+            return
+        logger.warning(f"Terminating script process {process.pid} of task {owner}")
+        process.terminate()
+        try:
+            await asyncio.to_thread(process.wait, self.cancel_grace)
+        except Exception:
+            self.kill(owner)
+
 # 导出便捷函数
 import sys
+
+
+class ExecuteScriptInput(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    # 仅允许 scripts 目录下的脚本名，拒绝路径穿越
+    script_name: Annotated[str, StringConstraints(pattern=r"^[A-Za-z0-9_\-]+$")]
+    args: Dict[str, Any] = {}
+
+
+def warmup():
+    # Worker 启动时创建 ScriptRunner 单例 (并发信号量与临时目录)，build_dispatch_table 调用
+    ScriptRunner.get_instance()
+
+
+@input_schema(ExecuteScriptInput)
 async def execute_script(data: dict):
     runner = ScriptRunner.get_instance()
     script_name = data.get("script_name")
@@ -0,0 +1,44 @@
+import json
+from decimal import Decimal
+from typing import Any
+from pydantic import BaseModel
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - requirements.txt 中已固定 orjson，缺失时退回标准库
+    orjson = None
+
+
+def json_default(obj: Any) -> Any:
+    """
+    序列化器遇到非原生类型时的回调 (只在这些对象上调用，不遍历整个结构)
+    - Pydantic 模型：model_dump(mode="json")
+    - HttpUrl / UUID 等其余对象：str()，与旧的 to_json_compatible 行为一致
+    """
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, bytes):
+        return obj.decode("utf-8", errors="replace")
+    if isinstance(obj, Decimal):
+        return float(obj)
+    return str(obj)
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=json_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=json_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    基于 orjson 的 JSON 响应
+    作为应用的默认响应类；大结果的接口 (/dispatch、/task/{tid}/detail) 直接返回该响应，
+    跳过 FastAPI 对返回值的 jsonable_encoder 递归转换
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,19 @@
+from typing import Callable, Optional, Type
+from pydantic import BaseModel
+
+
+def input_schema(model: Type[BaseModel]) -> Callable:
+    """
+    为任务处理函数登记 taskData 的输入模型 (Pydantic)，在 /dispatch 入队前校验
+    用法：
+        @input_schema(ProxyForwardInput)
+        async def proxy_forward(data: dict): ...
+    """
+    def decorator(func: Callable) -> Callable:
+        func.__procurator_input_schema__ = model
+        return func
+    return decorator
+
+
+def resolve_input_schema(func: Callable) -> Optional[Type[BaseModel]]:
+    return getattr(func, "__procurator_input_schema__", None)
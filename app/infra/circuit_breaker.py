@@ -0,0 +1,188 @@
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Set, Tuple
+from app.core.config import config
+from app.core.metrics import CIRCUIT_STATE, CIRCUIT_TRANSITIONS_TOTAL, CIRCUIT_REJECTED_TOTAL
+from app.queues.control import control_bus
+from app.core.log_utils import get_logger
+
+logger = get_logger("circuit_breaker")
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+_STATE_VALUES = {STATE_CLOSED: 0, STATE_OPEN: 1, STATE_HALF_OPEN: 2}
+
+# 控制通道消息：某个主机的熔断器打开 / 恢复，所有进程同步状态
+CIRCUIT_OPENED_ACTION = "circuit_opened"
+CIRCUIT_CLOSED_ACTION = "circuit_closed"
+
+# 进行中的广播任务：保留引用，避免执行中被垃圾回收
+_broadcasts: Set[asyncio.Task] = set()
+
+
+class CircuitOpenError(Exception):
+    """
+    目标主机熔断中，请求未发出
+    """
+
+    def __init__(self, host: str, retry_after: float):
+        super().__init__(f"circuit open for {host}, retry after {retry_after:.1f}s")
+        self.host = host
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    单个目标主机的熔断器
+    - closed: 正常放行，记录滚动窗口 (CIRCUIT_WINDOW_SECONDS) 内的结果与耗时；
+      窗口内请求数达到 CIRCUIT_MIN_REQUESTS 且错误率或慢请求率超过阈值时打开
+    - open: 直接拒绝 (CircuitOpenError)，CIRCUIT_OPEN_SECONDS 后进入 half_open
+    - half_open: 放行最多 CIRCUIT_HALF_OPEN_PROBES 个探测请求，成功则关闭，失败则重新打开
+    """
+
+    def __init__(self, host: str):
+        self.host = host
+        self.state = STATE_CLOSED
+        self.open_until = 0.0
+        self._probes = 0
+        # (时间, 是否成功, 是否慢请求)
+        self._window: Deque[Tuple[float, bool, bool]] = deque()
+
+    def before(self) -> bool:
+        """
+        请求发出前调用；熔断中抛出 CircuitOpenError
+        返回本次请求是否为 half_open 探测 (结束时需传回 record / release)
+        """
+        now = time.monotonic()
+        if self.state == STATE_OPEN:
+            if now < self.open_until:
+                CIRCUIT_REJECTED_TOTAL.labels(host=self.host).inc()
+                raise CircuitOpenError(self.host, self.open_until - now)
+            self._transition(STATE_HALF_OPEN)
+
+        if self.state == STATE_HALF_OPEN:
+            if self._probes >= int(config.get("CIRCUIT_HALF_OPEN_PROBES", 1)):
+                CIRCUIT_REJECTED_TOTAL.labels(host=self.host).inc()
+                raise CircuitOpenError(self.host, 1.0)
+            self._probes += 1
+            return True
+        return False
+
+    def release(self, probe: bool):
+        """
+        请求被取消 (没有结果) 时归还探测名额
+        """
+        if probe:
+            self._probes = max(0, self._probes - 1)
+
+    def record(self, ok: bool, latency: float, probe: bool = False):
+        self.release(probe)
+        if self.state == STATE_HALF_OPEN and probe:
+            if ok:
+                self._close()
+            else:
+                self._open()
+            return
+        if self.state != STATE_CLOSED:
+            return
+
+        now = time.monotonic()
+        slow = latency >= float(config.get("CIRCUIT_SLOW_SECONDS", 5))
+        self._window.append((now, ok, slow))
+        cutoff = now - float(config.get("CIRCUIT_WINDOW_SECONDS", 30))
+        while self._window and self._window[0][0] < cutoff:
+            self._window.popleft()
+
+        total = len(self._window)
+        if total < int(config.get("CIRCUIT_MIN_REQUESTS", 10)):
+            return
+        errors = sum(1 for _, success, _ in self._window if not success)
+        slows = sum(1 for _, _, is_slow in self._window if is_slow)
+        if (errors / total >= float(config.get("CIRCUIT_ERROR_RATE", 0.5))
+                or slows / total >= float(config.get("CIRCUIT_SLOW_RATE", 0.5))):
+            logger.warning(f"Opening circuit for {self.host} ({errors}/{total} errors, {slows}/{total} slow)")
+            self._open()
+
+    def _open(self, duration: Optional[float] = None, broadcast: bool = True):
+        if duration is None:
+            duration = float(config.get("CIRCUIT_OPEN_SECONDS", 30))
+        self.open_until = time.monotonic() + duration
+        self._window.clear()
+        self._transition(STATE_OPEN)
+        if broadcast:
+            _broadcast({"action": CIRCUIT_OPENED_ACTION, "host": self.host, "until": time.time() + duration})
+
+    def _close(self, broadcast: bool = True):
+        self._window.clear()
+        self._transition(STATE_CLOSED)
+        if broadcast:
+            _broadcast({"action": CIRCUIT_CLOSED_ACTION, "host": self.host})
+
+    def _transition(self, state: str):
+        if state == self.state:
+            return
+        self.state = state
+        CIRCUIT_STATE.labels(host=self.host).set(_STATE_VALUES[state])
+        CIRCUIT_TRANSITIONS_TOTAL.labels(host=self.host, state=state).inc()
+
+
+def _broadcast(message: dict):
+    try:
+        task = asyncio.get_running_loop().create_task(control_bus.publish(message))
+    except RuntimeError:
+        return
+    _broadcasts.add(task)
+    task.add_done_callback(_on_broadcast_done)
+
+
+def _on_broadcast_done(task: asyncio.Task):
+    _broadcasts.discard(task)
+    if task.cancelled():
+        return
+    error = task.exception()
+    if error is not None:
+        logger.error(f"Failed to broadcast circuit state: {error}")
+
+
+class CircuitBreakerRegistry:
+    """
+    按目标主机管理熔断器
+    打开 / 恢复通过控制通道广播，其他进程 (API / Worker) 同步该主机的状态，无需各自积累失败
+    """
+
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        control_bus.subscribe(self._on_control)
+
+    @staticmethod
+    def active() -> bool:
+        return str(config.get("CIRCUIT_BREAKER_ENABLED", "1")).lower() not in ("0", "false", "no")
+
+    def get(self, host: str) -> CircuitBreaker:
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker(host)
+            self._breakers[host] = breaker
+        return breaker
+
+    def _on_control(self, message: dict):
+        action = message.get("action")
+        host = message.get("host")
+        if not host or action not in (CIRCUIT_OPENED_ACTION, CIRCUIT_CLOSED_ACTION):
+            return
+        breaker = self.get(host)
+        if action == CIRCUIT_OPENED_ACTION:
+            remaining = float(message.get("until") or 0) - time.time()
+            # 本进程的消息回环或已处于更晚的打开状态时忽略
+            if remaining > 0 and breaker.open_until < time.monotonic() + remaining - 0.5:
+                breaker._open(remaining, broadcast=False)
+        elif breaker.state != STATE_CLOSED:
+            breaker._close(broadcast=False)
+
+    def reset(self):
+        self._breakers.clear()
+
+
+circuit_breakers = CircuitBreakerRegistry()
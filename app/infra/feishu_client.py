@@ -10,6 +10,17 @@ logger = get_logger("feishu_client")
 # Redis Key 前缀
 REDIS_KEY_TOKEN = "feishu:tenant_access_token"
 
+# 复用到飞书开放平台的 keep-alive 连接，避免每次刷新 Token 重新握手 TLS
+_session = None
+
+
+def get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        _session = requests.Session()
+    return _session
+
+
 def get_tenant_access_token(app_id=None, app_secret=None):
     """
     获取飞书 tenant_access_token (优先查 Redis)
@@ -48,7 +59,7 @@ def get_tenant_access_token(app_id=None, app_secret=None):
     }
     
     try:
-        resp = requests.post(url, json=payload, timeout=5)
+        resp = get_session().post(url, json=payload, timeout=5)
         resp.raise_for_status()
         data = resp.json()
         if data.get("code") == 0:
@@ -0,0 +1,258 @@
+import base64
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Optional
+import httpx
+from app.core.config import config
+from app.core.redis import redis_client
+from app.core.metrics import HTTP_CACHE_TOTAL
+from app.infra.http_client import BoundedResponse
+from app.core.log_utils import get_logger
+
+logger = get_logger("http_cache")
+
+HTTP_CACHE_KEY_PREFIX = "procurator:httpcache:"
+
+CACHEABLE_METHODS = ("GET", "HEAD")
+# 缓存条目中保留的响应头 (其余响应头不影响转发结果)
+_STORED_HEADERS = ("content-type", "cache-control", "etag", "last-modified", "expires", "vary")
+
+
+def _cache_control(value: Optional[str]) -> Dict[str, Optional[str]]:
+    directives = {}
+    for part in (value or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, arg = part.partition("=")
+        directives[name.strip().lower()] = arg.strip().strip('"') or None
+    return directives
+
+
+def _freshness(headers: httpx.Headers, authorized: bool) -> Optional[float]:
+    """
+    共享缓存的新鲜期 (秒)：None 表示不可缓存，0 表示每次使用前都需要重新验证
+    按 Cache-Control (no-store / private / no-cache / s-maxage / max-age)、Expires 的顺序判定，
+    没有显式新鲜期但有校验器 (ETag / Last-Modified) 时缓存并每次重新验证
+    """
+    cc = _cache_control(headers.get("cache-control"))
+    if "no-store" in cc or "private" in cc:
+        return None
+    # 带 Authorization 的请求只有响应显式允许时才进入共享缓存
+    if authorized and not ("public" in cc or "s-maxage" in cc):
+        return None
+    has_validator = bool(headers.get("etag") or headers.get("last-modified"))
+    if "no-cache" in cc:
+        return 0.0 if has_validator else None
+
+    for directive in ("s-maxage", "max-age"):
+        if directive in cc:
+            try:
+                age = float(headers.get("age") or 0)
+                return max(0.0, float(cc[directive]) - age)
+            except (TypeError, ValueError):
+                return 0.0 if has_validator else None
+
+    if headers.get("expires"):
+        try:
+            expires = parsedate_to_datetime(headers["expires"]).timestamp()
+            date = parsedate_to_datetime(headers["date"]).timestamp() if headers.get("date") else time.time()
+            return max(0.0, expires - date)
+        except Exception:
+            # 无法解析的 Expires 视为已过期
+            return 0.0 if has_validator else None
+
+    return 0.0 if has_validator else None
+
+
+class HttpResponseCache:
+    """
+    转发任务 GET/HEAD 子请求的共享 HTTP 响应缓存
+    - 遵循 Cache-Control / Expires 的新鲜期；过期后携带 If-None-Match / If-Modified-Since 条件请求，304 时复用缓存内容
+    - 按 Vary 记录参与协商的请求头，不一致时视为未命中；Vary: * 不缓存
+    - L1: 进程内 LRU，按总字节数 (HTTP_CACHE_L1_BYTES) 淘汰；L2: Redis (仅 Redis 模式)，多 Worker 共享
+    - 只缓存完整读取 (未被字节上限截断，摘要模式下摘要完整) 的 200 响应，单条不超过 HTTP_CACHE_MAX_ENTRY_BYTES
+    """
+
+    def __init__(self):
+        self.enabled = config.get("QUEUE_BACKEND", "memory").lower() == "redis"
+        self._l1: "OrderedDict[str, dict]" = OrderedDict()
+        self._l1_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def active() -> bool:
+        return str(config.get("HTTP_CACHE_ENABLED", "1")).lower() not in ("0", "false", "no")
+
+    @staticmethod
+    def l1_bytes() -> int:
+        return int(config.get("HTTP_CACHE_L1_BYTES", 33554432))
+
+    @staticmethod
+    def max_entry_bytes() -> int:
+        return int(config.get("HTTP_CACHE_MAX_ENTRY_BYTES", 262144))
+
+    @staticmethod
+    def stale_ttl() -> int:
+        # 过期后保留多久用于条件请求重新验证
+        return int(config.get("HTTP_CACHE_STALE_TTL", 600))
+
+    @staticmethod
+    def key_for(method: str, url: str, digest: bool) -> str:
+        # 响应体读取方式 (完整 / 摘要) 不同时缓存内容不同，分别存放
+        raw = f"{method} {url} {'digest' if digest else 'body'}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def fetch(self, method: str, url: str, headers: Dict[str, str], digest: bool,
+                    send: Callable[[Dict[str, str]], Awaitable[BoundedResponse]],
+                    stats: Optional[dict] = None) -> BoundedResponse:
+        """
+        经缓存发送请求
+        url: 包含查询参数的完整 URL
+        send: 实际发送请求的回调，参数为本次请求需要追加的条件请求头
+        stats: 可选，写入缓存结果 cache = hit / revalidated / miss
+        """
+        stats = stats if stats is not None else {}
+        lower = {k.lower(): v for k, v in (headers or {}).items()}
+        request_cc = _cache_control(lower.get("cache-control"))
+        key = self.key_for(method, url, digest)
+
+        entry = None
+        if "no-cache" not in request_cc and "no-store" not in request_cc:
+            entry = await self._get(key)
+            if entry is not None and not self._vary_matches(entry, lower):
+                entry = None
+
+        conditional: Dict[str, str] = {}
+        if entry is not None:
+            if entry["expires_at"] > time.time():
+                stats["cache"] = "hit"
+                HTTP_CACHE_TOTAL.labels(result="hit").inc()
+                return self._response(entry)
+            if entry.get("etag"):
+                conditional["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                conditional["If-Modified-Since"] = entry["last_modified"]
+
+        resp = await send(conditional)
+        if resp.status_code == 304 and entry is not None:
+            # 304 的响应头刷新新鲜期与校验器，内容沿用缓存
+            merged = httpx.Headers(entry["headers"])
+            for name in _STORED_HEADERS:
+                if resp.headers.get(name):
+                    merged[name] = resp.headers[name]
+            freshness = _freshness(merged, "authorization" in lower)
+            if freshness is not None:
+                entry["headers"] = dict(merged)
+                entry["etag"] = merged.get("etag")
+                entry["last_modified"] = merged.get("last-modified")
+                entry["expires_at"] = time.time() + freshness
+                await self._put(key, entry)
+            stats["cache"] = "revalidated"
+            HTTP_CACHE_TOTAL.labels(result="revalidated").inc()
+            return self._response(entry)
+
+        stats["cache"] = "miss"
+        HTTP_CACHE_TOTAL.labels(result="miss").inc()
+        if "no-store" not in request_cc:
+            await self._store(key, resp, lower)
+        return resp
+
+    @staticmethod
+    def _vary_matches(entry: dict, request_headers: Dict[str, str]) -> bool:
+        return all(request_headers.get(name) == value for name, value in (entry.get("vary") or {}).items())
+
+    @staticmethod
+    def _response(entry: dict) -> BoundedResponse:
+        return BoundedResponse(
+            entry["status"], httpx.Headers(entry["headers"]), entry["content"], entry["size"],
+            entry.get("truncated", False), entry.get("sha256"), entry.get("encoding")
+        )
+
+    async def _store(self, key: str, resp: BoundedResponse, request_headers: Dict[str, str]):
+        if resp.status_code != 200 or len(resp.content) > self.max_entry_bytes():
+            return
+        # 截断的响应体不缓存；摘要模式只保留预览，摘要完整即可缓存
+        if resp.truncated and resp.sha256 is None:
+            return
+        freshness = _freshness(resp.headers, "authorization" in request_headers)
+        if freshness is None:
+            return
+        vary_names = [v.strip().lower() for v in (resp.headers.get("vary") or "").split(",") if v.strip()]
+        if "*" in vary_names:
+            return
+        entry = {
+            "status": resp.status_code,
+            "headers": {k: v for k, v in resp.headers.items() if k.lower() in _STORED_HEADERS},
+            "content": resp.content,
+            "size": resp.size,
+            "truncated": resp.truncated,
+            "sha256": resp.sha256,
+            "encoding": resp.encoding,
+            "etag": resp.headers.get("etag"),
+            "last_modified": resp.headers.get("last-modified"),
+            "vary": {name: request_headers.get(name) for name in vary_names},
+            "expires_at": time.time() + freshness,
+        }
+        await self._put(key, entry)
+
+    async def _get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._l1.get(key)
+            if entry is not None:
+                self._l1.move_to_end(key)
+                return entry
+
+        if not self.enabled:
+            return None
+        try:
+            raw = await redis_client.get_async_client().get(f"{HTTP_CACHE_KEY_PREFIX}{key}")
+            if raw is None:
+                return None
+            entry = json.loads(raw)
+            entry["content"] = base64.b64decode(entry["content"])
+            self._put_l1(key, entry)
+            return entry
+        except Exception as e:
+            logger.error(f"HTTP cache lookup failed: {e}")
+            return None
+
+    async def _put(self, key: str, entry: dict):
+        self._put_l1(key, entry)
+        if not self.enabled:
+            return
+        # 有校验器的条目过期后继续保留一段时间用于条件请求
+        ttl = max(0.0, entry["expires_at"] - time.time())
+        if entry.get("etag") or entry.get("last_modified"):
+            ttl += self.stale_ttl()
+        if ttl < 1:
+            return
+        try:
+            raw = json.dumps({**entry, "content": base64.b64encode(entry["content"]).decode("ascii")})
+            await redis_client.get_async_client().set(f"{HTTP_CACHE_KEY_PREFIX}{key}", raw, ex=int(ttl))
+        except Exception as e:
+            logger.error(f"HTTP cache store failed: {e}")
+
+    def _put_l1(self, key: str, entry: dict):
+        with self._lock:
+            previous = self._l1.pop(key, None)
+            if previous is not None:
+                self._l1_bytes -= len(previous["content"])
+            self._l1[key] = entry
+            self._l1_bytes += len(entry["content"])
+            # 按总字节数淘汰最久未使用的条目
+            while self._l1 and self._l1_bytes > self.l1_bytes():
+                _, evicted = self._l1.popitem(last=False)
+                self._l1_bytes -= len(evicted["content"])
+
+    def clear(self):
+        with self._lock:
+            self._l1.clear()
+            self._l1_bytes = 0
+
+
+http_response_cache = HttpResponseCache()
@@ -0,0 +1,281 @@
+import asyncio
+import hashlib
+import importlib.util
+import json
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+import httpx
+from app.core.config import config
+from app.core.metrics import (
+    HTTP_CLIENT_CONNECTIONS_TOTAL,
+    HTTP_CLIENT_POOL_WAIT_SECONDS,
+    HTTP_CLIENT_RESPONSE_BYTES_TOTAL,
+    HTTP_CLIENT_RESPONSE_ABORTED_TOTAL,
+)
+from app.core.log_utils import get_logger
+from app.infra.circuit_breaker import circuit_breakers
+
+logger = get_logger("http_client")
+
+# 每个主机保留的最近请求耗时样本数 (用于对冲请求的 p95 延迟)
+_LATENCY_SAMPLES = 200
+
+# httpcore trace 事件：请求拿到连接后的第一个事件，区分新建连接与复用 keep-alive 连接
+_NEW_CONNECTION_EVENT = "connection.connect_tcp.started"
+_REUSED_CONNECTION_EVENTS = ("http11.send_request_headers.started", "http2.send_request_headers.started")
+
+
+class PoolTimeoutError(httpx.PoolTimeout):
+    """
+    等待目标主机并发槽位 (HTTP_CLIENT_MAX_PER_HOST) 超过请求超时，请求未发出
+    """
+
+    def __init__(self, host: str, timeout: Optional[float]):
+        super().__init__(f"timed out after {timeout}s waiting for a request slot to {host}")
+        self.host = host
+
+
+class BoundedResponse:
+    """
+    按字节上限流式读取的响应：只保留前 max_bytes 字节的响应体
+    提供与 httpx.Response 一致的 status_code / headers / is_success / text / json()
+    """
+
+    def __init__(self, status_code: int, headers: httpx.Headers, content: bytes, size: int, truncated: bool,
+                 sha256: Optional[str], encoding: Optional[str] = None):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        # 实际收到的 (解压后) 字节数；提前中止时为中止前的字节数
+        self.size = size
+        self.truncated = truncated
+        self.sha256 = sha256
+        self.encoding = encoding or "utf-8"
+
+    @property
+    def is_success(self) -> bool:
+        return 200 <= self.status_code < 300
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding, errors="replace")
+
+    def json(self) -> Any:
+        if self.truncated:
+            raise ValueError("response body truncated")
+        return json.loads(self.content)
+
+
+class HttpClientPool:
+    """
+    进程内共享的出站 HTTP 连接池 (proxy_forward / proxy_multi_forward 等转发任务使用)
+    - 单个 httpx.AsyncClient：keep-alive 连接跨任务复用，避免每个任务重新握手 TCP / TLS
+    - 默认校验 TLS 证书 (HTTP_VERIFY_TLS)；默认不跟随重定向，调用方可按请求传入 follow_redirects=True
+    - 安装了 h2 且 HTTP_CLIENT_HTTP2 开启时协商 HTTP/2
+    - 总连接数 / keep-alive 连接数由 httpx Limits 限制，单个目标主机的并发由 HTTP_CLIENT_MAX_PER_HOST 限制
+    - 等待主机槽位的时长受请求超时 (timeout 的 pool 部分) 约束，超时抛出 PoolTimeoutError
+    - 目标主机按 app/infra/circuit_breaker.py 熔断：熔断中的主机直接抛出 CircuitOpenError，不占用连接与槽位
+    - 随 Worker 启动创建、停机关闭；httpx 客户端绑定事件循环，在其他事件循环中使用时 (脚本 / 测试) 重新创建
+    """
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._host_limits: Dict[str, asyncio.Semaphore] = {}
+        self._latencies: Dict[str, Deque[float]] = {}
+
+    @staticmethod
+    def http2_enabled() -> bool:
+        enabled = str(config.get("HTTP_CLIENT_HTTP2", "1")).lower() not in ("0", "false", "no")
+        return enabled and importlib.util.find_spec("h2") is not None
+
+    @staticmethod
+    def verify_tls() -> bool:
+        return str(config.get("HTTP_VERIFY_TLS", "1")).lower() not in ("0", "false", "no")
+
+    @staticmethod
+    def max_response_bytes() -> int:
+        return int(config.get("HTTP_CLIENT_MAX_RESPONSE_BYTES", 1048576))
+
+    @staticmethod
+    def max_digest_bytes() -> int:
+        return int(config.get("HTTP_CLIENT_MAX_DIGEST_BYTES", 67108864))
+
+    @staticmethod
+    def max_per_host() -> int:
+        return int(config.get("HTTP_CLIENT_MAX_PER_HOST", 20))
+
+    def _build(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=int(config.get("HTTP_CLIENT_MAX_CONNECTIONS", 200)),
+            max_keepalive_connections=int(config.get("HTTP_CLIENT_MAX_KEEPALIVE", 50)),
+            keepalive_expiry=float(config.get("HTTP_CLIENT_KEEPALIVE_EXPIRY", 30)),
+        )
+        http2 = self.http2_enabled()
+        verify = self.verify_tls()
+        logger.info(f"Creating shared HTTP client (http2={http2}, verify={verify}, max_connections={limits.max_connections})")
+        return httpx.AsyncClient(limits=limits, http2=http2, verify=verify, follow_redirects=False)
+
+    def start(self):
+        """
+        在当前事件循环中创建共享客户端 (幂等)
+        """
+        try:
+            self.client()
+        except RuntimeError:
+            # 不在事件循环中：首次请求时再创建
+            pass
+
+    def client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._loop is not loop:
+            self._client = self._build()
+            self._loop = loop
+            self._host_limits = {}
+        return self._client
+
+    def _host_limit(self, host: str) -> asyncio.Semaphore:
+        sem = self._host_limits.get(host)
+        if sem is None:
+            sem = asyncio.Semaphore(self.max_per_host())
+            self._host_limits[host] = sem
+        return sem
+
+    def latency_quantile(self, host: str, q: float, min_samples: int = 20) -> Optional[float]:
+        """
+        主机最近请求耗时的分位数 (秒)，样本不足时返回 None
+        """
+        samples = self._latencies.get(host)
+        if not samples or len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def _observe_latency(self, host: str, seconds: float):
+        samples = self._latencies.get(host)
+        if samples is None:
+            samples = deque(maxlen=_LATENCY_SAMPLES)
+            self._latencies[host] = samples
+        samples.append(seconds)
+
+    async def request(self, method: str, url: str, max_bytes: Optional[int] = None, digest: bool = False,
+                      **kwargs) -> BoundedResponse:
+        """
+        通过共享连接池发送请求，其余参数同 httpx.AsyncClient.request
+        响应体按流读取，只保留前 max_bytes 字节 (不超过 HTTP_CLIENT_MAX_RESPONSE_BYTES)：
+        - digest=False: 超过上限立即中止读取并关闭连接
+        - digest=True: 继续读取 (不保留) 以计算完整响应体的 sha256，最多读取 HTTP_CLIENT_MAX_DIGEST_BYTES
+        follow_redirects: 是否跟随重定向 (默认不跟随)
+        目标主机熔断中时抛出 CircuitOpenError；等待主机槽位超时抛出 PoolTimeoutError (不计入熔断统计)
+        5xx 与网络错误计入熔断统计，4xx 不计入
+        """
+        client = self.client()
+        started = time.perf_counter()
+        observed = False
+
+        async def _trace(event: str, info: dict):
+            # 只记录每个请求拿到连接时的第一个事件：等待时长 = 主机并发槽位 + 连接池排队
+            nonlocal observed
+            if observed:
+                return
+            if event == _NEW_CONNECTION_EVENT:
+                result = "new"
+            elif event in _REUSED_CONNECTION_EVENTS:
+                result = "reused"
+            else:
+                return
+            observed = True
+            HTTP_CLIENT_CONNECTIONS_TOTAL.labels(result=result).inc()
+            HTTP_CLIENT_POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+
+        follow_redirects = bool(kwargs.pop("follow_redirects", False))
+        extensions = dict(kwargs.pop("extensions", None) or {})
+        extensions["trace"] = _trace
+        host = httpx.URL(url).host
+        breaker = circuit_breakers.get(host) if circuit_breakers.active() else None
+        probe = breaker.before() if breaker else False
+        limit = self._host_limit(host)
+        # 主机槽位与 httpx 连接池共用同一个等待上限，饱和的主机不会让请求无限排队
+        slot_timeout = httpx.Timeout(kwargs.get("timeout", client.timeout)).pool
+        try:
+            await asyncio.wait_for(limit.acquire(), slot_timeout)
+        except asyncio.TimeoutError:
+            if breaker:
+                breaker.release(probe)
+            raise PoolTimeoutError(host, slot_timeout)
+        except asyncio.CancelledError:
+            if breaker:
+                breaker.release(probe)
+            raise
+        try:
+            sent = time.perf_counter()
+            try:
+                request = client.build_request(method, url, extensions=extensions, **kwargs)
+                raw = await client.send(request, stream=True, follow_redirects=follow_redirects)
+                try:
+                    resp = await self._read_bounded(raw, max_bytes, digest)
+                finally:
+                    await raw.aclose()
+            except asyncio.CancelledError:
+                if breaker:
+                    breaker.release(probe)
+                raise
+            except Exception:
+                if breaker:
+                    breaker.record(False, time.perf_counter() - sent, probe)
+                raise
+        finally:
+            limit.release()
+        elapsed = time.perf_counter() - sent
+        self._observe_latency(host, elapsed)
+        if breaker:
+            breaker.record(resp.status_code < 500, elapsed, probe)
+        return resp
+
+    async def _read_bounded(self, resp: httpx.Response, max_bytes: Optional[int], digest: bool) -> BoundedResponse:
+        limit = self.max_response_bytes()
+        if max_bytes:
+            limit = min(limit, int(max_bytes))
+        hasher = hashlib.sha256() if digest else None
+        buffer = bytearray()
+        size = discarded = 0
+        truncated = aborted = False
+
+        async for chunk in resp.aiter_bytes():
+            size += len(chunk)
+            room = limit - len(buffer)
+            if room > 0:
+                buffer += chunk[:room]
+            discarded += max(0, len(chunk) - max(room, 0))
+            if hasher is not None:
+                hasher.update(chunk)
+            if size > limit:
+                truncated = True
+                # 超过上限后不再读取：不计算摘要时立即中止，计算摘要时最多读到摘要上限
+                if hasher is None or size >= self.max_digest_bytes():
+                    aborted = True
+                    break
+
+        HTTP_CLIENT_RESPONSE_BYTES_TOTAL.labels(kind="received").inc(size)
+        if discarded:
+            HTTP_CLIENT_RESPONSE_BYTES_TOTAL.labels(kind="discarded").inc(discarded)
+        if aborted:
+            HTTP_CLIENT_RESPONSE_ABORTED_TOTAL.inc()
+        # 中止读取时摘要不完整，不返回
+        sha256 = hasher.hexdigest() if hasher is not None and not aborted else None
+        return BoundedResponse(resp.status_code, resp.headers, bytes(buffer), size, truncated, sha256,
+                               resp.charset_encoding)
+
+    async def aclose(self):
+        client, self._client = self._client, None
+        self._loop = None
+        self._host_limits = {}
+        if client is not None and not client.is_closed:
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.error(f"Failed to close shared HTTP client: {e}")
+
+
+http_client_pool = HttpClientPool()
@@ -0,0 +1,96 @@
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from app.core.config import config
+from app.core.redis import redis_client
+from app.core.log_utils import get_logger
+
+logger = get_logger("idempotency")
+
+IDEMPOTENCY_KEY_PREFIX = "procurator:idem:"
+
+# Memory 模式清理过期键的间隔 (秒)
+_SWEEP_INTERVAL = 60
+
+
+class IdempotencyStore:
+    """
+    分发幂等键：同一窗口内重复的 Idempotency-Key 返回首次入队的 task_id
+    Redis 模式下使用 SET NX EX 原子占位 (多 API 进程共享)；
+    Memory 模式下使用进程内带过期时间的字典：定期清理过期键，键数超过 IDEMPOTENCY_LOCAL_MAX_KEYS 时淘汰最早的键
+    """
+
+    def __init__(self):
+        self.enabled = config.get("QUEUE_BACKEND", "memory").lower() == "redis"
+        self._local: Dict[str, Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+
+    @staticmethod
+    def window() -> int:
+        return int(config.get("IDEMPOTENCY_TTL", 86400))
+
+    @staticmethod
+    def local_max_keys() -> int:
+        return int(config.get("IDEMPOTENCY_LOCAL_MAX_KEYS", 100000))
+
+    async def claim(self, key: str, tid: str) -> Optional[str]:
+        """
+        以 tid 占位幂等键
+        占位成功返回 None (调用方继续入队)；键已存在返回首次请求的 task_id
+        Redis 不可用时抛出原始异常，由调用方决定放行或拒绝
+        """
+        window = self.window()
+        if not self.enabled:
+            return self._claim_local(key, tid, window)
+
+        client = redis_client.get_async_client()
+        redis_key = f"{IDEMPOTENCY_KEY_PREFIX}{key}"
+        # SET NX 失败后读取原值；原值恰好在两步之间过期时重试一次
+        for _ in range(2):
+            if await client.set(redis_key, tid, nx=True, ex=window):
+                return None
+            existing = await client.get(redis_key)
+            if existing:
+                return existing
+        return None
+
+    def _claim_local(self, key: str, tid: str, window: int) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            if now - self._last_sweep > min(window, _SWEEP_INTERVAL):
+                self._local = {k: v for k, v in self._local.items() if v[1] > now}
+                self._last_sweep = now
+            entry = self._local.pop(key, None)
+            if entry and entry[1] > now:
+                self._local[key] = entry
+                return entry[0]
+            # 插入顺序即过期顺序：超过上限时从最早的键开始淘汰
+            overflow = len(self._local) + 1 - self.local_max_keys()
+            if overflow > 0:
+                for stale in list(self._local)[:overflow]:
+                    del self._local[stale]
+            self._local[key] = (tid, now + window)
+            return None
+
+    async def release(self, key: str, tid: str):
+        """
+        入队失败时释放占位 (仅当键仍属于该 tid)，允许客户端重试
+        """
+        if not self.enabled:
+            with self._lock:
+                entry = self._local.get(key)
+                if entry and entry[0] == tid:
+                    self._local.pop(key, None)
+            return
+
+        client = redis_client.get_async_client()
+        redis_key = f"{IDEMPOTENCY_KEY_PREFIX}{key}"
+        try:
+            if await client.get(redis_key) == tid:
+                await client.delete(redis_key)
+        except Exception as e:
+            logger.error(f"Failed to release idempotency key {key}: {e}")
+
+
+idempotency_store = IdempotencyStore()
@@ -0,0 +1,193 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Tuple
+from app.core.config import config
+from app.core.redis import redis_client
+from app.core.metrics import RESULT_CACHE_TOTAL
+from app.queues.control import control_bus
+from app.core.log_utils import get_logger
+
+logger = get_logger("result_cache")
+
+RESULT_KEY_PREFIX = "procurator:result:"
+
+# 控制通道消息：某个任务的缓存结果已失效，所有进程丢弃 L1 条目
+RESULT_INVALIDATED_ACTION = "result_cache_invalidated"
+
+# 不影响任务结果的分发控制字段，不参与缓存键计算
+_IGNORED_FIELDS = ("webhook", "async")
+
+
+def fingerprint(task: str, data: dict) -> str:
+    """
+    任务名 + 规范化 taskData (键排序、忽略分发控制字段) 的 sha256
+    """
+    normalized = {k: v for k, v in data.items() if k not in _IGNORED_FIELDS}
+    raw = json.dumps(normalized, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(f"{task}\n{raw}".encode("utf-8")).hexdigest()
+
+
+def cacheable(ttl: int, when: Optional[Callable[[dict], bool]] = None,
+              on_hit: Optional[Callable[[Any, float], Any]] = None) -> Callable:
+    """
+    为确定性任务的处理函数开启结果缓存 (按任务名 + 规范化 taskData 命中)
+    when: 可选判定函数，返回 False 的 taskData 不缓存 (例如包含非 GET 请求的转发)
+    on_hit: 可选，命中时以 (缓存结果, 已缓存秒数) 调用，返回值作为本次结果 (例如扣减剩余有效期)
+    用法：
+        @cacheable(ttl=60)
+        async def get_token(data: dict): ...
+    """
+    def decorator(func: Callable) -> Callable:
+        func.__procurator_cache__ = {"ttl": int(ttl), "when": when, "on_hit": on_hit}
+        return func
+    return decorator
+
+
+def resolve_cache_policy(func: Callable) -> Optional[dict]:
+    return getattr(func, "__procurator_cache__", None)
+
+
+class ResultCache:
+    """
+    任务结果缓存
+    - L1: 进程内有界 LRU (RESULT_CACHE_L1_SIZE)，按条目 TTL 过期
+    - L2: Redis (仅 Redis 模式)，多进程 / 多 Worker 共享
+    同步与异步分发在入队前查询，命中时直接返回，不占用 Worker 执行槽位；
+    同步执行与 Worker 执行成功后写入；任务依赖的外部状态变化时通过 invalidate 丢弃 (广播到所有进程)
+    """
+
+    def __init__(self):
+        self.enabled = config.get("QUEUE_BACKEND", "memory").lower() == "redis"
+        self._l1: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        control_bus.subscribe(self._on_control)
+
+    @staticmethod
+    def active() -> bool:
+        return str(config.get("RESULT_CACHE_ENABLED", "1")).lower() not in ("0", "false", "no")
+
+    @staticmethod
+    def l1_size() -> int:
+        return int(config.get("RESULT_CACHE_L1_SIZE", 1024))
+
+    def key_for(self, task: str, data: dict, policy: Optional[dict]) -> Optional[str]:
+        """
+        计算缓存键；任务未开启缓存或 taskData 不满足判定函数时返回 None
+        """
+        if not policy or not self.active() or not isinstance(data, dict):
+            return None
+        when = policy.get("when")
+        if when is not None:
+            try:
+                if not when(data):
+                    return None
+            except Exception:
+                return None
+        return f"{task}:{fingerprint(task, data)}"
+
+    async def get(self, task: str, key: str, policy: Optional[dict] = None) -> Tuple[bool, Any]:
+        """
+        返回 (是否命中, 结果)；policy 带 on_hit 时命中结果经其修正
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._l1.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._l1.move_to_end(key)
+                    RESULT_CACHE_TOTAL.labels(task_name=task, result="hit_l1").inc()
+                    return True, self._on_hit(policy, entry[1], entry[0] - now)
+                self._l1.pop(key, None)
+
+        if self.enabled:
+            try:
+                client = redis_client.get_async_client()
+                pipeline = client.pipeline(transaction=False)
+                pipeline.get(f"{RESULT_KEY_PREFIX}{key}")
+                pipeline.ttl(f"{RESULT_KEY_PREFIX}{key}")
+                raw, ttl = await pipeline.execute()
+                if raw is not None:
+                    value = json.loads(raw)
+                    # 回填 L1，过期时间与 Redis 剩余 TTL 对齐
+                    if ttl and ttl > 0:
+                        self._put_l1(key, value, now + ttl)
+                    RESULT_CACHE_TOTAL.labels(task_name=task, result="hit_l2").inc()
+                    return True, self._on_hit(policy, value, ttl if ttl and ttl > 0 else None)
+            except Exception as e:
+                logger.error(f"Result cache lookup failed for {task}: {e}")
+
+        RESULT_CACHE_TOTAL.labels(task_name=task, result="miss").inc()
+        return False, None
+
+    async def set(self, task: str, key: str, value: Any, ttl: int):
+        try:
+            raw = json.dumps(value, default=str)
+        except Exception as e:
+            logger.warning(f"Result of {task} is not cacheable: {e}")
+            return
+        # 经过 JSON 往返，保证 L1 与 L2 命中返回相同的结构
+        self._put_l1(key, json.loads(raw), time.time() + ttl)
+        if self.enabled:
+            try:
+                await redis_client.get_async_client().set(f"{RESULT_KEY_PREFIX}{key}", raw, ex=ttl)
+            except Exception as e:
+                logger.error(f"Result cache store failed for {task}: {e}")
+
+    def _put_l1(self, key: str, value: Any, expires_at: float):
+        with self._lock:
+            self._l1[key] = (expires_at, value)
+            self._l1.move_to_end(key)
+            while len(self._l1) > self.l1_size():
+                self._l1.popitem(last=False)
+
+    @staticmethod
+    def _on_hit(policy: Optional[dict], value: Any, remaining: Optional[float]) -> Any:
+        hook = (policy or {}).get("on_hit")
+        if hook is None:
+            return value
+        # 已缓存秒数 = 写入时的 TTL - 剩余 TTL；剩余 TTL 未知时按已缓存满 TTL 处理
+        age = policy["ttl"] - remaining if remaining is not None else policy["ttl"]
+        try:
+            return hook(value, max(0.0, age))
+        except Exception as e:
+            logger.error(f"Result cache hit hook failed: {e}")
+            return value
+
+    def _drop_l1(self, task: str):
+        prefix = f"{task}:"
+        with self._lock:
+            for key in [k for k in self._l1 if k.startswith(prefix)]:
+                del self._l1[key]
+
+    def _on_control(self, message: dict):
+        if message.get("action") == RESULT_INVALIDATED_ACTION and message.get("task"):
+            self._drop_l1(message["task"])
+
+    async def invalidate(self, task: str):
+        """
+        丢弃任务的全部缓存结果 (L1 + Redis)，并通知其他进程丢弃各自的 L1
+        任务结果依赖的外部状态变化时调用 (例如 set_token 更新了凭证 / 手动 Token)
+        """
+        self._drop_l1(task)
+        if self.enabled:
+            try:
+                client = redis_client.get_async_client()
+                keys = [key async for key in client.scan_iter(match=f"{RESULT_KEY_PREFIX}{task}:*", count=500)]
+                if keys:
+                    await client.delete(*keys)
+            except Exception as e:
+                logger.error(f"Result cache invalidation failed for {task}: {e}")
+        try:
+            await control_bus.publish({"action": RESULT_INVALIDATED_ACTION, "task": task})
+        except Exception as e:
+            logger.error(f"Failed to broadcast result cache invalidation for {task}: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._l1.clear()
+
+
+result_cache = ResultCache()
@@ -0,0 +1,161 @@
+import asyncio
+import random
+import time
+from typing import Optional
+import httpx
+from app.core.config import config
+from app.core.metrics import PROXY_RETRIES_TOTAL, PROXY_HEDGES_TOTAL
+from app.infra.circuit_breaker import CircuitOpenError
+from app.infra.http_client import http_client_pool, BoundedResponse
+
+# 幂等方法：任何瞬时失败都可以重试
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+# 只对只读方法发送对冲请求
+HEDGE_METHODS = ("GET", "HEAD")
+# 视为瞬时失败、可以重试的状态码
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+class RetryBudget:
+    """
+    进程内的重试预算 (令牌桶)，限制重试 / 对冲请求占全部请求的比例，避免故障期间重试放大负载
+    - 每个首次请求存入 RETRY_BUDGET_RATIO 个令牌
+    - 另按 RETRY_BUDGET_MIN_PER_SECOND 匀速补充，保证低流量时也能重试
+    - 令牌上限 RETRY_BUDGET_MAX；每次重试 / 对冲消耗 1 个令牌，不足时放弃重试
+    """
+
+    def __init__(self):
+        self._tokens: Optional[float] = None
+        self._updated = time.monotonic()
+
+    @staticmethod
+    def capacity() -> float:
+        return float(config.get("RETRY_BUDGET_MAX", 100))
+
+    def _refill(self):
+        now = time.monotonic()
+        if self._tokens is None:
+            self._tokens = min(self.capacity(), 10.0)
+        rate = float(config.get("RETRY_BUDGET_MIN_PER_SECOND", 1))
+        self._tokens = min(self.capacity(), self._tokens + (now - self._updated) * rate)
+        self._updated = now
+
+    def deposit(self):
+        self._refill()
+        self._tokens = min(self.capacity(), self._tokens + float(config.get("RETRY_BUDGET_RATIO", 0.1)))
+
+    def withdraw(self) -> bool:
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+
+retry_budget = RetryBudget()
+
+
+def _backoff(attempt: int) -> float:
+    base = float(config.get("PROXY_RETRY_BACKOFF", 0.1))
+    # 指数退避 + 全抖动
+    return random.uniform(0, min(base * (2 ** (attempt - 1)), 2.0))
+
+
+def hedge_delay(host: str) -> float:
+    """
+    对冲请求的发送延迟：该主机最近请求耗时的 p95，样本不足时使用 PROXY_HEDGE_DEFAULT_DELAY
+    """
+    p95 = http_client_pool.latency_quantile(host, 0.95)
+    if p95 is None:
+        p95 = float(config.get("PROXY_HEDGE_DEFAULT_DELAY", 0.5))
+    return max(p95, float(config.get("PROXY_HEDGE_MIN_DELAY", 0.02)))
+
+
+async def _hedged(method: str, url: str, stats: dict, **kwargs) -> BoundedResponse:
+    """
+    先发送主请求；超过 p95 延迟仍未返回时 (且重试预算允许) 再发送一个对冲请求，取先成功的响应
+    """
+    primary = asyncio.ensure_future(http_client_pool.request(method, url, **kwargs))
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=hedge_delay(httpx.URL(url).host))
+    except asyncio.CancelledError:
+        # asyncio.wait 被取消时不会取消等待的任务 (例如转发截止时间到期)：取消主请求，避免遗留孤儿请求
+        primary.cancel()
+        await asyncio.gather(primary, return_exceptions=True)
+        raise
+    if done:
+        return primary.result()
+    if not retry_budget.withdraw():
+        PROXY_HEDGES_TOTAL.labels(result="budget_exhausted").inc()
+        return await primary
+
+    PROXY_HEDGES_TOTAL.labels(result="sent").inc()
+    stats["hedged"] = True
+    backup = asyncio.ensure_future(http_client_pool.request(method, url, **kwargs))
+    pending = {primary, backup}
+    finished = []
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for job in done:
+                if job.exception() is None and job.result().status_code < 500:
+                    if job is backup:
+                        PROXY_HEDGES_TOTAL.labels(result="won").inc()
+                    return job.result()
+                finished.append(job)
+    finally:
+        # 取消落后的请求，释放连接与主机槽位
+        for job in pending:
+            job.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    # 两个请求都失败：优先返回有响应的结果，否则抛出主请求的异常
+    for job in finished:
+        if job.exception() is None:
+            return job.result()
+    raise primary.exception()
+
+
+async def request_with_policy(method: str, url: str, retries: int = 0, hedge: bool = False,
+                              stats: Optional[dict] = None, **kwargs) -> BoundedResponse:
+    """
+    按重试 / 对冲策略发送请求，参数同 http_client_pool.request
+    - retries: 首次请求之外的最大重试次数。幂等方法在网络错误、超时与 429/502/503/504 时重试；
+      非幂等方法只在连接失败 (请求未发出) 时重试
+    - hedge: 对 GET/HEAD 开启对冲请求
+    - stats: 可选，写入实际的 attempts 次数与是否发送了对冲请求 (hedged)
+    熔断中的主机 (CircuitOpenError) 不重试
+    """
+    stats = stats if stats is not None else {}
+    stats["attempts"] = 0
+    idempotent = method in IDEMPOTENT_METHODS
+    retry_budget.deposit()
+
+    while True:
+        stats["attempts"] += 1
+        resp, error = None, None
+        try:
+            if hedge and method in HEDGE_METHODS:
+                resp = await _hedged(method, url, stats, **kwargs)
+            else:
+                resp = await http_client_pool.request(method, url, **kwargs)
+            retryable = idempotent and resp.status_code in RETRY_STATUSES
+        except CircuitOpenError:
+            raise
+        except httpx.TransportError as e:
+            error = e
+            retryable = idempotent or isinstance(e, httpx.ConnectError)
+
+        if not retryable or stats["attempts"] > retries:
+            if error is not None:
+                raise error
+            return resp
+        if not retry_budget.withdraw():
+            PROXY_RETRIES_TOTAL.labels(result="budget_exhausted").inc()
+            if error is not None:
+                raise error
+            return resp
+
+        PROXY_RETRIES_TOTAL.labels(result="retried").inc()
+        await asyncio.sleep(_backoff(stats["attempts"]))
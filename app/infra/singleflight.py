@@ -0,0 +1,47 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+from app.core.metrics import SYNC_COALESCED_TOTAL
+
+
+def coalesce(func: Callable) -> Callable:
+    """
+    为任务处理函数开启同步分发的请求合并 (single-flight)：
+    同一进程内并发的相同请求 (任务名 + 规范化 taskData) 共享一次执行及其结果
+    """
+    func.__procurator_singleflight__ = True
+    return func
+
+
+def resolve_coalesce(func: Callable) -> bool:
+    return bool(getattr(func, "__procurator_singleflight__", False))
+
+
+class SingleFlight:
+    """
+    进程内 single-flight：同一 key 同时只有一次执行在途，后到的调用等待同一结果
+    执行放在独立的 Task 中，发起方 (leader) 断开连接不会取消其他调用方共享的执行
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]], task_name: str = "unknown") -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            call = asyncio.ensure_future(fn())
+            self._calls[key] = call
+            call.add_done_callback(lambda t: self._forget(key, t))
+            SYNC_COALESCED_TOTAL.labels(task_name=task_name, role="leader").inc()
+        else:
+            SYNC_COALESCED_TOTAL.labels(task_name=task_name, role="follower").inc()
+        return await asyncio.shield(call)
+
+    def _forget(self, key: str, call: asyncio.Task):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def inflight(self) -> int:
+        return len(self._calls)
+
+
+singleflight = SingleFlight()
@@ -0,0 +1,98 @@
+import json
+import time
+from typing import Dict, List, Optional, Set
+from app.core.config import config
+from app.core.redis import redis_client
+from app.core.log_utils import get_logger
+
+logger = get_logger("worker_registry")
+
+# Redis Key: 每个 Worker 一个带 TTL 的心跳 Key + 一个按最后心跳时间排序的索引
+HEARTBEAT_KEY_PREFIX = "procurator:worker:"
+HEARTBEAT_INDEX_KEY = "procurator:workers"
+
+
+class WorkerRegistry:
+    """
+    Worker 心跳注册表
+    Redis 模式下心跳写入 Redis，超过 TTL 未续期的 Worker 自动过期；
+    Memory 模式下只有本进程的 Worker，心跳保存在内存中
+    """
+
+    def __init__(self):
+        self.enabled = config.get("QUEUE_BACKEND", "memory").lower() == "redis"
+        self._local: Dict[str, dict] = {}
+
+    @staticmethod
+    def interval() -> float:
+        return float(config.get("WORKER_HEARTBEAT_INTERVAL", 5))
+
+    def ttl(self) -> int:
+        return int(config.get("WORKER_HEARTBEAT_TTL", int(self.interval() * 3)))
+
+    async def publish(self, heartbeat: dict):
+        worker_id = heartbeat["worker_id"]
+        if not self.enabled:
+            self._local[worker_id] = heartbeat
+            return
+
+        client = redis_client.get_async_client()
+        pipeline = client.pipeline(transaction=False)
+        pipeline.set(f"{HEARTBEAT_KEY_PREFIX}{worker_id}", json.dumps(heartbeat), ex=self.ttl())
+        pipeline.zadd(HEARTBEAT_INDEX_KEY, {worker_id: heartbeat["ts"]})
+        await pipeline.execute()
+
+    async def unregister(self, worker_id: str):
+        """
+        Worker 正常停机时立即注销，不必等待心跳过期
+        """
+        if not self.enabled:
+            self._local.pop(worker_id, None)
+            return
+
+        client = redis_client.get_async_client()
+        pipeline = client.pipeline(transaction=False)
+        pipeline.delete(f"{HEARTBEAT_KEY_PREFIX}{worker_id}")
+        pipeline.zrem(HEARTBEAT_INDEX_KEY, worker_id)
+        await pipeline.execute()
+
+    async def list_workers(self) -> List[dict]:
+        """
+        列出存活的 Worker (心跳未过期)，顺带清理索引中的过期条目
+        """
+        if not self.enabled:
+            return list(self._local.values())
+
+        client = redis_client.get_async_client()
+        cutoff = time.time() - self.ttl()
+        await client.zremrangebyscore(HEARTBEAT_INDEX_KEY, "-inf", cutoff)
+        worker_ids = await client.zrangebyscore(HEARTBEAT_INDEX_KEY, cutoff, "+inf")
+        if not worker_ids:
+            return []
+
+        raw = await client.mget([f"{HEARTBEAT_KEY_PREFIX}{w}" for w in worker_ids])
+        workers = []
+        for item in raw:
+            if not item:
+                continue
+            try:
+                workers.append(json.loads(item))
+            except Exception:
+                pass
+        return workers
+
+    async def alive_consumers(self) -> Optional[Set[str]]:
+        """
+        返回存活 Worker 的 Stream 消费者名集合
+        注册表为空或不可用时返回 None，调用方不应据此判定任何消费者死亡
+        """
+        try:
+            workers = await self.list_workers()
+        except Exception as e:
+            logger.error(f"Failed to list workers: {e}")
+            return None
+        consumers = {w.get("consumer") for w in workers if w.get("consumer")}
+        return consumers or None
+
+
+worker_registry = WorkerRegistry()
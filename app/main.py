@@ -2,12 +2,17 @@ import sys
 import os
 import time
 import psutil
+import hashlib
+import uuid
 
 from app.core.config import config
 from app.core.security import IPAllowlistMiddleware, verify_token, resolve_role, token_dependency
 from app.queues.task_queue import queue_manager
+from app.queues.admission import admission_controller
 from app.worker import worker
+from app.core.executors import executors, sync_dispatch_pool, PoolSaturatedError
 from app.core.log_utils import get_logger
+from app.core.serialization import FastJSONResponse
 from app.queues.tasks import (
     is_allowed, 
     list_tasks, 
@@ -15,15 +20,29 @@ from app.queues.tasks import (
     list_scripts, 
     get_task_webhook,
     get_task_async_mode,
+    get_cache_policy,
+    is_coalesced,
     handle_task
 )
 from app.infra.rate_limiter import rate_limiter
 from app.infra.feishu_client import get_tenant_access_token
-from app.routers import logs, dlq
-
-from fastapi import FastAPI, Header, Depends, Request
+from app.routers import logs, dlq, workers, registry, workflows, groups
+from app.queues.control import control_bus
+from app.core.metrics import TASK_CANCELLED_TOTAL, TASK_DEDUPE_TOTAL
+from app.infra.idempotency import idempotency_store
+from app.infra.result_cache import result_cache, fingerprint
+from app.infra.singleflight import singleflight
+from app.infra.webhook import notify
+from app.services.system import forward_concurrently
+from app.services.task_persistence import persist_task_init, persist_task_finish
+from app.services.webhook_config import get_configured_webhook
+from app.services.task_registry import task_registry
+from app.services.workflow import workflow_engine
+from app.services.groups import group_manager
+
+from fastapi import FastAPI, Header, Depends, Request, BackgroundTasks
 from pydantic import BaseModel, HttpUrl, Field
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Literal
 import subprocess
 import platform
 import re
@@ -32,24 +51,6 @@ from contextlib import asynccontextmanager
 
 
 
-def to_json_compatible(obj):
-    """
-    递归将对象转换为 JSON 兼容的基础类型。
-    特别处理 Pydantic 的 HttpUrl 等类型。
-    """
-    if hasattr(obj, "model_dump"):
-        return obj.model_dump(mode="json")
-    if hasattr(obj, "dict"):
-        return obj.dict()
-    if isinstance(obj, list):
-        return [to_json_compatible(item) for item in obj]
-    if isinstance(obj, dict):
-        return {k: to_json_compatible(v) for k, v in obj.items()}
-    if hasattr(obj, "__str__") and not isinstance(obj, (int, float, bool, type(None), str)):
-        return str(obj)
-    return obj
-
-
 def set_custom_process_name(process_name):
     """
     仅在Linux系统下设置进程名,Windows系统不执行,且捕获所有异常避免报错
@@ -78,11 +79,16 @@ async def lifespan(app: FastAPI):
             await worker.stop()
         except Exception:
             pass
+        executors.shutdown()
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
 app.add_middleware(IPAllowlistMiddleware)
 app.include_router(logs.router)
 app.include_router(dlq.router, dependencies=[Depends(token_dependency)])
+app.include_router(workers.router, dependencies=[Depends(token_dependency)])
+app.include_router(registry.router, dependencies=[Depends(token_dependency)])
+app.include_router(workflows.router, dependencies=[Depends(token_dependency)])
+app.include_router(groups.router, dependencies=[Depends(token_dependency)])
 logger = get_logger("api")
 
 DEMO_WEBHOOK_EVENTS: list[dict] = []
@@ -90,10 +96,14 @@ DEMO_WEBHOOK_EVENTS: list[dict] = []
 class DispatchRequest(BaseModel):
     task: str
     taskData: dict
-    queue: Optional[str] = "api"
+    queue: Optional[str] = None
     maxRetries: Optional[int] = 0
     webhook: Optional[str] = None
     async_mode: Optional[bool] = Field(True, alias="async")
+    # 幂等键 (也可通过 Idempotency-Key 请求头传入)，窗口内重复请求返回首次的 task_id
+    dedupe_key: Optional[str] = None
+    # 优先级 (high / normal / low)：队列积压时 low 最先被拒绝，high (交互式) 最后
+    priority: Optional[Literal["high", "normal", "low"]] = "normal"
 
 @app.get("/ping")
 def ping():
@@ -105,8 +115,27 @@ def metrics():
     from starlette.responses import Response
     return Response(get_metrics_data(), media_type="text/plain")
 
+async def _run_sync_task(task: str, task_data: dict):
+    """
+    同步分发的任务在独立的有界并发池中执行，池满时抛出 PoolSaturatedError
+    """
+    await sync_dispatch_pool.acquire(task)
+    try:
+        return await handle_task(task, task_data)
+    finally:
+        sync_dispatch_pool.release()
+
 @app.post("/dispatch")
-async def dispatch(req: DispatchRequest, ident=Depends(token_dependency)):
+async def dispatch(
+    req: DispatchRequest,
+    bg_tasks: BackgroundTasks,
+    idempotency_key: Optional[str] = Header(None),
+    ident=Depends(token_dependency)
+):
+    # 直接返回响应对象，同步执行的大结果不再经过 jsonable_encoder
+    return FastJSONResponse(await _dispatch(req, bg_tasks, idempotency_key, ident))
+
+async def _dispatch(req: DispatchRequest, bg_tasks: BackgroundTasks, idempotency_key: Optional[str], ident: dict):
     # 拦截示例任务，直接返回 Hello World
     if req.task == "_doc_example":
         return {"code": 200, "data": "Hello World"}
@@ -119,7 +148,8 @@ async def dispatch(req: DispatchRequest, ident=Depends(token_dependency)):
             req.async_mode = req.taskData["async"]
 
     payload = {"task": req.task, "taskData": req.taskData}
-    src = req.queue or "api"
+    # 队列：请求指定 > registered_tasks.default_queue > api
+    src = req.queue or task_registry.default_queue(req.task) or "api"
     if not is_allowed(req.task, src, ident.get("role")):
         from fastapi import HTTPException
         raise HTTPException(status_code=422, detail="Task not allowed or unknown")
@@ -140,7 +170,7 @@ async def dispatch(req: DispatchRequest, ident=Depends(token_dependency)):
         validated_data = validate_task_input(req.task, req.taskData)
         # 如果返回的是 Pydantic 模型，转换为字典以确保 JSON 可序列化
         if hasattr(validated_data, "model_dump"):
-            payload["taskData"] = validated_data.model_dump(mode="json")
+            payload["taskData"] = validated_data.model_dump(mode="json", exclude_unset=True)
         elif hasattr(validated_data, "dict"):
             payload["taskData"] = validated_data.dict()
         else:
@@ -169,43 +199,151 @@ async def dispatch(req: DispatchRequest, ident=Depends(token_dependency)):
     elif task_async_config == "Free":
         if req.async_mode is False:
             is_sync = True
+
+    # 结果缓存 (任务通过 @cacheable 开启)：命中时同步/异步分发都直接返回结果，不占用 Worker
+    cache_policy = get_cache_policy(req.task)
+    cache_key = result_cache.key_for(req.task, payload["taskData"], cache_policy)
+    if cache_key:
+        hit, cached = await result_cache.get(req.task, cache_key, cache_policy)
+        if hit:
+            if is_sync:
+                return {"accepted": True, "status": "completed", "result": cached, "cached": True}
+            # 异步调用方按 task_id 轮询 / 关联 Webhook：命中时同样分配任务 ID，直接写入完成记录
+            tid = queue_manager.record_completed(src, payload, result=cached)
+            bg_tasks.add_task(persist_task_init, tid, src, req.task, payload)
+            bg_tasks.add_task(persist_task_finish, tid, "completed", result=cached, queue=src, task_name=req.task)
+            if payload.get("webhook"):
+                bg_tasks.add_task(notify, tid, req.task, payload, "done", cached, None)
+            return {"accepted": True, "task_id": tid, "status": "completed", "result": cached, "cached": True}
     
     if is_sync:
         logger.info("Executing task %s synchronously", req.task)
         try:
-            result = await handle_task(req.task, payload["taskData"])
+            if is_coalesced(req.task):
+                # 并发的相同同步请求共享一次执行 (只有实际执行占用同步池槽位)
+                result = await singleflight.do(
+                    fingerprint(req.task, payload["taskData"]),
+                    lambda: _run_sync_task(req.task, payload["taskData"]),
+                    task_name=req.task
+                )
+            else:
+                result = await _run_sync_task(req.task, payload["taskData"])
+            if cache_key:
+                await result_cache.set(req.task, cache_key, result, cache_policy["ttl"])
             return {"accepted": True, "status": "completed", "result": result}
+        except PoolSaturatedError as e:
+            from fastapi import HTTPException
+            logger.warning("Sync task %s rejected: %s", req.task, e)
+            raise HTTPException(
+                status_code=503,
+                detail=f"Sync execution pool saturated ({e.reason}), retry later or use async mode",
+                headers={"Retry-After": str(max(1, int(round(e.retry_after))))}
+            )
         except Exception as e:
             logger.error("Sync task %s failed: %s", req.task, e)
             return {"accepted": True, "status": "failed", "error": str(e)}
 
     # 异步排队逻辑
+    # 重试次数：请求指定 > registered_tasks.max_retries > RETRY_MAX
     if req.maxRetries and req.maxRetries > 0:
         payload["_max_retries"] = int(req.maxRetries)
+    elif task_registry.max_retries(req.task) is not None:
+        payload["_max_retries"] = int(task_registry.max_retries(req.task))
     elif config.get("RETRY_MAX"):
         try:
             payload["_max_retries"] = int(config.get("RETRY_MAX"))
         except Exception:
             pass
 
-    # 确保整个 payload 是 JSON 兼容的（处理 HttpUrl 等对象）
-    payload = to_json_compatible(payload)
-    tid = queue_manager.enqueue(src, payload)
+    # 幂等键：按调用方 + 任务名隔离，SET NX 原子占位，重复请求直接返回首次入队的 task_id
+    # 在准入控制之前查询：超时重试的客户端即使队列过载也能拿回原 task_id
+    dedupe_key = idempotency_key or req.dedupe_key
+    tid = None
+    if dedupe_key:
+        caller = hashlib.sha256(str(ident.get("token") or ident.get("ip")).encode()).hexdigest()[:16]
+        dedupe_key = f"{caller}:{req.task}:{dedupe_key}"
+        tid = str(uuid.uuid4())
+        try:
+            existing = await idempotency_store.claim(dedupe_key, tid)
+        except Exception as e:
+            # 幂等存储不可用时放行 (fail open)：不因 Redis 故障拒绝分发，本次请求不去重
+            logger.error("Idempotency claim for %s failed, dispatching without dedupe: %s", req.task, e)
+            TASK_DEDUPE_TOTAL.labels(task_name=req.task, result="error").inc()
+            existing = dedupe_key = None
+        else:
+            TASK_DEDUPE_TOTAL.labels(task_name=req.task, result="hit" if existing else "miss").inc()
+        if existing:
+            logger.info("Duplicate dispatch of %s, returning original task %s", req.task, existing)
+            return {"accepted": True, "task_id": existing, "duplicate": True}
+
+    # 准入控制：按缓存的队列积压与高水位决定是否接收 (不在请求路径上查询队列长度)
+    rejected = admission_controller.check(src, req.priority or "normal")
+    if rejected:
+        from fastapi import HTTPException
+        status_code, retry_after = rejected
+        logger.warning("Dispatch of %s to %s shed (priority=%s, depth=%s)",
+                       req.task, src, req.priority, admission_controller.depth(src))
+        if dedupe_key:
+            # 未入队：释放占位，客户端稍后以同一幂等键重试
+            await idempotency_store.release(dedupe_key, tid)
+        raise HTTPException(
+            status_code=status_code,
+            detail=f"Queue {src} is overloaded, retry later",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+    try:
+        tid = queue_manager.enqueue(src, payload, tid=tid)
+    except Exception:
+        if dedupe_key:
+            await idempotency_store.release(dedupe_key, tid)
+        raise
     
     # 异步持久化到数据库 (Cold Storage)
     bg_tasks.add_task(persist_task_init, tid, src, req.task, payload)
     
-    logger.info("Enqueued task %s to %s", tid, req.queue)
+    logger.info("Enqueued task %s to %s", tid, src)
     return {"accepted": True, "task_id": tid}
 
 @app.get("/task/{tid}", dependencies=[Depends(token_dependency)])
 def task_status(tid: str):
     return {"status": queue_manager.status(tid)}
 
+@app.delete("/task/{tid}", dependencies=[Depends(token_dependency)])
+async def cancel_task(tid: str, force: bool = False):
+    """
+    取消任务
+    - pending: 直接标记为 cancelled，出队时跳过
+    - processing: 通过控制通道通知执行中的 Worker 取消 (force=true 时强制 kill 脚本子进程)
+    """
+    import asyncio
+    from fastapi import HTTPException
+    prev = await asyncio.to_thread(queue_manager.cancel, tid)
+    if prev is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if prev not in ("pending", "processing"):
+        raise HTTPException(status_code=409, detail=f"Task already {prev}")
+
+    if prev == "processing":
+        await control_bus.publish({"action": "cancel", "tid": tid, "force": force})
+        logger.info("Cancellation of running task %s requested (force=%s)", tid, force)
+        return {"task_id": tid, "status": "cancelling"}
+
+    info = await asyncio.to_thread(queue_manager.get_task, tid) or {}
+    TASK_CANCELLED_TOTAL.labels(queue=info.get("queue") or "unknown", task_name=info.get("task") or "unknown", stage="pending").inc()
+    await persist_task_finish(tid, "cancelled", queue=info.get("queue"), task_name=info.get("task"))
+    payload = info.get("payload") or {}
+    if payload.get("_workflow"):
+        await workflow_engine.on_task_finished(payload, "cancelled", error="cancelled before start")
+    if payload.get("_group"):
+        await group_manager.on_task_finished(payload, "cancelled", error="cancelled before start")
+    logger.info("Cancelled pending task %s", tid)
+    return {"task_id": tid, "status": "cancelled"}
+
 @app.get("/task/{tid}/detail", dependencies=[Depends(token_dependency)])
 def task_detail(tid: str):
     from app.queues.task_queue import queue_manager as qm
-    return qm.backend.get_task(tid)
+    return FastJSONResponse(qm.backend.get_task(tid))
 
 @app.get("/tasks", dependencies=[Depends(token_dependency)])
 def tasks_list():
@@ -255,9 +393,12 @@ class ProxyForwardRequest(BaseModel):
     headers: Optional[Dict[str, str]] = None
     webhook: Optional[HttpUrl] = None
     queue: Optional[str] = "api"
+    # 响应体返回方式 (body / hash / summary) 与字节上限，见 proxy_forward 任务
+    response_mode: Optional[Literal["body", "hash", "summary"]] = "body"
+    max_response_bytes: Optional[int] = Field(None, gt=0)
 
 @app.post("/proxy/forward")
-def proxy_forward(req: ProxyForwardRequest, ident=Depends(token_dependency)):
+async def proxy_forward(req: ProxyForwardRequest, ident=Depends(token_dependency)):
     max_req = int(config.get("RATE_LIMIT_MAX", 30))
     win = int(config.get("RATE_LIMIT_WINDOW", 60))
     key = f"proxy_forward:{ident.get('token') or ident.get('ip')}"
@@ -272,8 +413,11 @@ def proxy_forward(req: ProxyForwardRequest, ident=Depends(token_dependency)):
                 "data": req.data,
                 "timeout": int(req.timeout or 3),
                 "headers": req.headers or {},
+                "response_mode": req.response_mode or "body",
             },
         }
+        if req.max_response_bytes:
+            payload["taskData"]["max_response_bytes"] = req.max_response_bytes
         if req.webhook:
             payload["taskData"]["webhook"] = str(req.webhook)
         if req.queue:
@@ -289,35 +433,34 @@ def proxy_forward(req: ProxyForwardRequest, ident=Depends(token_dependency)):
         tid = queue_manager.enqueue(qn, payload)
         logger.info("Enqueued proxy_forward %s to %s", tid, qn)
         return {"accepted": True, "mode": "async", "task_id": tid}
-    import json
-    import time
-    from urllib.request import Request, urlopen
-    from urllib.error import URLError, HTTPError
-    results = []
-    ok = 0
-    headers = req.headers or {}
-    to = float(req.timeout or 3)
-    for u in req.urls:
-        url = str(u)
-        t0 = time.time()
-        body = json.dumps(req.data, ensure_ascii=False).encode("utf-8")
-        reqobj = Request(url, data=body, headers={"Content-Type": "application/json", **headers}, method="POST")
-        try:
-            with urlopen(reqobj, timeout=to) as resp:
-                code = int(resp.getcode())
-                raw = resp.read()
-                txt = raw.decode("utf-8", errors="replace")
-                try:
-                    parsed = json.loads(txt)
-                    item = {"url": url, "code": code, "ok": 200 <= code < 300, "response": parsed, "ms": int((time.time() - t0) * 1000)}
-                except Exception:
-                    item = {"url": url, "code": code, "ok": 200 <= code < 300, "text": txt[:200], "ms": int((time.time() - t0) * 1000)}
-        except (URLError, HTTPError):
-            item = {"url": url, "code": None, "ok": False, "error": "request_failed", "ms": int((time.time() - t0) * 1000)}
-        if item.get("ok"):
-            ok += 1
-        results.append(item)
-    return {"accepted": True, "mode": "sync", "count": len(results), "ok": ok, "failed": len(results) - ok, "results": results}
+    # 同步模式：与 proxy_forward 任务共用异步并发引擎，总耗时取决于最慢的目标 (受整体截止时间约束)
+    # 与原 urllib 实现一致跟随重定向；TLS 证书按 HTTP_VERIFY_TLS 校验
+    deadline = float(config.get("PROXY_SYNC_DEADLINE_SECONDS", 10))
+    raw = await forward_concurrently(
+        [str(u) for u in req.urls], req.data, req.headers or {}, float(req.timeout or 3), deadline=deadline,
+        response_mode=req.response_mode or "body", max_bytes=req.max_response_bytes, follow_redirects=True
+    )
+    results = [_legacy_proxy_item(item) for item in raw]
+    ok = sum(1 for item in results if item["ok"])
+    partial = any(item.get("error") == "deadline_exceeded" for item in results)
+    return {"accepted": True, "mode": "sync", "count": len(results), "ok": ok, "failed": len(results) - ok,
+            "partial": partial, "results": results}
+
+def _legacy_proxy_item(item: dict) -> dict:
+    """
+    转换为同步 /proxy/forward 原有的结果格式 (code / response 或 text / ms)
+    """
+    out = {"url": item["url"], "code": item.get("status") or None, "ok": bool(item.get("ok")), "ms": item.get("duration_ms", 0)}
+    if "error" in item:
+        # 超时、整体截止与熔断保留原因，其余网络错误沿用 request_failed
+        out["error"] = item["error"] if item["error"] in ("timeout", "pool_timeout", "deadline_exceeded", "circuit_open") else "request_failed"
+    elif isinstance(item.get("response"), str):
+        out["text"] = item["response"][:200]
+    else:
+        out["response"] = item.get("response")
+    if item.get("truncated"):
+        out["truncated"] = True
+    return out
 
 def free_port(port: int):
     system = platform.system().lower()
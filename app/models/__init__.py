@@ -1,2 +1,3 @@
 from app.models.task import Task
 from app.models.system import RegisteredTask, Webhook, User, AuditLog
+from app.models.workflow import Workflow
@@ -0,0 +1,21 @@
+from sqlalchemy import Column, String, DateTime, Integer, Text, JSON
+from sqlalchemy.sql import func
+from app.core.database import Base
+
+
+class Workflow(Base):
+    __tablename__ = "workflows"
+
+    id = Column(String(36), primary_key=True)
+    status = Column(String(20), index=True, default="running")
+
+    # 提交时的 DAG 定义 (nodes / edges) 与各节点的执行状态 (state / task_id)
+    spec = Column(JSON, nullable=True)
+    nodes = Column(JSON, nullable=True)
+    total = Column(Integer, default=0)
+
+    error = Column(Text, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
@@ -0,0 +1,125 @@
+import asyncio
+import math
+import time
+from typing import Dict, Optional, Set, Tuple
+from app.core.config import config
+from app.core.metrics import TASK_QUEUE_SIZE, ADMISSION_REJECTED_TOTAL
+from app.core.log_utils import get_logger
+from app.infra.worker_registry import worker_registry
+from app.queues.task_queue import queue_manager
+
+logger = get_logger("admission")
+
+PRIORITY_HIGH = "high"
+PRIORITY_NORMAL = "normal"
+PRIORITY_LOW = "low"
+
+# 各优先级开始拒绝时的积压比例 (相对高水位)：低优先级最先被拒绝，交互式 (high) 最后
+_DEFAULT_RATIOS = {PRIORITY_LOW: 0.5, PRIORITY_NORMAL: 0.8, PRIORITY_HIGH: 1.0}
+
+
+class AdmissionController:
+    """
+    基于队列积压的准入控制
+    - 队列积压 (Stream lag / 内存队列长度) 与消费速率 (Worker 心跳 tps) 按 ADMISSION_REFRESH_INTERVAL
+      在后台刷新并缓存，分发路径只读缓存，不会每个请求执行一次 XLEN
+    - 每个队列有高水位 (ADMISSION_HIGH_WATER，可用 ADMISSION_HIGH_WATER_<QUEUE> 单独覆盖)，
+      low / normal 在达到高水位的一定比例时返回 429，任何优先级在超过高水位时返回 503
+    - Retry-After 按 超出阈值的积压 / 消费速率 估算
+    """
+
+    def __init__(self):
+        self._depth: Dict[str, int] = {}
+        self._drain_rate: Dict[str, float] = {}
+        self._refreshed_at: Dict[str, float] = {}
+        self._refreshing: Set[str] = set()
+
+    @staticmethod
+    def active() -> bool:
+        return str(config.get("ADMISSION_ENABLED", "1")).lower() not in ("0", "false", "no")
+
+    @staticmethod
+    def refresh_interval() -> float:
+        return float(config.get("ADMISSION_REFRESH_INTERVAL", 1.0))
+
+    @staticmethod
+    def high_water(queue: str) -> int:
+        value = config.get(f"ADMISSION_HIGH_WATER_{queue.upper()}")
+        if value is None:
+            value = config.get("ADMISSION_HIGH_WATER", 10000)
+        return int(value)
+
+    @staticmethod
+    def ratio(priority: str) -> float:
+        value = config.get(f"ADMISSION_{priority.upper()}_RATIO")
+        if value is None:
+            return _DEFAULT_RATIOS.get(priority, _DEFAULT_RATIOS[PRIORITY_NORMAL])
+        return float(value)
+
+    @staticmethod
+    def max_retry_after() -> int:
+        return int(config.get("ADMISSION_RETRY_AFTER_MAX", 60))
+
+    def depth(self, queue: str) -> Optional[int]:
+        return self._depth.get(queue)
+
+    def check(self, queue: str, priority: str = PRIORITY_NORMAL) -> Optional[Tuple[int, int]]:
+        """
+        准入判定，只读缓存 (缓存过期时在后台刷新，本次仍使用旧值)
+        放行返回 None；拒绝返回 (HTTP 状态码, Retry-After 秒数)
+        """
+        if not self.active():
+            return None
+        self._maybe_refresh(queue)
+
+        depth = self._depth.get(queue)
+        if depth is None:
+            # 尚无积压数据 (刚启动) 时放行
+            return None
+
+        high_water = self.high_water(queue)
+        threshold = high_water * self.ratio(priority)
+        if depth < threshold:
+            return None
+
+        status = 503 if depth >= high_water else 429
+        # 需要消化到阈值以下的积压 / 消费速率；没有消费速率数据时按上限
+        excess = depth - threshold + 1
+        rate = self._drain_rate.get(queue) or 0.0
+        retry_after = self.max_retry_after() if rate <= 0 else math.ceil(excess / rate)
+        retry_after = max(1, min(retry_after, self.max_retry_after()))
+        ADMISSION_REJECTED_TOTAL.labels(queue=queue, priority=priority, status=str(status)).inc()
+        return status, retry_after
+
+    def _maybe_refresh(self, queue: str):
+        if queue in self._refreshing:
+            return
+        if time.monotonic() - self._refreshed_at.get(queue, 0.0) < self.refresh_interval():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._refreshing.add(queue)
+        loop.create_task(self.refresh(queue))
+
+    async def refresh(self, queue: str):
+        try:
+            depth = await asyncio.to_thread(queue_manager.queue_depth, queue)
+            if depth is not None:
+                self._depth[queue] = int(depth)
+                TASK_QUEUE_SIZE.labels(queue=queue).set(depth)
+
+            # 消费速率：消费该队列的存活 Worker 的吞吐之和 (心跳中的 tps 是 Worker 全部队列的合计，近似值)
+            workers = await worker_registry.list_workers()
+            self._drain_rate[queue] = sum(
+                float(w.get("tps") or 0) for w in workers if queue in (w.get("queues") or [])
+            )
+        except Exception as e:
+            logger.error(f"Failed to refresh admission stats for {queue}: {e}")
+        finally:
+            self._refreshed_at[queue] = time.monotonic()
+            self._refreshing.discard(queue)
+
+
+admission_controller = AdmissionController()
@@ -1,24 +1,86 @@
+import asyncio
 import json
 import time
 import socket
 import os
 import uuid
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Set
+from app.core.config import config
 from app.core.redis import redis_client
 from app.core.log_utils import get_logger
 from app.core.metrics import TASK_ENQUEUED_TOTAL, TASK_QUEUE_SIZE
+from app.infra.worker_registry import worker_registry
 
 logger = get_logger("redis_stream")
 
+# 任务终态：释放 PEL 时不再重新入队
+FINAL_STATUSES = ("completed", "failed", "cancelled")
+
+# 出队认领：记录 msg_id 并将状态置为 processing；已取消的任务直接返回 cancelled
+# 返回 nil (Hash 丢失) / {"cancelled"} / {"processing", payload}
+CLAIM_TASK_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return nil
+end
+redis.call('HSET', KEYS[1], '_stream_msg_id', ARGV[1])
+local st = redis.call('HGET', KEYS[1], 'status')
+if st == 'cancelled' or redis.call('HEXISTS', KEYS[1], 'cancel_requested') == 1 then
+    redis.call('HSET', KEYS[1], 'status', 'cancelled', 'updated_at', ARGV[2])
+    return {'cancelled'}
+end
+redis.call('HSET', KEYS[1], 'status', 'processing', 'updated_at', ARGV[2])
+return {'processing', redis.call('HGET', KEYS[1], 'payload')}
+"""
+
+# 取消：pending 直接置为 cancelled；processing 记录取消请求，由执行中的 Worker 处理
+# 返回取消前的状态 (Hash 不存在返回 nil)
+CANCEL_TASK_LUA = """
+local st = redis.call('HGET', KEYS[1], 'status')
+if not st then
+    return nil
+end
+if st == 'pending' then
+    redis.call('HSET', KEYS[1], 'status', 'cancelled', 'updated_at', ARGV[1])
+elseif st == 'processing' then
+    redis.call('HSET', KEYS[1], 'cancel_requested', ARGV[1])
+end
+return st
+"""
+
+# 幂等入队：任务 Hash 不存在时写入 Hash 并推送 Stream (原子执行)，已存在返回 0
+ENQUEUE_ONCE_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'id', ARGV[1], 'task', ARGV[2], 'status', 'pending',
+           'created_at', ARGV[3], 'payload', ARGV[4], 'queue', ARGV[5])
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+redis.call('XADD', KEYS[2], '*', 'tid', ARGV[1])
+return 1
+"""
+
 class RedisStreamBackend:
     def __init__(self):
         self.client = redis_client.get_client()
+        self._async_client = None
+        self._claim_script = None
+        self._cancel_script = self.client.register_script(CANCEL_TASK_LUA)
+        self._enqueue_once_script = self.client.register_script(ENQUEUE_ONCE_LUA)
         self.group_name = "procurator_group"
         self.consumer_name = f"worker_{socket.gethostname()}_{os.getpid()}"
         
         # 记录已初始化的队列，避免重复 XGROUP CREATE
         self._initialized_queues = set()
 
+        # 异步出队：是否需要检查自己的 Pending 消息 (启动或 XCLAIM 之后)
+        self._check_own_pending = {}
+        # 每个队列的唤醒事件: queue_name -> (loop, asyncio.Event)，XCLAIM 后打断阻塞中的 XREADGROUP
+        self._waiters = {}
+        # 编排回调失败、退避中的 Pending 消息: msg_id -> 可重新投递的时间戳
+        self._deferred: Dict[str, float] = {}
+        # 退避到期后重新检查自己 Pending 的定时器: queue_name -> TimerHandle
+        self._rechecks = {}
+
     def _ensure_group(self, queue_name: str):
         """确保 Consumer Group 存在"""
         if queue_name in self._initialized_queues:
@@ -37,14 +99,14 @@ class RedisStreamBackend:
         
         self._initialized_queues.add(queue_name)
 
-    def enqueue(self, queue_name: str, payload: dict) -> str:
+    def enqueue(self, queue_name: str, payload: dict, tid: Optional[str] = None) -> str:
         """
         入队：
-        1. 生成 Task ID
+        1. 生成 Task ID (调用方可预先生成)
         2. 保存任务详情到 Hash (用于状态查询)
         3. 推送到 Stream (用于分发)
         """
-        tid = str(uuid.uuid4())
+        tid = tid or str(uuid.uuid4())
         task_name = payload.get("task", "unknown")
         
         # 1. 构造任务元数据
@@ -81,6 +143,50 @@ class RedisStreamBackend:
             
         return tid
 
+    def enqueue_once(self, queue_name: str, payload: dict, tid: str) -> bool:
+        """
+        以确定的 tid 入队：任务 Hash 已存在时不重复入队 (返回 False)
+        写入 Hash 与推送 Stream 在同一个 Lua 脚本中完成，不会出现只有 Hash 没有消息的中间状态
+        """
+        task_name = payload.get("task", "unknown")
+        stream_key = f"procurator:queue:{queue_name}"
+        created = self._enqueue_once_script(
+            keys=[f"procurator:task:{tid}", stream_key],
+            args=[tid, task_name, time.time(), json.dumps(payload), queue_name, 604800]
+        )
+        if not created:
+            return False
+
+        try:
+            TASK_ENQUEUED_TOTAL.labels(queue=queue_name, task_name=task_name).inc()
+            TASK_QUEUE_SIZE.labels(queue=queue_name).set(self.client.xlen(stream_key))
+        except Exception:
+            pass
+        return True
+
+    def record_completed(self, queue_name: str, payload: dict, result=None, tid: Optional[str] = None) -> str:
+        """
+        直接写入已完成的任务记录 (Hash)，不推送 Stream (结果缓存命中的异步分发)
+        """
+        tid = tid or str(uuid.uuid4())
+        now = time.time()
+        task_key = f"procurator:task:{tid}"
+        pipeline = self.client.pipeline()
+        pipeline.hset(task_key, mapping={
+            "id": tid,
+            "task": payload.get("task", "unknown"),
+            "status": "completed",
+            "created_at": now,
+            "updated_at": now,
+            "payload": json.dumps(payload),
+            "queue": queue_name,
+            "result": json.dumps(result, default=str),
+            "cached": 1
+        })
+        pipeline.expire(task_key, 604800)
+        pipeline.execute()
+        return tid
+
     def dequeue(self, queue_name: str) -> Optional[tuple[str, dict]]:
         """
         出队：
@@ -158,47 +264,368 @@ class RedisStreamBackend:
             
         return None
 
-    def process_pending(self, queue_name: str):
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            self._async_client = redis_client.get_async_client()
+        return self._async_client
+
+    def _wake(self, queue_name: str):
+        """
+        唤醒阻塞在该队列上的异步出队 (process_pending 在线程池中执行，需 call_soon_threadsafe)
+        """
+        waiter = self._waiters.get(queue_name)
+        if not waiter:
+            return
+        loop, event = waiter
+        try:
+            loop.call_soon_threadsafe(event.set)
+        except RuntimeError:
+            # 事件循环已关闭
+            self._waiters.pop(queue_name, None)
+
+    def _waiter(self, queue_name: str) -> asyncio.Event:
+        loop = asyncio.get_running_loop()
+        waiter = self._waiters.get(queue_name)
+        if waiter is None or waiter[0] is not loop:
+            waiter = (loop, asyncio.Event())
+            self._waiters[queue_name] = waiter
+        return waiter[1]
+
+    async def _read_new(self, client, queue_name: str, stream_key: str, wakeup: asyncio.Event):
+        """
+        阻塞读取新消息 (">")；抢占到消息 (wakeup) 时立即放弃本次阻塞，返回 None
+        """
+        block_ms = int(config.get("QUEUE_BLOCK_MS", 30000))
+        read = asyncio.ensure_future(client.xreadgroup(
+            self.group_name,
+            self.consumer_name,
+            {stream_key: ">"},
+            count=1,
+            block=block_ms
+        ))
+        woken = asyncio.ensure_future(wakeup.wait())
+        try:
+            await asyncio.wait({read, woken}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            woken.cancel()
+            if not read.done():
+                # 取消时即使消息已投递给本消费者，也会留在 PEL 中，下一次出队读取 "0" 时处理
+                read.cancel()
+                await asyncio.gather(read, return_exceptions=True)
+        if read.cancelled():
+            return None
+        return read.result()
+
+    async def _read_own_pending(self, client, queue_name: str, stream_key: str):
+        """
+        读取自己 PEL 中的消息 ("0")，跳过退避中的消息 (编排回调失败待重新投递)；
+        全部在退避中时不再反复读取，最早到期时再检查
+        """
+        now = time.time()
+        start = "0"
+        earliest = None
+        while True:
+            messages = await client.xreadgroup(
+                self.group_name,
+                self.consumer_name,
+                {stream_key: start},
+                count=10
+            )
+            entries = messages[0][1] if messages else []
+            if not entries:
+                break
+            for msg_id, msg_data in entries:
+                until = self._deferred.get(msg_id)
+                if until is None or until <= now:
+                    self._deferred.pop(msg_id, None)
+                    return [(messages[0][0], [(msg_id, msg_data)])]
+                earliest = until if earliest is None else min(earliest, until)
+            start = entries[-1][0]
+
+        self._check_own_pending[queue_name] = False
+        if earliest is not None:
+            handle = self._rechecks.pop(queue_name, None)
+            if handle:
+                handle.cancel()
+            self._rechecks[queue_name] = asyncio.get_running_loop().call_later(
+                earliest - now, self._recheck_own_pending, queue_name
+            )
+        return None
+
+    def _recheck_own_pending(self, queue_name: str):
+        self._rechecks.pop(queue_name, None)
+        self._check_own_pending[queue_name] = True
+        self._wake(queue_name)
+
+    async def adequeue(self, queue_name: str) -> Optional[tuple[str, dict]]:
+        """
+        异步出队 (事件驱动)：
+        XREADGROUP BLOCK 在新消息到达时立即返回，空闲期间不占用 CPU 与线程池；
+        Crash Recovery 抢占到消息后唤醒阻塞中的读取，立即处理抢占的消息
+        """
+        self._ensure_group(queue_name)
+        stream_key = f"procurator:queue:{queue_name}"
+        client = self.async_client
+        wakeup = self._waiter(queue_name)
+        # 先 clear 再检查 Pending，避免丢失两者之间发生的唤醒
+        wakeup.clear()
+
+        try:
+            # 1. 优先处理自己的 Pending 消息 (启动、XCLAIM 或编排回调退避到期之后)
+            messages = None
+            if self._check_own_pending.get(queue_name, True):
+                messages = await self._read_own_pending(client, queue_name, stream_key)
+                if messages:
+                    logger.info(f"Processing pending message from {queue_name}")
+
+            # 2. 阻塞读取新消息 (">")，有消息写入时 Redis 立即唤醒
+            if not messages:
+                messages = await self._read_new(client, queue_name, stream_key, wakeup)
+
+            if messages:
+                stream_name, msg_list = messages[0]
+                if msg_list:
+                    msg_id, msg_data = msg_list[0]
+                    tid = msg_data.get("tid")
+
+                    # 记录 msg_id 到 Hash 并认领 (不立即 ACK)
+                    if self._claim_script is None:
+                        self._claim_script = client.register_script(CLAIM_TASK_LUA)
+                    claimed = await self._claim_script(
+                        keys=[f"procurator:task:{tid}"],
+                        args=[msg_id, time.time()]
+                    )
+
+                    if claimed and claimed[0] == "processing":
+                        return tid, self._decode_payload(claimed[1])
+
+                    if claimed:
+                        # 排队期间已被取消，跳过执行
+                        logger.info(f"Skipping cancelled task {tid} in {queue_name}")
+                    else:
+                        # Hash 丢失，ACK 掉
+                        logger.warning(f"Task {tid} found in stream but missing in hash")
+                    await client.xack(stream_key, self.group_name, msg_id)
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Redis async dequeue error: {e}")
+            await asyncio.sleep(1)
+
+        return None
+
+    @staticmethod
+    def _decode_payload(raw) -> dict:
+        if isinstance(raw, str):
+            try:
+                return json.loads(raw)
+            except Exception:
+                return {}
+        return raw or {}
+
+    def process_pending(self, queue_name: str, alive_consumers: Optional[Set[str]] = None) -> int:
         """
         处理长时间 Pending 的消息 (Crash Recovery)
+        alive_consumers: 存活 Worker 的消费者名集合 (来自心跳注册表)，
+        属于已死亡消费者的消息在空闲超过心跳 TTL 后即可抢占，不必等待 10 分钟的空闲超时
+        (心跳短暂中断的存活 Worker 刚投递的消息不会被抢走重复执行)
         """
         self._ensure_group(queue_name)
         stream_key = f"procurator:queue:{queue_name}"
-        
+        ttl_ms = worker_registry.ttl() * 1000
+        dead_idle_ms = max(ttl_ms, int(config.get("WORKER_DEAD_CLAIM_IDLE_MS", ttl_ms)))
+        claimed = 0
+
         try:
-            # 检查 PEL 中超过 10分钟 (600000ms) 未 ACK 的消息
             pendings = self.client.xpending_range(
                 stream_key, 
                 self.group_name, 
                 min="-", 
                 max="+", 
-                count=10
+                count=100
             )
             
             for p in pendings:
+                msg_id = p['message_id']
                 # 忽略 delivery_count 过高的毒药消息 (比如 > 10 次)
                 if p['times_delivered'] > 10:
-                    msg_id = p['message_id']
                     logger.error(f"Message {msg_id} delivered {p['times_delivered']} times, moving to DLQ")
                     # 这里应该做 DLQ 处理，但为了简单先 ACK 掉
                     self.client.xack(stream_key, self.group_name, msg_id)
                     continue
 
-                if p['time_since_delivered'] > 600000: # 10分钟
-                    msg_id = p['message_id']
+                owner = p.get('consumer')
+                owner_dead = (
+                    alive_consumers is not None
+                    and owner != self.consumer_name
+                    and owner not in alive_consumers
+                )
+
+                if owner_dead and p['time_since_delivered'] >= dead_idle_ms:
+                    min_idle = dead_idle_ms
+                    logger.warning(f"Claiming message {msg_id} of dead consumer {owner} in {queue_name}")
+                elif p['time_since_delivered'] > 600000: # 10分钟
+                    min_idle = 600000
                     logger.warning(f"Claiming timeout message {msg_id} in {queue_name}")
-                    
-                    # 抢占消息
-                    self.client.xclaim(
-                        stream_key, 
-                        self.group_name, 
-                        self.consumer_name, 
-                        min_idle_time=600000, 
-                        message_ids=[msg_id]
-                    )
+                else:
+                    continue
+
+                # 抢占消息 (min_idle_time 保证多个 Worker 同时抢占时只有一个成功)
+                res = self.client.xclaim(
+                    stream_key, 
+                    self.group_name, 
+                    self.consumer_name, 
+                    min_idle_time=min_idle, 
+                    message_ids=[msg_id]
+                )
+                if res:
+                    claimed += 1
         except Exception as e:
             logger.error(f"Error processing pending for {queue_name}: {e}")
 
+        if claimed:
+            # 抢占到的消息进入自己的 PEL：唤醒阻塞中的出队，立即优先处理
+            self._check_own_pending[queue_name] = True
+            self._wake(queue_name)
+        return claimed
+
+    def defer(self, tid: str) -> int:
+        """
+        编排回调失败：消息保留在自己的 PEL 中 (不 ACK)，按指数退避 (ORCHESTRATION_RETRY_DELAY 起翻倍，最长 60 秒)
+        之后再重新投递；返回累计失败次数 (记录在任务 Hash 的 orchestration_attempts)
+        """
+        task_key = f"procurator:task:{tid}"
+        queue_name, msg_id = self.client.hmget(task_key, ["queue", "_stream_msg_id"])
+        attempts = int(self.client.hincrby(task_key, "orchestration_attempts", 1))
+        if queue_name and msg_id:
+            now = time.time()
+            # 清理早已到期却未被本消费者读取的条目 (消息已被其他 Worker 抢占)
+            for stale in [m for m, until in self._deferred.items() if until < now - 600]:
+                del self._deferred[stale]
+            base = float(config.get("ORCHESTRATION_RETRY_DELAY", 2))
+            self._deferred[msg_id] = now + min(base * 2 ** (attempts - 1), 60.0)
+            # 下一次出队读取自己的 PEL，发现退避中时按到期时间安排重新检查
+            self._check_own_pending[queue_name] = True
+        return attempts
+
+    def release(self, tid: str) -> bool:
+        """
+        释放任务 (Worker 停机 Drain)：
+        Stream 没有 NACK，这里重新 XADD 一条消息并 ACK 旧消息，
+        使其他消费者可以通过 ">" 立即读取，而不必等待 10 分钟的 XCLAIM
+        """
+        task_key = f"procurator:task:{tid}"
+        queue_name, msg_id = self.client.hmget(task_key, ["queue", "_stream_msg_id"])
+        if not queue_name:
+            return False
+
+        stream_key = f"procurator:queue:{queue_name}"
+        pipeline = self.client.pipeline(transaction=True)
+        pipeline.xadd(stream_key, {"tid": tid})
+        if msg_id:
+            pipeline.xack(stream_key, self.group_name, msg_id)
+        pipeline.hset(task_key, mapping={"status": "pending", "updated_at": time.time()})
+        pipeline.hdel(task_key, "_stream_msg_id")
+        pipeline.execute()
+        logger.info(f"Released task {tid} back to {queue_name}")
+        return True
+
+    def requeue(self, tid: str, payload: dict, error: Optional[str] = None) -> bool:
+        """
+        失败重试：与 release 相同，重新 XADD 并 ACK 当前消息 (事务内完成)，
+        同时写入新的 payload (携带 _retry_count) 与本次错误
+        """
+        task_key = f"procurator:task:{tid}"
+        queue_name, msg_id = self.client.hmget(task_key, ["queue", "_stream_msg_id"])
+        if not queue_name:
+            return False
+
+        stream_key = f"procurator:queue:{queue_name}"
+        mapping = {
+            "status": "pending",
+            "payload": json.dumps(payload),
+            "retry_count": payload.get("_retry_count", 0),
+            "updated_at": time.time()
+        }
+        if error:
+            mapping["error"] = str(error)
+        pipeline = self.client.pipeline(transaction=True)
+        pipeline.xadd(stream_key, {"tid": tid})
+        if msg_id:
+            pipeline.xack(stream_key, self.group_name, msg_id)
+        pipeline.hset(task_key, mapping=mapping)
+        pipeline.hdel(task_key, "_stream_msg_id")
+        pipeline.execute()
+        logger.info(f"Requeued task {tid} to {queue_name} (retry {mapping['retry_count']})")
+        return True
+
+    def queue_depth(self, queue_name: str) -> int:
+        """
+        队列积压：Consumer Group 的 lag (尚未投递的消息数，Redis >= 7)；
+        旧版本 Redis 没有 lag 字段时退回到 XLEN
+        """
+        self._ensure_group(queue_name)
+        stream_key = f"procurator:queue:{queue_name}"
+        for group in self.client.xinfo_groups(stream_key):
+            if group.get("name") == self.group_name and group.get("lag") is not None:
+                return int(group["lag"])
+        return int(self.client.xlen(stream_key))
+
+    def release_pending(self, queue_name: str) -> int:
+        """
+        释放当前消费者 PEL 中的所有消息 (已预取但未处理/未 ACK)
+        已进入终态 (completed / failed / cancelled) 的任务只 ACK，不重新入队也不覆盖状态
+        返回重新入队的消息数
+        """
+        self._ensure_group(queue_name)
+        stream_key = f"procurator:queue:{queue_name}"
+        released = 0
+
+        try:
+            pendings = self.client.xpending_range(
+                stream_key,
+                self.group_name,
+                min="-",
+                max="+",
+                count=100,
+                consumername=self.consumer_name
+            )
+            for p in pendings:
+                msg_id = p["message_id"]
+                entries = self.client.xrange(stream_key, min=msg_id, max=msg_id, count=1)
+                tid = entries[0][1].get("tid") if entries else None
+                status = self.client.hget(f"procurator:task:{tid}", "status") if tid else None
+                requeue = status is not None and status not in FINAL_STATUSES
+                pipeline = self.client.pipeline(transaction=True)
+                if requeue:
+                    pipeline.xadd(stream_key, {"tid": tid})
+                    pipeline.hset(f"procurator:task:{tid}", "status", "pending")
+                pipeline.xack(stream_key, self.group_name, msg_id)
+                pipeline.execute()
+                if requeue:
+                    released += 1
+        except Exception as e:
+            logger.error(f"Error releasing pending for {queue_name}: {e}")
+
+        if released:
+            logger.info(f"Released {released} pending messages of {self.consumer_name} in {queue_name}")
+        return released
+
+    def cancel(self, tid: str) -> Optional[str]:
+        """
+        取消任务，返回取消前的状态 (任务不存在返回 None)
+        pending 的任务保留在 Stream 中，出队时认领脚本会跳过并 ACK
+        """
+        return self._cancel_script(keys=[f"procurator:task:{tid}"], args=[time.time()])
+
+    def mark_cancelled(self, tid: str, payload: dict = None):
+        """
+        执行中的任务已被取消：ACK 并标记为 cancelled (不进入 DLQ)
+        """
+        self._ack_and_update(tid, "cancelled")
+
     def mark_done(self, tid: str, payload: dict = None):
         """
         标记完成并 ACK
@@ -276,6 +703,11 @@ class RedisStreamBackend:
                 info["payload"] = json.loads(info["payload"])
             except:
                 pass
+        if "result" in info and isinstance(info["result"], str):
+            try:
+                info["result"] = json.loads(info["result"])
+            except Exception:
+                pass
         return info
 
     def save_task(self, tid, data):
@@ -0,0 +1,77 @@
+import json
+import asyncio
+from contextvars import ContextVar
+from typing import Callable, List, Optional
+from app.core.config import config
+from app.core.redis import redis_client
+from app.core.log_utils import get_logger
+
+logger = get_logger("control")
+
+CONTROL_CHANNEL = "procurator:control"
+
+# 当前正在执行的任务 ID (Worker 执行任务时设置，供 ScriptRunner 等关联子进程)
+current_task_id: ContextVar[Optional[str]] = ContextVar("current_task_id", default=None)
+
+
+class ControlBus:
+    """
+    Worker 控制通道 (如取消执行中的任务)
+    Redis 模式下通过 Pub/Sub 广播给所有 Worker；Memory 模式下直接分发给本进程的处理函数
+    """
+
+    def __init__(self):
+        self.enabled = config.get("QUEUE_BACKEND", "memory").lower() == "redis"
+        self._handlers: List[Callable[[dict], None]] = []
+
+    def subscribe(self, handler: Callable[[dict], None]):
+        if handler not in self._handlers:
+            self._handlers.append(handler)
+
+    def unsubscribe(self, handler: Callable[[dict], None]):
+        if handler in self._handlers:
+            self._handlers.remove(handler)
+
+    def _dispatch(self, message: dict):
+        for handler in list(self._handlers):
+            try:
+                handler(message)
+            except Exception as e:
+                logger.error(f"Control handler failed for {message}: {e}")
+
+    async def publish(self, message: dict):
+        if not self.enabled:
+            self._dispatch(message)
+            return
+        await redis_client.get_async_client().publish(CONTROL_CHANNEL, json.dumps(message))
+
+    async def listen(self):
+        """
+        订阅 Redis 控制频道并分发消息 (由 Worker 作为后台任务运行)
+        """
+        if not self.enabled:
+            return
+
+        while True:
+            pubsub = redis_client.get_async_client().pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(CONTROL_CHANNEL)
+                async for raw in pubsub.listen():
+                    try:
+                        message = json.loads(raw["data"])
+                    except Exception:
+                        continue
+                    self._dispatch(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Control channel error: {e}")
+                await asyncio.sleep(1)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+
+control_bus = ControlBus()
@@ -1,7 +1,8 @@
 import uuid
 import time
+import asyncio
 import threading
-from typing import Dict, Optional, Tuple
+from typing import Dict, Optional, Set, Tuple
 from app.core.metrics import TASK_ENQUEUED_TOTAL, TASK_QUEUE_SIZE
 from app.core.config import config
 from app.core.log_utils import get_logger
@@ -13,9 +14,21 @@ class MemoryBackend:
         self.tasks = {}
         self.queues = {"api": [], "script": []}
         self.lock = threading.Lock()
+        # 每个队列的唤醒事件: queue_name -> (loop, asyncio.Event)
+        self._waiters = {}
 
-    def enqueue(self, queue_name: str, payload: dict) -> str:
-        tid = str(uuid.uuid4())
+    def enqueue(self, queue_name: str, payload: dict, tid: Optional[str] = None) -> str:
+        tid = tid or str(uuid.uuid4())
+        self._push(queue_name, payload, tid, once=False)
+        return tid
+
+    def enqueue_once(self, queue_name: str, payload: dict, tid: str) -> bool:
+        """
+        以确定的 tid 入队，任务已存在时不重复入队 (返回 False)
+        """
+        return self._push(queue_name, payload, tid, once=True)
+
+    def _push(self, queue_name: str, payload: dict, tid: str, once: bool) -> bool:
         task_info = {
             "id": tid,
             "task": payload.get("task"),
@@ -26,7 +39,10 @@ class MemoryBackend:
         }
         
         with self.lock:
-            if tid not in self.tasks:
+            if tid in self.tasks:
+                if once:
+                    return False
+            else:
                 self.tasks[tid] = task_info
             
             if queue_name not in self.queues:
@@ -39,12 +55,66 @@ class MemoryBackend:
                 TASK_QUEUE_SIZE.labels(queue=queue_name).inc()
             except Exception:
                 pass
-        
+
+        self._wake(queue_name)
+        return True
+
+    def record_completed(self, queue_name: str, payload: dict, result=None, tid: Optional[str] = None) -> str:
+        """
+        直接写入已完成的任务记录，不进入队列 (结果缓存命中的异步分发)
+        """
+        tid = tid or str(uuid.uuid4())
+        now = time.time()
+        with self.lock:
+            self.tasks[tid] = {
+                "id": tid,
+                "task": payload.get("task"),
+                "status": "completed",
+                "created_at": now,
+                "updated_at": now,
+                "payload": payload,
+                "queue": queue_name,
+                "result": result,
+                "cached": True
+            }
         return tid
 
+    def _wake(self, queue_name: str):
+        """
+        唤醒等待该队列的 Worker (enqueue 可能来自其他线程，需 call_soon_threadsafe)
+        """
+        waiter = self._waiters.get(queue_name)
+        if not waiter:
+            return
+        loop, event = waiter
+        try:
+            loop.call_soon_threadsafe(event.set)
+        except RuntimeError:
+            # 事件循环已关闭
+            self._waiters.pop(queue_name, None)
+
+    async def adequeue(self, queue_name: str) -> Optional[Tuple[str, dict]]:
+        """
+        异步出队：队列为空时挂起等待入队事件，空闲期间不轮询
+        """
+        loop = asyncio.get_running_loop()
+        waiter = self._waiters.get(queue_name)
+        if waiter is None or waiter[0] is not loop:
+            waiter = (loop, asyncio.Event())
+            self._waiters[queue_name] = waiter
+        event = waiter[1]
+
+        while True:
+            # 先 clear 再检查队列，避免丢失两者之间发生的唤醒
+            event.clear()
+            item = self.dequeue(queue_name)
+            if item:
+                return item
+            await event.wait()
+
     def dequeue(self, queue_name: str) -> Optional[Tuple[str, dict]]:
         with self.lock:
-            if queue_name in self.queues and self.queues[queue_name]:
+            while queue_name in self.queues and self.queues[queue_name]:
                 tid = self.queues[queue_name].pop(0)
                 
                 # Prometheus Metrics
@@ -54,10 +124,93 @@ class MemoryBackend:
                     pass
 
                 task = self.tasks.get(tid)
-                if task:
-                    return tid, task["payload"]
+                if not task:
+                    continue
+                if task.get("status") == "cancelled" or task.get("cancel_requested"):
+                    # 排队期间已被取消，跳过执行
+                    task["status"] = "cancelled"
+                    continue
+                task["status"] = "processing"
+                task["updated_at"] = time.time()
+                return tid, task["payload"]
         return None
 
+    def cancel(self, tid) -> Optional[str]:
+        """
+        取消任务，返回取消前的状态 (任务不存在返回 None)
+        pending 的任务直接移出队列；processing 的任务由执行中的 Worker 处理
+        """
+        with self.lock:
+            task = self.tasks.get(tid)
+            if not task:
+                return None
+            status = task.get("status")
+            if status == "pending":
+                queue = self.queues.get(task.get("queue"), [])
+                if tid in queue:
+                    queue.remove(tid)
+                    try:
+                        TASK_QUEUE_SIZE.labels(queue=task.get("queue")).dec()
+                    except Exception:
+                        pass
+                task["status"] = "cancelled"
+                task["updated_at"] = time.time()
+            elif status == "processing":
+                task["cancel_requested"] = time.time()
+            return status
+
+    def mark_cancelled(self, tid, payload=None):
+        self.update_status(tid, "cancelled")
+
+    def queue_depth(self, queue_name: str) -> int:
+        """
+        尚未被 Worker 取走的任务数
+        """
+        with self.lock:
+            return len(self.queues.get(queue_name, []))
+
+    def release(self, tid):
+        """
+        将已出队但未完成的任务放回队首 (Worker 停机 Drain 时使用)
+        """
+        with self.lock:
+            task = self.tasks.get(tid)
+            if not task:
+                return False
+            queue_name = task.get("queue") or "api"
+            task["status"] = "pending"
+            task["updated_at"] = time.time()
+            self.queues.setdefault(queue_name, []).insert(0, tid)
+            try:
+                TASK_QUEUE_SIZE.labels(queue=queue_name).inc()
+            except Exception:
+                pass
+        self._wake(queue_name)
+        return True
+
+    def requeue(self, tid, payload: dict, error=None) -> bool:
+        """
+        失败重试：以新的 payload (携带 _retry_count) 放回队尾
+        """
+        with self.lock:
+            task = self.tasks.get(tid)
+            if not task:
+                return False
+            queue_name = task.get("queue") or "api"
+            task["status"] = "pending"
+            task["payload"] = payload
+            task["retry_count"] = payload.get("_retry_count", 0)
+            task["updated_at"] = time.time()
+            if error:
+                task["error"] = error
+            self.queues.setdefault(queue_name, []).append(tid)
+            try:
+                TASK_QUEUE_SIZE.labels(queue=queue_name).inc()
+            except Exception:
+                pass
+        self._wake(queue_name)
+        return True
+
     def mark_done(self, tid, payload=None):
         self.update_status(tid, "completed")
 
@@ -93,11 +246,26 @@ class QueueManager:
             self.backend = MemoryBackend()
             logger.info("Using MemoryBackend")
 
-    def enqueue(self, queue_name: str, payload: dict) -> str:
-        return self.backend.enqueue(queue_name, payload)
+    def enqueue(self, queue_name: str, payload: dict, tid: Optional[str] = None) -> str:
+        # tid 可由调用方预先生成 (幂等键需要在入队前占位)
+        return self.backend.enqueue(queue_name, payload, tid=tid)
+
+    def enqueue_once(self, queue_name: str, payload: dict, tid: str) -> bool:
+        # 幂等入队：以确定的 tid 入队，任务已存在时返回 False (编排回调的重复投递不会重复入队)
+        return self.backend.enqueue_once(queue_name, payload, tid)
 
     def dequeue(self, queue_name: str) -> Optional[Tuple[str, dict]]:
         return self.backend.dequeue(queue_name)
+
+    def record_completed(self, queue_name: str, payload: dict, result=None, tid: Optional[str] = None) -> str:
+        # 不入队，直接写入已完成的任务记录 (结果缓存命中时仍返回可查询的 task_id)
+        return self.backend.record_completed(queue_name, payload, result=result, tid=tid)
+
+    async def adequeue(self, queue_name: str) -> Optional[Tuple[str, dict]]:
+        # 事件驱动出队；后端不支持时退回到线程池中的同步 dequeue
+        if hasattr(self.backend, "adequeue"):
+            return await self.backend.adequeue(queue_name)
+        return await asyncio.to_thread(self.backend.dequeue, queue_name)
     
     def mark_done(self, tid, payload=None):
         if hasattr(self.backend, "mark_done"):
@@ -111,6 +279,56 @@ class QueueManager:
         if hasattr(self.backend, "get_task"):
             return self.backend.get_task(tid)
         return None
+
+    def process_pending(self, queue_name: str, alive_consumers: Optional[Set[str]] = None) -> int:
+        # Crash Recovery：抢占超时或已死亡消费者的 Pending 消息 (仅 Redis Stream)
+        if hasattr(self.backend, "process_pending"):
+            return self.backend.process_pending(queue_name, alive_consumers)
+        return 0
+
+    def cancel(self, tid) -> Optional[str]:
+        # 返回取消前的状态，任务不存在返回 None
+        if hasattr(self.backend, "cancel"):
+            return self.backend.cancel(tid)
+        return None
+
+    def mark_cancelled(self, tid, payload=None):
+        if hasattr(self.backend, "mark_cancelled"):
+            self.backend.mark_cancelled(tid, payload)
+
+    def release(self, tid) -> bool:
+        # 释放未完成的任务，使其立即可被其他消费者获取
+        if hasattr(self.backend, "release"):
+            return self.backend.release(tid)
+        return False
+
+    def requeue(self, tid, payload: dict, error=None) -> bool:
+        # 失败重试：放回队列再次执行，后端不支持时返回 False (按最终失败处理)
+        if hasattr(self.backend, "requeue"):
+            return self.backend.requeue(tid, payload, error)
+        return False
+
+    def supports_redelivery(self) -> bool:
+        # 未 ACK 的消息会被重新投递 (Redis Stream PEL)；Memory 后端出队即移除，没有重新投递
+        return hasattr(self.backend, "process_pending")
+
+    def defer(self, tid) -> int:
+        # 编排回调失败：保留消息并退避后重新投递，返回累计失败次数 (后端不支持重新投递时返回 0)
+        if hasattr(self.backend, "defer"):
+            return self.backend.defer(tid)
+        return 0
+
+    def queue_depth(self, queue_name: str) -> Optional[int]:
+        # 队列积压 (尚未投递给 Worker 的消息数)，后端不支持时返回 None
+        if hasattr(self.backend, "queue_depth"):
+            return self.backend.queue_depth(queue_name)
+        return None
+
+    def release_pending(self, queue_name: str) -> int:
+        # 释放当前消费者名下所有已预取但未 ACK 的消息 (仅 Redis Stream 存在 PEL)
+        if hasattr(self.backend, "release_pending"):
+            return self.backend.release_pending(queue_name)
+        return 0
         
     def status(self, tid):
         # 兼容旧 API
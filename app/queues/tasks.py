@@ -1,10 +1,25 @@
 import importlib
 import asyncio
-from typing import Any, Dict
+from typing import Any, Callable, Dict, Optional, Tuple, Type
+from pydantic import BaseModel
+from app.core.config import config
 from app.core.log_utils import get_logger
+from app.core.executors import executors, resolve_executor
+from app.core.validation import resolve_input_schema
+from app.infra.result_cache import resolve_cache_policy
+from app.infra.singleflight import resolve_coalesce
+from app.services.task_registry import task_registry
 
 logger = get_logger("tasks")
 
+class TaskTimeoutError(TimeoutError):
+    """任务执行超过 registered_tasks.timeout_seconds"""
+
+
+class TaskCancelledError(Exception):
+    """任务被 DELETE /task/{tid} 取消"""
+
+
 # 允许的任务列表 (模拟 task_map)
 ALLOWED_TASKS = {
     "feishu_get_token": "app.services.feishu.get_token",
@@ -18,7 +33,9 @@ ALLOWED_TASKS = {
 }
 
 def is_allowed(task: str, queue: str, role: str) -> bool:
-    # 鉴权逻辑
+    # 鉴权逻辑：registered_tasks 中被停用的任务一律拒绝 (读取进程内快照，无 DB 查询)
+    if not task_registry.is_active(task):
+        return False
     if task in ALLOWED_TASKS or task.startswith("test."):
         return True
     return False
@@ -29,9 +46,70 @@ def list_tasks():
 def list_scripts():
     return []
 
-def validate_task_input(task: str, data: dict) -> dict:
-    # 透传，实际应调用 Pydantic 模型
-    return data
+# 任务输入模型缓存: task_name -> Pydantic 模型 (None 表示未登记，透传)
+_INPUT_SCHEMAS: Dict[str, Optional[Type[BaseModel]]] = {}
+
+
+def get_input_schema(task: str) -> Optional[Type[BaseModel]]:
+    """
+    查找任务登记的输入模型 (与处理函数一起通过 @input_schema 登记)，结果缓存
+    """
+    if task in _INPUT_SCHEMAS:
+        return _INPUT_SCHEMAS[task]
+    try:
+        func, _ = get_handler(task)
+        model = resolve_input_schema(func)
+    except Exception:
+        model = None
+    _INPUT_SCHEMAS[task] = model
+    return model
+
+
+def validate_task_input(task: str, data: dict):
+    """
+    按任务登记的输入模型校验 taskData，未登记模型的任务透传
+    校验失败抛出 pydantic.ValidationError
+    """
+    model = get_input_schema(task)
+    if model is None:
+        return data
+    return model.model_validate(data)
+
+# 结果缓存策略缓存: task_name -> {"ttl", "when"} (None 表示未开启缓存)
+_CACHE_POLICIES: Dict[str, Optional[dict]] = {}
+
+
+def get_cache_policy(task: str) -> Optional[dict]:
+    """
+    查找任务处理函数通过 @cacheable 登记的结果缓存策略，结果缓存
+    """
+    if task in _CACHE_POLICIES:
+        return _CACHE_POLICIES[task]
+    try:
+        func, _ = get_handler(task)
+        policy = resolve_cache_policy(func)
+    except Exception:
+        policy = None
+    _CACHE_POLICIES[task] = policy
+    return policy
+
+# 同步请求合并开关缓存: task_name -> bool
+_COALESCED: Dict[str, bool] = {}
+
+
+def is_coalesced(task: str) -> bool:
+    """
+    任务处理函数是否通过 @coalesce 开启了同步分发的请求合并，结果缓存
+    """
+    if task in _COALESCED:
+        return _COALESCED[task]
+    try:
+        func, _ = get_handler(task)
+        enabled = resolve_coalesce(func)
+    except Exception:
+        enabled = False
+    _COALESCED[task] = enabled
+    return enabled
 
 def get_task_webhook(task: str):
     return None
@@ -39,35 +117,93 @@ def get_task_webhook(task: str):
 def get_task_async_mode(task: str):
     return "Free"
 
-async def handle_task(task_name: str, task_data: dict) -> Any:
-    logger.info(f"Handling task: {task_name}")
-    
-    # if task_name == "proxy_forward":
-    #     # Proxy forward async logic - placeholder implementation
-    #     # In real app, this would use httpx to forward request
-    #     return {"status": "forwarded (mock)"}
+# 预解析的任务分发表: task_name -> (处理函数, 执行池类型)
+# Worker 启动时由 build_dispatch_table 一次性构建，分发时只做一次字典查找
+_DISPATCH_TABLE: Dict[str, Tuple[Callable, Optional[str]]] = {}
+
 
+def _resolve_handler(task_name: str) -> Tuple[Callable, Optional[str]]:
     module_path_str = ALLOWED_TASKS.get(task_name)
     if not module_path_str:
-        if task_name.startswith("test."):
-             return f"Test task {task_name} executed"
         raise ValueError(f"Task {task_name} handler not found")
 
+    module_name, func_name = module_path_str.rsplit(".", 1)
     try:
-        module_name, func_name = module_path_str.rsplit(".", 1)
         module = importlib.import_module(module_name)
-        func = getattr(module, func_name)
-        
-        if asyncio.iscoroutinefunction(func):
-            return await func(task_data)
-        else:
-            return func(task_data)
     except ImportError as e:
         logger.error(f"Import error for {task_name}: {e}")
         raise
+    try:
+        func = getattr(module, func_name)
     except AttributeError as e:
         logger.error(f"Function not found for {task_name}: {e}")
         raise
+    return func, resolve_executor(func)
+
+
+def build_dispatch_table(warmup: Optional[bool] = None) -> Dict[str, Tuple[Callable, Optional[str]]]:
+    """
+    将 ALLOWED_TASKS 解析为可直接调用的分发表 (预先导入所有处理函数模块)
+    warmup: 导入后调用模块级的 warmup() 钩子 (如预建连接)，默认读取 TASK_WARMUP
+    解析失败的任务不会进入分发表，分发时再次尝试并抛出原始错误
+    """
+    if warmup is None:
+        warmup = config.get("TASK_WARMUP", "1") == "1"
+
+    table = {}
+    for task_name in ALLOWED_TASKS:
+        try:
+            table[task_name] = _resolve_handler(task_name)
+        except Exception as e:
+            logger.error(f"Failed to resolve handler for {task_name}: {e}")
+
+    _DISPATCH_TABLE.clear()
+    _DISPATCH_TABLE.update(table)
+    _INPUT_SCHEMAS.clear()
+    _CACHE_POLICIES.clear()
+    _COALESCED.clear()
+
+    if warmup:
+        warmed = set()
+        for func, _ in table.values():
+            module = importlib.import_module(func.__module__)
+            hook = getattr(module, "warmup", None)
+            if module.__name__ in warmed or not callable(hook):
+                continue
+            warmed.add(module.__name__)
+            try:
+                hook()
+            except Exception as e:
+                logger.error(f"Warmup failed for {module.__name__}: {e}")
+
+    logger.info(f"Dispatch table built with {len(table)} handlers")
+    return _DISPATCH_TABLE
+
+
+def get_handler(task_name: str) -> Tuple[Callable, Optional[str]]:
+    """
+    O(1) 查找任务处理函数；分发表未构建 (或任务在构建后才加入) 时懒解析并缓存
+    未知任务抛出 ValueError
+    """
+    entry = _DISPATCH_TABLE.get(task_name)
+    if entry is None:
+        entry = _resolve_handler(task_name)
+        _DISPATCH_TABLE[task_name] = entry
+    return entry
+
+
+async def handle_task(task_name: str, task_data: dict) -> Any:
+    logger.info(f"Handling task: {task_name}")
+
+    if task_name not in ALLOWED_TASKS and task_name.startswith("test."):
+        return f"Test task {task_name} executed"
+
+    func, kind = get_handler(task_name)
+    try:
+        if kind is None:
+            return await func(task_data)
+        # 同步处理函数不能在事件循环中直接调用，交给有界线程池/进程池
+        return await executors.run(kind, func, task_data, task_name)
     except Exception as e:
         logger.error(f"Execution failed for {task_name}: {e}")
         raise
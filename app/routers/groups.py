@@ -0,0 +1,38 @@
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from app.core.security import token_dependency
+from app.routers.workflows import TaskSpec, prepare_node
+from app.services.groups import group_manager
+
+router = APIRouter(prefix="/groups", tags=["Groups"])
+
+
+class GroupRequest(BaseModel):
+    tasks: List[TaskSpec] = Field(..., min_length=1)
+    # chord 回调：全部成员结束后入队一次，taskData._results 为按成员顺序排列的结果
+    callback: Optional[TaskSpec] = None
+    webhook: Optional[str] = None
+
+
+@router.post("")
+async def submit_group(req: GroupRequest, ident=Depends(token_dependency)):
+    """
+    批量分发一组任务，返回 group_id；全部成员结束后触发回调任务与组级 Webhook (各一次)
+    """
+    role = ident.get("role")
+    members = [prepare_node(t, role, f"member {i}") for i, t in enumerate(req.tasks)]
+    callback = prepare_node(req.callback, role, "callback") if req.callback else None
+    gid, tids = await group_manager.submit(members, callback=callback, webhook=req.webhook)
+    return {"accepted": True, "group_id": gid, "task_ids": tids}
+
+
+@router.get("/{gid}")
+async def get_group(gid: str, results: bool = False):
+    """
+    任务组进度 (results=true 时附带按成员顺序排列的结果)
+    """
+    info = await group_manager.get(gid, include_results=results)
+    if info is None:
+        raise HTTPException(status_code=404, detail="Group not found")
+    return info
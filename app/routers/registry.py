@@ -0,0 +1,95 @@
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel
+from typing import Optional
+from app.core.database import AsyncSessionLocal
+from app.core.security import token_dependency
+from sqlalchemy.future import select
+from app.models.system import RegisteredTask, Webhook
+from app.services.task_registry import task_registry
+from app.services.webhook_config import webhook_config_cache
+
+router = APIRouter(prefix="/registry", tags=["Registry"])
+
+
+class RegisteredTaskUpdate(BaseModel):
+    default_queue: Optional[str] = None
+    max_retries: Optional[int] = None
+    timeout_seconds: Optional[int] = None
+    is_active: Optional[bool] = None
+    description: Optional[str] = None
+
+
+class WebhookUpdate(BaseModel):
+    url: str
+    is_active: Optional[bool] = True
+
+
+def _require_admin(ident: dict):
+    if ident.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Only admin can modify task registry")
+
+
+@router.get("")
+def list_registered_tasks():
+    """
+    当前进程内的 registered_tasks 快照
+    """
+    return {"tasks": task_registry.snapshot()}
+
+
+@router.put("/{task_name}")
+async def update_registered_task(task_name: str, req: RegisteredTaskUpdate, ident=Depends(token_dependency)):
+    """
+    新增或修改任务配置 (启用/停用、默认队列、重试、超时)，并通知所有进程重新加载，无需重启
+    """
+    _require_admin(ident)
+    values = req.model_dump(exclude_unset=True)
+    try:
+        async with AsyncSessionLocal() as session:
+            row = await session.get(RegisteredTask, task_name)
+            if row is None:
+                row = RegisteredTask(task_name=task_name)
+                session.add(row)
+            for k, v in values.items():
+                setattr(row, k, v)
+            await session.commit()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to update task registry: {e}")
+
+    await task_registry.notify_changed()
+    return {"task_name": task_name, "updated": values}
+
+
+@router.put("/{task_name}/webhook")
+async def update_task_webhook(task_name: str, req: WebhookUpdate, ident=Depends(token_dependency)):
+    """
+    设置任务的默认 Webhook (请求未指定 webhook 时使用)，并通知所有进程丢弃 Webhook 配置快照
+    """
+    _require_admin(ident)
+    try:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(Webhook).where(Webhook.task_name == task_name).order_by(Webhook.id)
+            )
+            row = result.scalars().first()
+            if row is None:
+                row = Webhook(task_name=task_name)
+                session.add(row)
+            row.url = req.url
+            row.is_active = req.is_active
+            await session.commit()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to update webhook: {e}")
+
+    await webhook_config_cache.notify_changed()
+    return {"task_name": task_name, "webhook": req.url, "is_active": req.is_active}
+
+
+@router.post("/reload")
+async def reload_registry(ident=Depends(token_dependency)):
+    """
+    直接修改数据库后，手动通知所有进程重新加载 (任务配置与 Webhook 配置快照)
+    """
+    _require_admin(ident)
+    await task_registry.notify_changed()
+    return {"reloading": True}
@@ -0,0 +1,23 @@
+from fastapi import APIRouter, HTTPException
+from app.infra.worker_registry import worker_registry
+
+router = APIRouter(prefix="/workers", tags=["Workers"])
+
+
+@router.get("")
+async def list_workers():
+    """
+    汇总所有存活 Worker 的心跳 (心跳过期的 Worker 自动剔除)
+    """
+    try:
+        workers = await worker_registry.list_workers()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to read worker heartbeats: {e}")
+
+    workers.sort(key=lambda w: w.get("worker_id", ""))
+    return {
+        "count": len(workers),
+        "inflight": sum(int(w.get("inflight") or 0) for w in workers),
+        "tps": round(sum(float(w.get("tps") or 0) for w in workers), 3),
+        "workers": workers,
+    }
@@ -0,0 +1,81 @@
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel, Field
+from typing import List, Optional, Tuple
+from app.core.config import config
+from app.core.security import token_dependency
+from app.queues.tasks import is_allowed, validate_task_input
+from app.services.task_registry import task_registry
+from app.services.workflow import workflow_engine, validate_dag
+
+router = APIRouter(prefix="/workflows", tags=["Workflows"])
+
+
+class TaskSpec(BaseModel):
+    task: str
+    taskData: dict = {}
+    queue: Optional[str] = None
+    maxRetries: Optional[int] = None
+
+
+class WorkflowNode(TaskSpec):
+    id: str
+
+
+class WorkflowRequest(BaseModel):
+    nodes: List[WorkflowNode] = Field(..., min_length=1)
+    # 依赖边: [上游节点 ID, 下游节点 ID]
+    edges: List[Tuple[str, str]] = []
+    webhook: Optional[str] = None
+
+
+def prepare_node(node: TaskSpec, role: str, label: str) -> dict:
+    """
+    与 /dispatch 相同的鉴权、参数校验、队列与重试次数选择 (工作流节点 / 任务组成员共用)
+    """
+    queue = node.queue or task_registry.default_queue(node.task) or "api"
+    if not is_allowed(node.task, queue, role):
+        raise HTTPException(status_code=422, detail=f"Task not allowed or unknown: {node.task} ({label})")
+    try:
+        validated = validate_task_input(node.task, node.taskData)
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Invalid task params for {label}: {e}")
+    if hasattr(validated, "model_dump"):
+        validated = validated.model_dump(mode="json", exclude_unset=True)
+
+    max_retries = None
+    if node.maxRetries and node.maxRetries > 0:
+        max_retries = int(node.maxRetries)
+    elif task_registry.max_retries(node.task) is not None:
+        max_retries = int(task_registry.max_retries(node.task))
+    elif config.get("RETRY_MAX"):
+        try:
+            max_retries = int(config.get("RETRY_MAX"))
+        except Exception:
+            pass
+    return {"task": node.task, "taskData": validated, "queue": queue, "_max_retries": max_retries}
+
+
+@router.post("")
+async def submit_workflow(req: WorkflowRequest, ident=Depends(token_dependency)):
+    """
+    提交 DAG 工作流：根节点立即入队，其余节点在全部上游完成后由 Worker 触发
+    """
+    try:
+        validate_dag([n.id for n in req.nodes], req.edges)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    nodes = {n.id: prepare_node(n, ident.get("role"), f"node {n.id}") for n in req.nodes}
+    wid = await workflow_engine.submit(nodes, req.edges, webhook=req.webhook)
+    return {"accepted": True, "workflow_id": wid}
+
+
+@router.get("/{wid}")
+async def get_workflow(wid: str):
+    """
+    工作流状态与各节点的状态 / 任务 ID / 结果
+    """
+    info = await workflow_engine.get(wid)
+    if info is None:
+        raise HTTPException(status_code=404, detail="Workflow not found")
+    return info
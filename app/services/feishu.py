@@ -1,9 +1,52 @@
-from app.infra.feishu_client import get_tenant_access_token, redis_client, REDIS_KEY_TOKEN
+from app.infra.feishu_client import get_tenant_access_token, get_session, redis_client, REDIS_KEY_TOKEN
 from app.core.config import config
 import time
 import hashlib
 import json
+from typing import Optional
+from pydantic import BaseModel, ConfigDict, Field
+from app.core.validation import input_schema
+from app.infra.result_cache import cacheable, result_cache
+from app.infra.singleflight import coalesce
 
+
+class GetTokenInput(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    app_id: Optional[str] = None
+    app_secret: Optional[str] = None
+    app_hash: Optional[str] = None
+
+
+class SetTokenInput(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    app_id: Optional[str] = None
+    app_secret: Optional[str] = None
+    token: Optional[str] = None
+    expire: int = Field(3600, gt=0)
+
+
+def warmup():
+    # Worker 启动时预建飞书 API 的 HTTP Session (build_dispatch_table 调用)
+    get_session()
+
+
+# get_token 的任务名 (set_token 更新凭证后丢弃其缓存结果)
+GET_TOKEN_TASK = "feishu_get_token"
+
+
+def _remaining_expire(result: dict, age: float) -> dict:
+    # 缓存命中时 expire 扣减已缓存的时长，保持为剩余有效期
+    if isinstance(result, dict) and isinstance(result.get("expire"), (int, float)):
+        return {**result, "expire": max(0, int(result["expire"] - age))}
+    return result
+
+
+# tenant_access_token 有效期约 2 小时，短 TTL 缓存避免重复请求飞书
+@cacheable(ttl=300, on_hit=_remaining_expire)
+@coalesce
+@input_schema(GetTokenInput)
 async def get_token(data: dict):
     # 支持两种模式：
     # 1. 直接传入 app_id / app_secret
@@ -31,6 +74,7 @@ async def get_token(data: dict):
     token, expire = get_tenant_access_token(app_id, app_secret)
     return {"tenant_access_token": token, "expire": expire}
 
+@input_schema(SetTokenInput)
 async def set_token(data: dict):
     """
     应用注册/凭证更新接口
@@ -48,6 +92,7 @@ async def set_token(data: dict):
         expire = data.get("expire", 3600)
         cache_key = f"{REDIS_KEY_TOKEN}:{app_id}"
         redis_client.set(cache_key, manual_token, ex=expire)
+        await result_cache.invalidate(GET_TOKEN_TASK)
         return {"status": "ok", "msg": "Token manually updated"}
 
     if not app_id or not app_secret:
@@ -77,6 +122,8 @@ async def set_token(data: dict):
     
     # 存储凭证，设置较长的过期时间 (例如 30 天)，或者不设置过期
     redis_client.set(cred_key, cred_data)
+    # 凭证更新后不再返回旧凭证缓存的 Token
+    await result_cache.invalidate(GET_TOKEN_TASK)
 
     return {
         "status": "registered", 
@@ -0,0 +1,270 @@
+import asyncio
+import json
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import config
+from app.core.redis import redis_client
+from app.core.log_utils import get_logger
+from app.queues.task_queue import queue_manager
+from app.services.task_persistence import persist_task_init
+from app.infra.webhook import notify
+
+logger = get_logger("groups")
+
+# Redis Key: 每个任务组一个 Hash
+# status / total / finished / failed / spec / tids / created_at / finished_at / callback_tid
+# result:{index}, error:{index}, done:{index} (完成去重), fired (回调只触发一次), notified (Webhook 只通知一次)
+GROUP_KEY_PREFIX = "procurator:group:"
+
+# 成员完成 (原子执行)：done:{index} 去重 -> 记录结果 -> 完成计数加一
+# 最后一个成员完成时通过 HSETNX fired 保证回调恰好触发一次
+# 重复投递时若已 fired 但组仍为 running (上次回调在入队前中断)，再次返回 1，由调用方幂等补发
+# 返回 {是否需要触发回调 (0/1), 已完成数}
+MEMBER_FINISHED_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return {0, 0}
+end
+if redis.call('HSETNX', KEYS[1], 'done:' .. ARGV[1], ARGV[2]) == 0 then
+    if redis.call('HEXISTS', KEYS[1], 'fired') == 1 and redis.call('HGET', KEYS[1], 'status') == 'running' then
+        return {1, tonumber(redis.call('HGET', KEYS[1], 'finished'))}
+    end
+    return {0, 0}
+end
+redis.call('HSET', KEYS[1], 'result:' .. ARGV[1], ARGV[3])
+if ARGV[2] ~= 'completed' then
+    redis.call('HSET', KEYS[1], 'error:' .. ARGV[1], ARGV[4])
+    redis.call('HINCRBY', KEYS[1], 'failed', 1)
+end
+local finished = redis.call('HINCRBY', KEYS[1], 'finished', 1)
+if finished >= tonumber(redis.call('HGET', KEYS[1], 'total')) then
+    if redis.call('HSETNX', KEYS[1], 'fired', 1) == 1 then
+        return {1, finished}
+    end
+end
+return {0, finished}
+"""
+
+
+def callback_task_id(gid: str) -> str:
+    """
+    chord 回调的任务 ID 由组 ID 确定，补发入队时不会产生重复任务
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{GROUP_KEY_PREFIX}{gid}/callback"))
+
+
+def _decode(value):
+    if value is None:
+        return None
+    try:
+        return json.loads(value)
+    except Exception:
+        return value
+
+
+class GroupManager:
+    """
+    任务组 (group) 与和弦 (chord)
+    - 一次提交多个成员任务，返回 group_id；成员完成时由 Worker 回调 on_task_finished 原子计数
+    - 最后一个成员完成时：可选的回调任务 (chord) 恰好入队一次，按成员顺序收到全部结果
+      (taskData["_results"]，失败成员为 null，失败下标见 taskData["_failed"])
+    - Webhook 以组为单位只通知一次，成员任务本身不发通知
+    - 回调任务 ID 由组 ID 确定并幂等入队；入队前中断时，重新投递的成员完成回调补发回调任务
+    """
+
+    def __init__(self):
+        self.enabled = config.get("QUEUE_BACKEND", "memory").lower() == "redis"
+        self._local: Dict[str, dict] = {}
+        self._finish_script = None
+
+    @staticmethod
+    def _key(gid: str) -> str:
+        return f"{GROUP_KEY_PREFIX}{gid}"
+
+    @staticmethod
+    def ttl() -> int:
+        return int(config.get("GROUP_TTL", 7 * 86400))
+
+    async def submit(self, members: List[dict], callback: Optional[dict] = None,
+                     webhook: Optional[str] = None) -> Tuple[str, List[str]]:
+        """
+        提交任务组
+        members / callback: {"task", "taskData", "queue", "_max_retries"} (调用方已完成鉴权与参数校验)
+        返回 (group_id, 成员 task_id 列表)
+        """
+        gid = str(uuid.uuid4())
+        spec = {"callback": callback, "webhook": webhook}
+        state = {
+            "status": "running",
+            "total": len(members),
+            "finished": 0,
+            "failed": 0,
+            "spec": json.dumps(spec),
+            "created_at": time.time(),
+        }
+        # 先写入组状态再入队成员，避免成员先于组状态完成
+        if self.enabled:
+            client = redis_client.get_async_client()
+            pipeline = client.pipeline(transaction=True)
+            pipeline.hset(self._key(gid), mapping=state)
+            pipeline.expire(self._key(gid), self.ttl())
+            await pipeline.execute()
+        else:
+            self._local[gid] = state
+
+        tids = []
+        for index, member in enumerate(members):
+            payload = {
+                "task": member["task"],
+                "taskData": member.get("taskData") or {},
+                "_group": {"id": gid, "index": index},
+            }
+            if member.get("_max_retries") is not None:
+                payload["_max_retries"] = member["_max_retries"]
+            tids.append(await self._enqueue(member.get("queue") or "api", payload))
+
+        await self._hset(gid, {"tids": json.dumps(tids)})
+        logger.info(f"Group {gid} submitted with {len(members)} members")
+        return gid, tids
+
+    async def _enqueue(self, queue: str, payload: dict, tid: Optional[str] = None) -> str:
+        # 指定 tid 时幂等入队，任务已存在则直接返回
+        if tid is None:
+            tid = await asyncio.to_thread(queue_manager.enqueue, queue, payload)
+        elif not await asyncio.to_thread(queue_manager.enqueue_once, queue, payload, tid):
+            return tid
+        await persist_task_init(tid, queue, payload["task"], payload)
+        return tid
+
+    async def _hset(self, gid: str, mapping: dict):
+        if self.enabled:
+            await redis_client.get_async_client().hset(self._key(gid), mapping=mapping)
+        elif gid in self._local:
+            self._local[gid].update(mapping)
+
+    async def _claim_notify(self, gid: str) -> bool:
+        """
+        组级 Webhook 的发送权 (HSETNX notified)，只有第一次成功
+        """
+        if self.enabled:
+            return bool(await redis_client.get_async_client().hsetnx(self._key(gid), "notified", 1))
+        state = self._local.get(gid)
+        if state is None or "notified" in state:
+            return False
+        state["notified"] = 1
+        return True
+
+    async def _load(self, gid: str) -> Optional[dict]:
+        if self.enabled:
+            raw = await redis_client.get_async_client().hgetall(self._key(gid))
+            return raw or None
+        state = self._local.get(gid)
+        return dict(state) if state else None
+
+    async def _finish_member(self, gid: str, index: int, status: str, result, error: Optional[str]) -> bool:
+        result_json = json.dumps(result, default=str)
+        if self.enabled:
+            if self._finish_script is None:
+                self._finish_script = redis_client.get_async_client().register_script(MEMBER_FINISHED_LUA)
+            fired, _ = await self._finish_script(
+                keys=[self._key(gid)],
+                args=[index, status, result_json, error or ""]
+            )
+            return bool(int(fired))
+
+        # Memory 模式：与 Lua 脚本逻辑一致 (单事件循环内无 await，天然原子)
+        state = self._local.get(gid)
+        if state is None:
+            return False
+        if f"done:{index}" in state:
+            return "fired" in state and state["status"] == "running"
+        state[f"done:{index}"] = status
+        state[f"result:{index}"] = result_json
+        if status != "completed":
+            state[f"error:{index}"] = error or ""
+            state["failed"] = int(state["failed"]) + 1
+        state["finished"] = int(state["finished"]) + 1
+        if state["finished"] >= int(state["total"]) and "fired" not in state:
+            state["fired"] = 1
+            return True
+        return False
+
+    def _results(self, state: dict) -> Tuple[List, List[int]]:
+        total = int(state.get("total") or 0)
+        results, failed = [], []
+        for i in range(total):
+            if state.get(f"done:{i}") not in (None, "completed"):
+                failed.append(i)
+                results.append(None)
+            else:
+                results.append(_decode(state.get(f"result:{i}")))
+        return results, failed
+
+    async def on_task_finished(self, payload: dict, status: str, result=None, error: Optional[str] = None):
+        """
+        Worker 回调：组成员进入终态 (completed / 最终 failed / cancelled)
+        """
+        meta = payload.get("_group") or {}
+        gid, index = meta.get("id"), meta.get("index")
+        if not gid or index is None:
+            return
+
+        if not await self._finish_member(gid, int(index), status, result, error):
+            return
+
+        # 最后一个成员：按顺序收集结果，触发回调任务与组级 Webhook (各一次)
+        # 组状态与 callback_tid 在回调入队之后一次写入，写入前中断时由重复投递补发
+        state = await self._load(gid) or {}
+        spec = json.loads(state.get("spec") or "{}")
+        results, failed = self._results(state)
+        group_status = "completed" if not failed else "failed"
+        update = {"status": group_status, "finished_at": time.time()}
+
+        callback = spec.get("callback")
+        if callback:
+            task_data = dict(callback.get("taskData") or {})
+            task_data["_results"] = results
+            task_data["_failed"] = failed
+            cb_payload = {"task": callback["task"], "taskData": task_data}
+            if callback.get("_max_retries") is not None:
+                cb_payload["_max_retries"] = callback["_max_retries"]
+            update["callback_tid"] = await self._enqueue(
+                callback.get("queue") or "api", cb_payload, tid=callback_task_id(gid)
+            )
+
+        await self._hset(gid, update)
+
+        # 补发回调时 (fired 之后中断) 不再重复通知
+        if spec.get("webhook") and await self._claim_notify(gid):
+            summary = {"total": len(results), "failed": failed, "results": results}
+            try:
+                await asyncio.to_thread(notify, gid, "group", {"webhook": spec["webhook"]}, group_status, summary, None)
+            except Exception:
+                pass
+        logger.info(f"Group {gid} finished ({group_status}, {len(failed)} failed)")
+
+    async def get(self, gid: str, include_results: bool = False) -> Optional[dict]:
+        state = await self._load(gid)
+        if not state:
+            return None
+        info = {
+            "group_id": gid,
+            "status": state.get("status"),
+            "total": int(state.get("total") or 0),
+            "finished": int(state.get("finished") or 0),
+            "failed": int(state.get("failed") or 0),
+            "task_ids": _decode(state.get("tids")) or [],
+            "callback_task_id": state.get("callback_tid"),
+            "created_at": float(state["created_at"]) if state.get("created_at") else None,
+            "finished_at": float(state["finished_at"]) if state.get("finished_at") else None,
+        }
+        if include_results:
+            info["results"], _ = self._results(state)
+            info["errors"] = {
+                i: state.get(f"error:{i}") for i in range(info["total"]) if f"error:{i}" in state
+            }
+        return info
+
+
+group_manager = GroupManager()
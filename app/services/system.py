@@ -1,14 +1,210 @@
 import time
 import asyncio
 import httpx
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Literal
+from typing_extensions import Annotated
+from pydantic import BaseModel, ConfigDict, Field, StringConstraints, field_validator
+from app.core.validation import input_schema
+from app.infra.singleflight import coalesce
+from app.infra.http_client import http_client_pool, BoundedResponse, PoolTimeoutError
+from app.infra.circuit_breaker import CircuitOpenError
+from app.infra.retry_policy import request_with_policy
+from app.infra.http_cache import http_response_cache, CACHEABLE_METHODS
 
+HttpUrlStr = Annotated[str, StringConstraints(strip_whitespace=True, pattern=r"^https?://")]
+# 响应体返回方式：body = 解析后的响应体 (JSON 或截断文本)；hash = 只返回 sha256 与大小；summary = 摘要 + 文本预览
+ResponseMode = Literal["body", "hash", "summary"]
+# hash / summary 模式只保留用于预览的前若干字节
+_PREVIEW_BYTES = 4096
+
+
+class ProxyForwardInput(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    urls: List[HttpUrlStr] = []
+    data: Dict[str, Any] = {}
+    headers: Dict[str, str] = {}
+    timeout: int = Field(5, gt=0)
+    response_mode: ResponseMode = "body"
+    max_response_bytes: Optional[int] = Field(None, gt=0)
+
+
+class ProxyRequestItem(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    url: HttpUrlStr
+    method: str = "POST"
+    data: Optional[Any] = None
+    headers: Dict[str, str] = {}
+    # 重试 / 对冲策略，未指定时使用批次级默认值
+    retries: Optional[int] = Field(None, ge=0, le=5)
+    hedge: Optional[bool] = None
+    response_mode: Optional[ResponseMode] = None
+    max_response_bytes: Optional[int] = Field(None, gt=0)
+    # GET/HEAD 是否使用共享 HTTP 响应缓存，未指定时使用批次级默认值
+    cache: Optional[bool] = None
+
+    @field_validator("method")
+    @classmethod
+    def _upper_method(cls, v: str) -> str:
+        v = v.upper()
+        if v not in ("GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"):
+            raise ValueError(f"unsupported method: {v}")
+        return v
+
+
+class ProxyMultiForwardInput(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    tasks: List[ProxyRequestItem] = []
+    timeout: int = Field(5, gt=0)
+    retries: int = Field(0, ge=0, le=5)
+    hedge: bool = False
+    response_mode: ResponseMode = "body"
+    max_response_bytes: Optional[int] = Field(None, gt=0)
+    cache: bool = False
+
+
+@coalesce
 async def ping(data: dict):
     return "pong"
 
 async def doc_example(data: dict):
     return "Hello World"
 
+def _read_options(mode: str, max_bytes: Optional[int]) -> dict:
+    """
+    流式读取参数：hash / summary 模式只保留预览字节，但读完整个响应体计算摘要
+    """
+    if mode in ("hash", "summary"):
+        return {"max_bytes": min(max_bytes or _PREVIEW_BYTES, _PREVIEW_BYTES), "digest": True}
+    return {"max_bytes": max_bytes, "digest": False}
+
+
+def _response_fields(resp: BoundedResponse, mode: str) -> dict:
+    """
+    按 response_mode 生成结果中的响应体字段；超过字节上限时附带 truncated
+    """
+    if mode == "hash":
+        # 响应体超过 HTTP_CLIENT_MAX_DIGEST_BYTES 时中止读取，sha256 为 None
+        return {"response": {"sha256": resp.sha256, "size": resp.size}}
+    if mode == "summary":
+        return {"response": {
+            "content_type": resp.headers.get("content-type"),
+            "size": resp.size,
+            "sha256": resp.sha256,
+            "truncated": resp.truncated,
+            "preview": resp.text[:200],
+        }}
+    # 尝试解析 JSON 响应
+    try:
+        fields = {"response": resp.json()}
+    except Exception:
+        fields = {"response": resp.text[:500]}  # 截断过长的文本响应
+    if resp.truncated:
+        fields["truncated"] = True
+    return fields
+
+
+def warmup():
+    # Worker 启动时在当前事件循环中创建转发任务共享的出站连接池 (build_dispatch_table 调用)
+    http_client_pool.start()
+
+
+async def _post_json(url: str, payload: Dict[str, Any], headers: Dict[str, str], timeout: float,
+                     response_mode: str = "body", max_bytes: Optional[int] = None,
+                     follow_redirects: bool = False) -> dict:
+    start_time = time.time()
+    try:
+        resp = await http_client_pool.request(
+            "POST", url, json=payload, headers=headers, timeout=timeout, follow_redirects=follow_redirects,
+            **_read_options(response_mode, max_bytes)
+        )
+        duration = int((time.time() - start_time) * 1000)
+
+        return {
+            "url": url,
+            "status": resp.status_code,
+            "ok": resp.is_success,
+            **_response_fields(resp, response_mode),
+            "duration_ms": duration
+        }
+    except CircuitOpenError:
+        return {
+            "url": url,
+            "status": 0,
+            "ok": False,
+            "error": "circuit_open",
+            "duration_ms": int((time.time() - start_time) * 1000)
+        }
+    except PoolTimeoutError:
+        return {
+            "url": url,
+            "status": 0,
+            "ok": False,
+            "error": "pool_timeout",
+            "duration_ms": int((time.time() - start_time) * 1000)
+        }
+    except httpx.TimeoutException:
+        return {
+            "url": url,
+            "status": 0,
+            "ok": False,
+            "error": "timeout",
+            "duration_ms": int((time.time() - start_time) * 1000)
+        }
+    except Exception as e:
+        return {
+            "url": url,
+            "status": 0,
+            "ok": False,
+            "error": str(e),
+            "duration_ms": int((time.time() - start_time) * 1000)
+        }
+
+
+async def forward_concurrently(urls: List[str], payload: Dict[str, Any], headers: Dict[str, str],
+                               timeout: float, deadline: Optional[float] = None,
+                               response_mode: str = "body", max_bytes: Optional[int] = None,
+                               follow_redirects: bool = False) -> List[dict]:
+    """
+    将相同 Payload 并发 POST 到多个 URL，结果顺序与 urls 一致
+    timeout: 单个 URL 的超时 (秒)
+    deadline: 整体截止时间 (秒)，到期仍未完成的 URL 被取消并记为 deadline_exceeded (部分结果)
+    response_mode / max_bytes: 响应体返回方式与字节上限 (见 _response_fields)
+    follow_redirects: 是否跟随重定向 (同步 /proxy/forward 沿用 urllib 的跟随行为)
+    """
+    headers = dict(headers or {})
+    # 默认 Content-Type
+    if "Content-Type" not in headers:
+        headers["Content-Type"] = "application/json"
+
+    start_time = time.time()
+    jobs = [
+        asyncio.ensure_future(_post_json(url, payload, headers, timeout, response_mode, max_bytes, follow_redirects))
+        for url in urls
+    ]
+    done, pending = await asyncio.wait(jobs, timeout=deadline)
+    if pending:
+        for job in pending:
+            job.cancel()
+        # 等待取消完成，被取消的请求释放连接与主机槽位
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    elapsed = int((time.time() - start_time) * 1000)
+    return [
+        job.result() if job in done else {
+            "url": url,
+            "status": 0,
+            "ok": False,
+            "error": "deadline_exceeded",
+            "duration_ms": elapsed
+        }
+        for url, job in zip(urls, jobs)
+    ]
+
+
+@input_schema(ProxyForwardInput)
 async def proxy_forward(data: dict):
     """
     异步并发转发 HTTP 请求 (简单模式：相同 Payload 发往多个 URL)
@@ -21,52 +217,11 @@ async def proxy_forward(data: dict):
     if not urls:
         return {"count": 0, "results": []}
 
-    # 默认 Content-Type
-    if "Content-Type" not in headers:
-        headers["Content-Type"] = "application/json"
-
-    results = []
-    
-    async def _fetch(client, url):
-        start_time = time.time()
-        try:
-            resp = await client.post(url, json=payload, headers=headers)
-            duration = int((time.time() - start_time) * 1000)
-            
-            # 尝试解析 JSON 响应
-            try:
-                resp_data = resp.json()
-            except Exception:
-                resp_data = resp.text[:500]  # 截断过长的文本响应
-
-            return {
-                "url": url,
-                "status": resp.status_code,
-                "ok": resp.is_success,
-                "response": resp_data,
-                "duration_ms": duration
-            }
-        except httpx.TimeoutException:
-            return {
-                "url": url,
-                "status": 0,
-                "ok": False,
-                "error": "timeout",
-                "duration_ms": int((time.time() - start_time) * 1000)
-            }
-        except Exception as e:
-            return {
-                "url": url,
-                "status": 0,
-                "ok": False,
-                "error": str(e),
-                "duration_ms": int((time.time() - start_time) * 1000)
-            }
-
-    async with httpx.AsyncClient(timeout=timeout, verify=False) as client:
-        tasks = [_fetch(client, url) for url in urls]
-        results = await asyncio.gather(*tasks)
-
+    results = await forward_concurrently(
+        urls, payload, headers, timeout,
+        response_mode=data.get("response_mode") or "body",
+        max_bytes=data.get("max_response_bytes")
+    )
     success_count = sum(1 for r in results if r.get("ok"))
     
     return {
@@ -76,30 +231,56 @@ async def proxy_forward(data: dict):
         "results": results
     }
 
+def _with_stats(item: dict, stats: dict) -> dict:
+    # 发生了重试 / 对冲或使用了响应缓存时在结果中注明，未发生时保持原有结果格式
+    if stats.get("attempts", 1) > 1:
+        item["attempts"] = stats["attempts"]
+    if stats.get("hedged"):
+        item["hedged"] = True
+    if stats.get("cache"):
+        item["cache"] = stats["cache"]
+    return item
+
+
+@input_schema(ProxyMultiForwardInput)
 async def proxy_multi_forward(data: dict):
     """
     异步并发转发 HTTP 请求 (高级模式：每个请求可独立定义 URL/Method/Data/Headers)
     taskData: {
         "tasks": [
-            {"url": "...", "method": "POST", "data": {...}, "headers": {...}},
+            {"url": "...", "method": "POST", "data": {...}, "headers": {...}, "retries": 2, "hedge": true},
             ...
         ],
-        "timeout": 5
+        "timeout": 5,
+        "retries": 0,   // 子请求未指定时的默认重试次数
+        "hedge": false, // 子请求未指定时是否对 GET/HEAD 发送对冲请求
+        "cache": false  // 子请求未指定时 GET/HEAD 是否使用 HTTP 响应缓存 (遵循 Cache-Control / ETag)
     }
     """
     sub_tasks: List[Dict] = data.get("tasks", [])
     global_timeout: int = int(data.get("timeout", 5))
+    default_retries: int = int(data.get("retries") or 0)
+    default_hedge: bool = bool(data.get("hedge"))
+    default_mode: str = data.get("response_mode") or "body"
+    default_max_bytes: Optional[int] = data.get("max_response_bytes")
+    default_cache: bool = bool(data.get("cache"))
     
     if not sub_tasks:
         return {"count": 0, "results": []}
 
     results = []
     
-    async def _execute_single(client, task_item):
+    async def _execute_single(task_item):
         url = task_item.get("url")
         method = task_item.get("method", "POST").upper()
         payload = task_item.get("data")
         headers = task_item.get("headers", {})
+        retries = task_item.get("retries")
+        hedge = task_item.get("hedge")
+        mode = task_item.get("response_mode") or default_mode
+        max_bytes = task_item.get("max_response_bytes") or default_max_bytes
+        use_cache = default_cache if task_item.get("cache") is None else bool(task_item.get("cache"))
+        stats: Dict[str, Any] = {}
         
         if not url:
             return {"url": None, "ok": False, "error": "url_missing"}
@@ -117,44 +298,75 @@ async def proxy_multi_forward(data: dict):
             else:
                 if payload: kwargs["json"] = payload
 
-            resp = await client.request(method, url, **kwargs)
+            read_options = _read_options(mode, max_bytes)
+
+            async def _send(conditional: Dict[str, str]) -> BoundedResponse:
+                return await request_with_policy(
+                    method, url,
+                    retries=default_retries if retries is None else int(retries),
+                    hedge=default_hedge if hedge is None else bool(hedge),
+                    stats=stats,
+                    timeout=global_timeout,
+                    **read_options,
+                    **{**kwargs, "headers": {**headers, **conditional}}
+                )
+
+            if use_cache and method in CACHEABLE_METHODS and http_response_cache.active():
+                full_url = str(httpx.URL(url, params=kwargs.get("params")))
+                resp = await http_response_cache.fetch(
+                    method, full_url, headers, read_options["digest"], _send, stats=stats
+                )
+            else:
+                resp = await _send({})
             duration = int((time.time() - start_time) * 1000)
-            
-            try:
-                resp_data = resp.json()
-            except Exception:
-                resp_data = resp.text[:500]
 
-            return {
+            return _with_stats({
                 "url": url,
                 "method": method,
                 "status": resp.status_code,
                 "ok": resp.is_success,
-                "response": resp_data,
+                **_response_fields(resp, mode),
                 "duration_ms": duration
+            }, stats)
+        except CircuitOpenError:
+            return {
+                "url": url,
+                "method": method,
+                "status": 0,
+                "ok": False,
+                "error": "circuit_open",
+                "duration_ms": int((time.time() - start_time) * 1000)
             }
+        except PoolTimeoutError:
+            return _with_stats({
+                "url": url,
+                "method": method,
+                "status": 0,
+                "ok": False,
+                "error": "pool_timeout",
+                "duration_ms": int((time.time() - start_time) * 1000)
+            }, stats)
         except httpx.TimeoutException:
-            return {
+            return _with_stats({
                 "url": url,
                 "method": method,
                 "status": 0,
                 "ok": False,
                 "error": "timeout",
                 "duration_ms": int((time.time() - start_time) * 1000)
-            }
+            }, stats)
         except Exception as e:
-            return {
+            return _with_stats({
                 "url": url,
                 "method": method,
                 "status": 0,
                 "ok": False,
                 "error": str(e),
                 "duration_ms": int((time.time() - start_time) * 1000)
-            }
+            }, stats)
 
-    async with httpx.AsyncClient(timeout=global_timeout, verify=False) as client:
-        tasks = [_execute_single(client, item) for item in sub_tasks]
-        results = await asyncio.gather(*tasks)
+    tasks = [_execute_single(item) for item in sub_tasks]
+    results = await asyncio.gather(*tasks)
 
     success_count = sum(1 for r in results if r.get("ok"))
     
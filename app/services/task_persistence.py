@@ -1,86 +1,279 @@
-from sqlalchemy import update
-from sqlalchemy.future import select
+import asyncio
+import time
+from collections import OrderedDict
 from datetime import datetime
+from typing import Dict, List, Optional
+from sqlalchemy import case
+from app.core.config import config
 from app.core.database import AsyncSessionLocal
+from app.core.metrics import (
+    TASK_PERSIST_FLUSH_SECONDS,
+    TASK_PERSIST_BATCH_SIZE,
+    TASK_PERSIST_BUFFERED,
+    TASK_PERSIST_BACKPRESSURE_TOTAL,
+)
 from app.models.task import Task
 from app.core.log_utils import get_logger
 
 logger = get_logger("persistence")
 
+# 入队事件的状态：不能覆盖已落库的后续状态 (finish 可能先于 init 落库)
+_INITIAL_STATUS = "pending"
+# "弱" 字段值：只在记录中没有该字段时写入，不覆盖已有值
+_WEAK_VALUES = {"status": _INITIAL_STATUS, "queue": "unknown", "task_name": "unknown"}
+# 单批写入失败后的最大重试次数，超过后丢弃并记录错误
+_MAX_ATTEMPTS = 3
+
+
+class TaskPersister:
+    """
+    任务生命周期的 Write-Behind 批量持久化
+    - init / start / finish 事件写入有界缓冲区，同一 tid 的事件在缓冲区内合并为一行
+    - 缓冲行数达到 TASK_PERSIST_BATCH_SIZE 或距上次刷新超过 TASK_PERSIST_FLUSH_INTERVAL 时，
+      按方言批量 upsert (INSERT ... ON CONFLICT DO UPDATE)，一次事务写入整批
+    - 缓冲区满 (TASK_PERSIST_BUFFER_SIZE) 时新任务的事件等待刷新腾出空间 (背压)
+    - 未启动刷新循环时 (脚本 / 测试) 直接同步写入
+    """
+
+    def __init__(self):
+        self._buffer: "OrderedDict[str, dict]" = OrderedDict()
+        self._attempts: Dict[str, int] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._space: Optional[asyncio.Event] = None
+
+    @staticmethod
+    def batch_size() -> int:
+        return int(config.get("TASK_PERSIST_BATCH_SIZE", 500))
+
+    @staticmethod
+    def buffer_size() -> int:
+        return int(config.get("TASK_PERSIST_BUFFER_SIZE", 10000))
+
+    @staticmethod
+    def interval() -> float:
+        return float(config.get("TASK_PERSIST_FLUSH_INTERVAL", 0.5))
+
+    def start(self):
+        """
+        启动后台刷新循环 (幂等)
+        """
+        if self._flusher and not self._flusher.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._flusher = asyncio.get_event_loop().create_task(self._flush_loop())
+
+    async def stop(self):
+        """
+        停止刷新循环并写入缓冲区中剩余的事件
+        """
+        if self._flusher:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        while self._buffer:
+            if not await self.flush():
+                break
+
+    async def submit(self, tid: str, fields: dict):
+        fields["updated_at"] = datetime.now()
+        if self._flusher is None:
+            await self._write([{"id": tid, **fields}])
+            return
+
+        # 背压：缓冲区已满且是新的 tid 时等待刷新 (已有 tid 的事件直接合并，不占新空间)
+        while tid not in self._buffer and len(self._buffer) >= self.buffer_size():
+            TASK_PERSIST_BACKPRESSURE_TOTAL.inc()
+            self._space.clear()
+            self._wakeup.set()
+            await self._space.wait()
+
+        row = self._buffer.get(tid)
+        if row is None:
+            self._buffer[tid] = {"id": tid, **fields}
+        else:
+            _merge(row, fields)
+        TASK_PERSIST_BUFFERED.set(len(self._buffer))
+        if len(self._buffer) >= self.batch_size():
+            self._wakeup.set()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval())
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                while self._buffer:
+                    if not await self.flush():
+                        # 数据库不可用时等待下一个周期，避免空转
+                        break
+                    if len(self._buffer) < self.batch_size():
+                        break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Task persistence flush loop error: {e}")
+                await asyncio.sleep(1)
+
+    async def flush(self) -> bool:
+        """
+        取出最多一批缓冲行并写入数据库，返回是否写入成功
+        """
+        if not self._buffer:
+            return True
+        rows = []
+        while self._buffer and len(rows) < self.batch_size():
+            _, row = self._buffer.popitem(last=False)
+            rows.append(row)
+        TASK_PERSIST_BUFFERED.set(len(self._buffer))
+        if self._space is not None:
+            self._space.set()
+
+        ok = await self._write(rows)
+        if not ok:
+            self._requeue(rows)
+        return ok
+
+    def _requeue(self, rows: List[dict]):
+        for row in rows:
+            tid = row["id"]
+            attempts = self._attempts.get(tid, 0) + 1
+            if attempts >= _MAX_ATTEMPTS:
+                self._attempts.pop(tid, None)
+                logger.error(f"Dropping persistence events of task {tid} after {attempts} failed attempts")
+                continue
+            self._attempts[tid] = attempts
+            # 写入失败期间可能又有新事件进入缓冲区，新事件优先
+            pending = self._buffer.pop(tid, None)
+            if pending is not None:
+                _merge(row, {k: v for k, v in pending.items() if k != "id"})
+            self._buffer[tid] = row
+            self._buffer.move_to_end(tid, last=False)
+        TASK_PERSIST_BUFFERED.set(len(self._buffer))
+
+    async def _write(self, rows: List[dict]) -> bool:
+        start = time.perf_counter()
+        async with AsyncSessionLocal() as session:
+            try:
+                dialect = session.bind.dialect.name
+                if dialect in ("postgresql", "sqlite"):
+                    # 批量 upsert 要求同一语句的各行列集合一致，按列集合分组
+                    groups: Dict[tuple, List[dict]] = {}
+                    for row in rows:
+                        groups.setdefault(tuple(sorted(row)), []).append(row)
+                    for group in groups.values():
+                        await session.execute(_upsert_stmt(dialect, group))
+                else:
+                    for row in rows:
+                        await _merge_row(session, row)
+                await session.commit()
+            except Exception as e:
+                logger.error(f"Failed to persist {len(rows)} task events: {e}")
+                return False
+
+        for row in rows:
+            self._attempts.pop(row["id"], None)
+        TASK_PERSIST_FLUSH_SECONDS.observe(time.perf_counter() - start)
+        TASK_PERSIST_BATCH_SIZE.observe(len(rows))
+        logger.debug(f"Persisted {len(rows)} task events")
+        return True
+
+
+def _merge(row: dict, fields: dict):
+    """
+    合并同一任务的生命周期事件：后到的字段覆盖先到的，
+    但弱字段值 (pending 状态、unknown 队列/任务名) 与创建时间不覆盖已有值
+    """
+    for k, v in fields.items():
+        if k in _WEAK_VALUES and v == _WEAK_VALUES[k] and k in row:
+            continue
+        if k == "created_at" and "created_at" in row:
+            continue
+        row[k] = v
+
+
+def _upsert_stmt(dialect: str, rows: List[dict]):
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+    stmt = insert(Task).values(rows)
+    excluded = stmt.excluded
+    set_ = {}
+    for col in rows[0]:
+        if col in ("id", "created_at"):
+            continue
+        if col in _WEAK_VALUES:
+            # finish 先于 init 落库时，init 的 pending 不能把终态改回去；unknown 不覆盖真实队列/任务名
+            column = getattr(Task, col)
+            set_[col] = case((getattr(excluded, col) == _WEAK_VALUES[col], column), else_=getattr(excluded, col))
+        else:
+            set_[col] = getattr(excluded, col)
+    return stmt.on_conflict_do_update(index_elements=[Task.id], set_=set_)
+
+
+async def _merge_row(session, row: dict):
+    """
+    不支持 ON CONFLICT 的方言：逐行读取后更新
+    """
+    task = await session.get(Task, row["id"])
+    if task is None:
+        session.add(Task(**row))
+        return
+    for k, v in row.items():
+        if k in ("id", "created_at"):
+            continue
+        if k in _WEAK_VALUES and v == _WEAK_VALUES[k]:
+            continue
+        setattr(task, k, v)
+
+
+task_persister = TaskPersister()
+
+
 async def persist_task_init(tid: str, queue: str, task_name: str, payload: dict):
     """
     任务入队时：创建初始记录
     """
-    async with AsyncSessionLocal() as session:
-        try:
-            task = Task(
-                id=tid,
-                queue=queue,
-                task_name=task_name,
-                payload=payload,
-                status="pending",
-                created_at=datetime.now()
-            )
-            session.add(task)
-            await session.commit()
-            logger.debug(f"Persisted init task {tid}")
-        except Exception as e:
-            logger.error(f"Failed to persist task init {tid}: {e}")
-
-async def persist_task_finish(tid: str, status: str, result: dict = None, error: str = None, worker_id: str = None):
+    await task_persister.submit(tid, {
+        "queue": queue,
+        "task_name": task_name,
+        "payload": payload,
+        "status": _INITIAL_STATUS,
+        "created_at": datetime.now(),
+    })
+
+
+async def persist_task_start(tid: str, worker_id: str, queue: str = None, task_name: str = None):
     """
-    任务完成/失败时：更新记录
+    任务开始时：更新开始时间和 Worker ID
+    queue / task_name 用于 init 尚未落库时补录记录
     """
-    async with AsyncSessionLocal() as session:
-        try:
-            # 尝试先查询，如果不存在（比如 Redis 里有但 DB 里没写入成功）则创建
-            # 但标准流程应该是 persist_task_init 先执行。
-            # 这里我们直接执行 update，如果记录不存在可能需要 fallback，
-            # 不过考虑到 "异步写入" 可能有延迟，update 应该能找到。
-            
-            stmt = (
-                update(Task)
-                .where(Task.id == tid)
-                .values(
-                    status=status,
-                    result=result,
-                    error=error,
-                    finished_at=datetime.now(),
-                    worker_id=worker_id,
-                    updated_at=datetime.now()
-                )
-            )
-            res = await session.execute(stmt)
-            
-            if res.rowcount == 0:
-                # 这是一个兜底：如果 init 写入失败或太慢，finish 时发现没有记录，则补录
-                # 但这需要知道 task_name 等信息，而 finish 时只有 tid 和 result。
-                # 这种情况下，我们可能只能记录 "未知任务" 或 忽略。
-                # 为了简化，我们暂时只打印警告。
-                logger.warning(f"Task {tid} not found in DB during finish update. Init might have failed or is slow.")
-                
-            await session.commit()
-            logger.debug(f"Persisted finish task {tid} ({status})")
-        except Exception as e:
-            logger.error(f"Failed to persist task finish {tid}: {e}")
-
-async def persist_task_start(tid: str, worker_id: str):
+    await task_persister.submit(tid, {
+        "queue": queue or "unknown",
+        "task_name": task_name or "unknown",
+        "status": "processing",
+        "started_at": datetime.now(),
+        "worker_id": worker_id,
+    })
+
+
+async def persist_task_finish(tid: str, status: str, result: dict = None, error: str = None,
+                              worker_id: str = None, queue: str = None, task_name: str = None):
     """
-    任务开始时：更新开始时间和 Worker ID
+    任务完成/失败/取消时：更新记录
+    queue / task_name 用于 init 尚未落库时补录记录 (之后到达的 init 只补充 payload，不覆盖状态)
     """
-    async with AsyncSessionLocal() as session:
-        try:
-            stmt = (
-                update(Task)
-                .where(Task.id == tid)
-                .values(
-                    status="processing",
-                    started_at=datetime.now(),
-                    worker_id=worker_id,
-                    updated_at=datetime.now()
-                )
-            )
-            await session.execute(stmt)
-            await session.commit()
-        except Exception as e:
-            logger.error(f"Failed to persist task start {tid}: {e}")
+    await task_persister.submit(tid, {
+        "queue": queue or "unknown",
+        "task_name": task_name or "unknown",
+        "status": status,
+        "result": result,
+        "error": error,
+        "finished_at": datetime.now(),
+        "worker_id": worker_id,
+    })
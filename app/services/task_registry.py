@@ -0,0 +1,133 @@
+import asyncio
+from typing import Dict, Optional
+from sqlalchemy.future import select
+from app.core.config import config
+from app.core.database import AsyncSessionLocal
+from app.models.system import RegisteredTask
+from app.queues.control import control_bus
+from app.core.log_utils import get_logger
+
+logger = get_logger("task_registry")
+
+# 控制通道消息：registered_tasks 已变更，所有进程重新加载快照
+REGISTRY_CHANGED_ACTION = "registry_changed"
+
+
+class TaskRegistry:
+    """
+    registered_tasks 表的进程内快照
+    - 启动时整表加载，之后在收到变更通知 (控制通道) 时重新加载
+    - TASK_REGISTRY_TTL 周期性兜底刷新，防止错过通知
+    - 所有读取都是同步的字典查找，分发路径上不产生 DB 查询
+    """
+
+    def __init__(self):
+        self._snapshot: Dict[str, dict] = {}
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    async def refresh(self):
+        """
+        从数据库重新加载全部任务配置
+        """
+        async with self._lock:
+            try:
+                snapshot = {}
+                async with AsyncSessionLocal() as session:
+                    result = await session.execute(select(RegisteredTask))
+                    for row in result.scalars().all():
+                        snapshot[row.task_name] = {
+                            "default_queue": row.default_queue,
+                            "max_retries": row.max_retries,
+                            "timeout_seconds": row.timeout_seconds,
+                            "is_active": row.is_active is not False,
+                        }
+                self._snapshot = snapshot
+                logger.info(f"Loaded {len(snapshot)} registered tasks")
+            except Exception as e:
+                # 加载失败时保留旧快照，等待下一次通知或兜底刷新
+                logger.error(f"Failed to load registered tasks: {e}")
+
+    def start(self):
+        """
+        启动后台刷新循环并订阅变更通知 (幂等)
+        """
+        if self._refresh_task and not self._refresh_task.done():
+            return
+        self._wakeup = asyncio.Event()
+        control_bus.subscribe(self._on_control)
+        self._refresh_task = asyncio.get_event_loop().create_task(self._refresh_loop())
+
+    async def stop(self):
+        control_bus.unsubscribe(self._on_control)
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            await asyncio.gather(self._refresh_task, return_exceptions=True)
+            self._refresh_task = None
+
+    def _on_control(self, message: dict):
+        if message.get("action") == REGISTRY_CHANGED_ACTION and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await self.refresh()
+                ttl = float(config.get("TASK_REGISTRY_TTL", 300))
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=ttl)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Task registry refresh loop error: {e}")
+                await asyncio.sleep(1)
+
+    async def notify_changed(self):
+        """
+        广播变更通知，所有进程 (包括本进程) 重新加载快照
+        """
+        await control_bus.publish({"action": REGISTRY_CHANGED_ACTION})
+
+    def snapshot(self) -> Dict[str, dict]:
+        return dict(self._snapshot)
+
+    def get(self, task_name: str) -> Optional[dict]:
+        return self._snapshot.get(task_name)
+
+    def is_active(self, task_name: str) -> bool:
+        """
+        未注册的任务视为启用 (由代码中的 ALLOWED_TASKS 决定是否存在)
+        """
+        entry = self._snapshot.get(task_name)
+        return entry is None or entry["is_active"]
+
+    def default_queue(self, task_name: str) -> Optional[str]:
+        entry = self._snapshot.get(task_name)
+        return entry.get("default_queue") if entry else None
+
+    def max_retries(self, task_name: str) -> Optional[int]:
+        entry = self._snapshot.get(task_name)
+        return entry.get("max_retries") if entry else None
+
+    def get_timeout(self, task_name: str) -> Optional[float]:
+        """
+        获取任务执行超时时间 (秒)
+        优先使用 registered_tasks.timeout_seconds，未注册则回退到 TASK_TIMEOUT_DEFAULT，
+        <= 0 表示不限制
+        """
+        entry = self._snapshot.get(task_name)
+        timeout = entry.get("timeout_seconds") if entry else None
+        if timeout is None:
+            timeout = config.get("TASK_TIMEOUT_DEFAULT", 0)
+        try:
+            timeout = float(timeout)
+        except (TypeError, ValueError):
+            return None
+        return timeout if timeout > 0 else None
+
+
+task_registry = TaskRegistry()
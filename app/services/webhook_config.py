@@ -1,30 +1,93 @@
-from typing import Optional
+import asyncio
+import time
+from typing import Dict, Optional
 from sqlalchemy.future import select
+from app.core.config import config
 from app.core.database import AsyncSessionLocal
+from app.core.metrics import WEBHOOK_CONFIG_CACHE_TOTAL
 from app.models.system import Webhook
+from app.queues.control import control_bus
+from app.services.task_registry import REGISTRY_CHANGED_ACTION
 from app.core.log_utils import get_logger
 
 logger = get_logger("config")
 
-async def get_configured_webhook(task_name: str) -> Optional[str]:
+# 控制通道消息：webhooks 表已变更，所有进程丢弃快照
+WEBHOOKS_CHANGED_ACTION = "webhooks_changed"
+
+
+class WebhookConfigCache:
     """
-    获取任务配置的 Webhook URL
-    优先匹配 task_name，如果没有则查找 default
+    webhooks 表的进程内快照
+    - 首次查询 / 快照过期 (WEBHOOK_CONFIG_TTL) 时整表加载活跃配置，并发查询只触发一次加载
+    - 快照中没有的任务即视为未配置 (负缓存)，不会再逐个查询数据库
+    - 收到 webhooks_changed / registry_changed 控制消息时立即失效
     """
-    async with AsyncSessionLocal() as session:
+
+    def __init__(self):
+        self._snapshot: Optional[Dict[str, str]] = None
+        self._loaded_at = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+        control_bus.subscribe(self._on_control)
+
+    @staticmethod
+    def ttl() -> float:
+        return float(config.get("WEBHOOK_CONFIG_TTL", 60))
+
+    def _fresh(self) -> bool:
+        return self._snapshot is not None and time.monotonic() - self._loaded_at < self.ttl()
+
+    def invalidate(self):
+        self._loaded_at = 0.0
+
+    def _on_control(self, message: dict):
+        if message.get("action") in (WEBHOOKS_CHANGED_ACTION, REGISTRY_CHANGED_ACTION):
+            self.invalidate()
+
+    async def _reload(self):
         try:
-            # 查找针对该任务的活跃 Webhook
-            stmt = select(Webhook).where(
-                Webhook.task_name == task_name,
-                Webhook.is_active == True
-            )
-            result = await session.execute(stmt)
-            webhook = result.scalars().first()
-            
-            if webhook:
-                return webhook.url
-                
-            return None
+            snapshot: Dict[str, str] = {}
+            async with AsyncSessionLocal() as session:
+                stmt = select(Webhook).where(Webhook.is_active == True).order_by(Webhook.id)
+                result = await session.execute(stmt)
+                for row in result.scalars().all():
+                    # 同一任务有多条活跃配置时保持原先的行为：取第一条
+                    snapshot.setdefault(row.task_name, row.url)
+            self._snapshot = snapshot
         except Exception as e:
-            logger.error(f"Failed to fetch webhook config for {task_name}: {e}")
-            return None
+            # 加载失败时保留旧快照 (首次加载失败则视为全部未配置)，TTL 后再重试，避免打爆数据库
+            logger.error(f"Failed to load webhook config: {e}")
+            if self._snapshot is None:
+                self._snapshot = {}
+        self._loaded_at = time.monotonic()
+
+    async def get(self, task_name: str) -> Optional[str]:
+        if not self._fresh():
+            if self._lock is None:
+                self._lock = asyncio.Lock()
+            async with self._lock:
+                # 等锁期间其他协程可能已完成加载
+                if not self._fresh():
+                    await self._reload()
+                    WEBHOOK_CONFIG_CACHE_TOTAL.labels(result="reload").inc()
+
+        url = self._snapshot.get(task_name)
+        WEBHOOK_CONFIG_CACHE_TOTAL.labels(result="hit" if url else "negative_hit").inc()
+        return url
+
+    async def notify_changed(self):
+        """
+        修改 webhooks 表后调用：通知所有进程丢弃快照
+        """
+        self.invalidate()
+        await control_bus.publish({"action": WEBHOOKS_CHANGED_ACTION})
+
+
+webhook_config_cache = WebhookConfigCache()
+
+
+async def get_configured_webhook(task_name: str) -> Optional[str]:
+    """
+    获取任务配置的 Webhook URL (读取进程内快照，分发路径上通常无 DB 查询)
+    """
+    return await webhook_config_cache.get(task_name)
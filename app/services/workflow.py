@@ -0,0 +1,392 @@
+import asyncio
+import json
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import config
+from app.core.database import AsyncSessionLocal
+from app.core.redis import redis_client
+from app.core.log_utils import get_logger
+from app.models.workflow import Workflow
+from app.queues.task_queue import queue_manager
+from app.services.task_persistence import persist_task_init
+from app.infra.webhook import notify
+
+logger = get_logger("workflow")
+
+# Redis Key: 每个工作流一个 Hash
+# status / total / finished / spec / created_at / finished_at
+# deps:{node} 剩余未完成的上游数, state:{node}, tid:{node}, result:{node}, done:{node} (完成去重)
+WORKFLOW_KEY_PREFIX = "procurator:workflow:"
+
+# 节点完成 (原子执行)：
+# 1. done:{node} 去重 (任务被重复投递时只计一次)；重复投递时返回已就绪但尚未入队 (无 tid:{node}) 的后继，
+#    上次回调在 Lua 与入队之间中断时由调用方幂等补发 (节点任务 ID 确定，不会重复入队)
+# 2. 记录节点状态与结果
+# 3. 节点成功 -> 后继依赖计数减一，减到 0 的后继即为就绪节点 (恰好一个上游会看到 0)
+#    节点失败/取消 -> 工作流标记为 failed，不再触发后继
+# 返回 {工作流状态变化 ('' / completed / failed), 就绪节点列表}
+NODE_FINISHED_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return {'', {}}
+end
+local done = redis.call('HGET', KEYS[1], 'done:' .. ARGV[1])
+if done then
+    local pending = {}
+    if done == 'completed' and redis.call('HGET', KEYS[1], 'status') == 'running' then
+        for i = 5, #ARGV do
+            if redis.call('HGET', KEYS[1], 'state:' .. ARGV[i]) == 'queued'
+                    and redis.call('HEXISTS', KEYS[1], 'tid:' .. ARGV[i]) == 0 then
+                table.insert(pending, ARGV[i])
+            end
+        end
+    end
+    return {'', pending}
+end
+redis.call('HSET', KEYS[1], 'done:' .. ARGV[1], ARGV[2], 'state:' .. ARGV[1], ARGV[2], 'result:' .. ARGV[1], ARGV[3])
+local finished = redis.call('HINCRBY', KEYS[1], 'finished', 1)
+if redis.call('HGET', KEYS[1], 'status') ~= 'running' then
+    return {'', {}}
+end
+if ARGV[2] ~= 'completed' then
+    redis.call('HSET', KEYS[1], 'status', 'failed', 'finished_at', ARGV[4])
+    return {'failed', {}}
+end
+local ready = {}
+for i = 5, #ARGV do
+    if redis.call('HINCRBY', KEYS[1], 'deps:' .. ARGV[i], -1) == 0 then
+        redis.call('HSET', KEYS[1], 'state:' .. ARGV[i], 'queued')
+        table.insert(ready, ARGV[i])
+    end
+end
+if finished >= tonumber(redis.call('HGET', KEYS[1], 'total')) then
+    redis.call('HSET', KEYS[1], 'status', 'completed', 'finished_at', ARGV[4])
+    return {'completed', ready}
+end
+return {'', ready}
+"""
+
+
+def validate_dag(node_ids: List[str], edges: List[Tuple[str, str]]) -> Tuple[Dict[str, List[str]], Dict[str, List[str]]]:
+    """
+    校验 DAG 并返回 (successors, predecessors)
+    节点 ID 重复、边引用未知节点、自环或存在环时抛出 ValueError
+    """
+    if len(set(node_ids)) != len(node_ids):
+        raise ValueError("duplicate node id")
+
+    successors: Dict[str, List[str]] = {n: [] for n in node_ids}
+    predecessors: Dict[str, List[str]] = {n: [] for n in node_ids}
+    for src, dst in edges:
+        if src not in successors or dst not in successors:
+            raise ValueError(f"edge references unknown node: {src} -> {dst}")
+        if src == dst:
+            raise ValueError(f"self-loop on node: {src}")
+        if dst in successors[src]:
+            continue
+        successors[src].append(dst)
+        predecessors[dst].append(src)
+
+    # Kahn 拓扑排序：无法排完即存在环
+    indegree = {n: len(predecessors[n]) for n in node_ids}
+    ready = deque(n for n in node_ids if indegree[n] == 0)
+    visited = 0
+    while ready:
+        n = ready.popleft()
+        visited += 1
+        for m in successors[n]:
+            indegree[m] -= 1
+            if indegree[m] == 0:
+                ready.append(m)
+    if visited != len(node_ids):
+        raise ValueError("workflow graph contains a cycle")
+
+    return successors, predecessors
+
+
+def node_task_id(wid: str, node_id: str) -> str:
+    """
+    节点的任务 ID 由 (工作流 ID, 节点 ID) 确定，补发入队时不会产生重复任务
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{WORKFLOW_KEY_PREFIX}{wid}/{node_id}"))
+
+
+def _decode(value):
+    if value is None:
+        return None
+    try:
+        return json.loads(value)
+    except Exception:
+        return value
+
+
+class WorkflowEngine:
+    """
+    DAG 工作流编排
+    - 节点即任务，边即依赖；提交后根节点立即入队
+    - 节点完成时由 Worker 回调 on_task_finished，原子地递减后继依赖计数并入队就绪节点，
+      上游结果通过 taskData["_upstream"] = {上游节点 ID: 结果} 传给下游
+    - 回调在 ACK 之前执行，失败时消息留在 PEL 中重新投递；重复回调补发尚未入队的就绪节点 (节点任务 ID 确定，幂等入队)
+    - 运行状态保存在 Redis (Memory 模式下保存在进程内)，创建与结束时持久化到数据库
+    """
+
+    def __init__(self):
+        self.enabled = config.get("QUEUE_BACKEND", "memory").lower() == "redis"
+        self._local: Dict[str, dict] = {}
+        self._finish_script = None
+
+    @staticmethod
+    def _key(wid: str) -> str:
+        return f"{WORKFLOW_KEY_PREFIX}{wid}"
+
+    @staticmethod
+    def ttl() -> int:
+        return int(config.get("WORKFLOW_TTL", 7 * 86400))
+
+    async def submit(self, nodes: Dict[str, dict], edges: List[Tuple[str, str]], webhook: Optional[str] = None) -> str:
+        """
+        提交工作流
+        nodes: node_id -> {"task", "taskData", "queue", "_max_retries"} (调用方已完成鉴权与参数校验)
+        """
+        successors, predecessors = validate_dag(list(nodes), edges)
+        wid = str(uuid.uuid4())
+        spec = {
+            "nodes": nodes,
+            "successors": successors,
+            "predecessors": predecessors,
+            "webhook": webhook,
+        }
+
+        roots = [n for n in nodes if not predecessors[n]]
+        state = {
+            "status": "running",
+            "total": len(nodes),
+            "finished": 0,
+            "spec": json.dumps(spec),
+            "created_at": time.time(),
+        }
+        for n in nodes:
+            state[f"deps:{n}"] = len(predecessors[n])
+            state[f"state:{n}"] = "queued" if n in roots else "waiting"
+
+        if self.enabled:
+            client = redis_client.get_async_client()
+            pipeline = client.pipeline(transaction=True)
+            pipeline.hset(self._key(wid), mapping=state)
+            pipeline.expire(self._key(wid), self.ttl())
+            await pipeline.execute()
+        else:
+            self._local[wid] = state
+
+        await persist_workflow(wid, "running", spec=spec, total=len(nodes))
+        for n in roots:
+            await self._enqueue_node(wid, spec, n)
+        logger.info(f"Workflow {wid} submitted with {len(nodes)} nodes, {len(roots)} roots")
+        return wid
+
+    async def _enqueue_node(self, wid: str, spec: dict, node_id: str, upstream: Optional[dict] = None):
+        node = spec["nodes"][node_id]
+        task_data = dict(node.get("taskData") or {})
+        if upstream is not None:
+            task_data["_upstream"] = upstream
+        payload = {
+            "task": node["task"],
+            "taskData": task_data,
+            "_workflow": {"id": wid, "node": node_id},
+        }
+        if node.get("_max_retries") is not None:
+            payload["_max_retries"] = node["_max_retries"]
+
+        queue = node.get("queue") or "api"
+        tid = node_task_id(wid, node_id)
+        created = await asyncio.to_thread(queue_manager.enqueue_once, queue, payload, tid)
+        await self._hset(wid, {f"tid:{node_id}": tid})
+        if created:
+            await persist_task_init(tid, queue, node["task"], payload)
+
+    async def _hset(self, wid: str, mapping: dict):
+        if self.enabled:
+            await redis_client.get_async_client().hset(self._key(wid), mapping=mapping)
+        elif wid in self._local:
+            self._local[wid].update(mapping)
+
+    async def _load(self, wid: str) -> Optional[dict]:
+        if self.enabled:
+            raw = await redis_client.get_async_client().hgetall(self._key(wid))
+            return raw or None
+        state = self._local.get(wid)
+        return dict(state) if state else None
+
+    async def _load_spec(self, wid: str) -> Optional[dict]:
+        if self.enabled:
+            raw = await redis_client.get_async_client().hget(self._key(wid), "spec")
+        else:
+            raw = (self._local.get(wid) or {}).get("spec")
+        return json.loads(raw) if raw else None
+
+    async def _finish_node(self, wid: str, node_id: str, status: str, result, successors: List[str]) -> Tuple[str, List[str]]:
+        result_json = json.dumps(result, default=str)
+        now = time.time()
+        if self.enabled:
+            if self._finish_script is None:
+                self._finish_script = redis_client.get_async_client().register_script(NODE_FINISHED_LUA)
+            transition, ready = await self._finish_script(
+                keys=[self._key(wid)],
+                args=[node_id, status, result_json, now, *successors]
+            )
+            return transition, list(ready)
+
+        # Memory 模式：与 Lua 脚本逻辑一致 (单事件循环内无 await，天然原子)
+        state = self._local.get(wid)
+        if state is None:
+            return "", []
+        if f"done:{node_id}" in state:
+            if state[f"done:{node_id}"] != "completed" or state["status"] != "running":
+                return "", []
+            return "", [n for n in successors if state.get(f"state:{n}") == "queued" and f"tid:{n}" not in state]
+        state[f"done:{node_id}"] = status
+        state[f"state:{node_id}"] = status
+        state[f"result:{node_id}"] = result_json
+        state["finished"] = int(state["finished"]) + 1
+        if state["status"] != "running":
+            return "", []
+        if status != "completed":
+            state["status"] = "failed"
+            state["finished_at"] = now
+            return "failed", []
+        ready = []
+        for n in successors:
+            state[f"deps:{n}"] = int(state[f"deps:{n}"]) - 1
+            if state[f"deps:{n}"] == 0:
+                state[f"state:{n}"] = "queued"
+                ready.append(n)
+        if state["finished"] >= int(state["total"]):
+            state["status"] = "completed"
+            state["finished_at"] = now
+            return "completed", ready
+        return "", ready
+
+    async def on_task_finished(self, payload: dict, status: str, result=None, error: Optional[str] = None):
+        """
+        Worker 回调：工作流节点进入终态 (completed / 最终 failed / cancelled)
+        """
+        meta = payload.get("_workflow") or {}
+        wid, node_id = meta.get("id"), meta.get("node")
+        if not wid or not node_id:
+            return
+
+        spec = await self._load_spec(wid)
+        if spec is None:
+            logger.warning(f"Workflow {wid} not found (expired?), node {node_id} result dropped")
+            return
+
+        transition, ready = await self._finish_node(
+            wid, node_id, status, result, spec["successors"].get(node_id, [])
+        )
+        if ready:
+            state = await self._load(wid) or {}
+            for n in ready:
+                upstream = {p: _decode(state.get(f"result:{p}")) for p in spec["predecessors"][n]}
+                await self._enqueue_node(wid, spec, n, upstream=upstream)
+
+        if transition:
+            await self._on_workflow_finished(wid, spec, transition, node_id, error)
+
+    async def _on_workflow_finished(self, wid: str, spec: dict, status: str, node_id: str, error: Optional[str]):
+        info = await self.get(wid) or {}
+        if status == "failed":
+            error = f"node {node_id} failed: {error}" if error else f"node {node_id} failed"
+        await persist_workflow(wid, status, nodes=info.get("nodes"), error=error, finished=True)
+
+        # 工作流结果：所有汇点 (无后继) 节点的结果
+        result = {
+            n: (info.get("nodes") or {}).get(n, {}).get("result")
+            for n, succ in spec["successors"].items() if not succ
+        }
+        if spec.get("webhook"):
+            try:
+                await asyncio.to_thread(notify, wid, "workflow", {"webhook": spec["webhook"]}, status, result, error)
+            except Exception:
+                pass
+        logger.info(f"Workflow {wid} {status}")
+
+    async def get(self, wid: str) -> Optional[dict]:
+        """
+        查询工作流状态：Redis 中已过期时回退到数据库
+        """
+        state = await self._load(wid)
+        if not state:
+            return await load_workflow(wid)
+
+        spec = json.loads(state["spec"])
+        nodes = {}
+        for n, node in spec["nodes"].items():
+            nodes[n] = {
+                "task": node["task"],
+                "state": state.get(f"state:{n}"),
+                "task_id": state.get(f"tid:{n}"),
+                "result": _decode(state.get(f"result:{n}")),
+            }
+        return {
+            "workflow_id": wid,
+            "status": state.get("status"),
+            "total": int(state.get("total") or 0),
+            "finished": int(state.get("finished") or 0),
+            "created_at": float(state["created_at"]) if state.get("created_at") else None,
+            "finished_at": float(state["finished_at"]) if state.get("finished_at") else None,
+            "nodes": nodes,
+        }
+
+
+async def persist_workflow(wid: str, status: str, spec: dict = None, nodes: dict = None,
+                           total: int = None, error: str = None, finished: bool = False):
+    """
+    工作流创建 / 结束时写入数据库
+    """
+    async with AsyncSessionLocal() as session:
+        try:
+            row = await session.get(Workflow, wid)
+            if row is None:
+                row = Workflow(id=wid, created_at=datetime.now())
+                session.add(row)
+            row.status = status
+            if spec is not None:
+                row.spec = spec
+            if nodes is not None:
+                row.nodes = nodes
+            if total is not None:
+                row.total = total
+            if error is not None:
+                row.error = error
+            if finished:
+                row.finished_at = datetime.now()
+            row.updated_at = datetime.now()
+            await session.commit()
+        except Exception as e:
+            logger.error(f"Failed to persist workflow {wid}: {e}")
+
+
+async def load_workflow(wid: str) -> Optional[dict]:
+    async with AsyncSessionLocal() as session:
+        try:
+            row = await session.get(Workflow, wid)
+        except Exception as e:
+            logger.error(f"Failed to load workflow {wid}: {e}")
+            return None
+        if row is None:
+            return None
+        return {
+            "workflow_id": row.id,
+            "status": row.status,
+            "total": row.total,
+            "created_at": row.created_at.timestamp() if row.created_at else None,
+            "finished_at": row.finished_at.timestamp() if row.finished_at else None,
+            "nodes": row.nodes,
+            "error": row.error,
+        }
+
+
+workflow_engine = WorkflowEngine()
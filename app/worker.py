@@ -1,20 +1,61 @@
 import asyncio
+import os
+import signal
 import time
 import socket
 import uuid
-from typing import Optional, List
+import psutil
+from typing import Optional, List, Dict, Set, Tuple
 
+from app.core.config import config
+from app.core.executors import executors
 from app.core.log_utils import get_logger
+from app.core.metrics import (
+    WORKER_DRAIN_SECONDS,
+    WORKER_DRAIN_RELEASED_TOTAL,
+    TASK_TIMEOUT_TOTAL,
+    TASK_FAILED_TOTAL,
+    TASK_RETRIED_TOTAL,
+    TASK_CANCELLED_TOTAL,
+)
 from app.queues.task_queue import queue_manager
-from app.queues.tasks import handle_task
+from app.queues.tasks import (
+    handle_task,
+    build_dispatch_table,
+    get_cache_policy,
+    TaskTimeoutError,
+    TaskCancelledError,
+)
+from app.queues.control import control_bus, current_task_id
+from app.core.script_runner import ScriptRunner
+from app.services.task_registry import task_registry
 from app.infra.webhook import notify
-from app.services.task_persistence import persist_task_start, persist_task_finish
+from app.infra.result_cache import result_cache
+from app.infra.worker_registry import worker_registry
+from app.services.task_persistence import persist_task_start, persist_task_finish, task_persister
+from app.infra.http_client import http_client_pool
+from app.services.workflow import workflow_engine
+from app.services.groups import group_manager
 
 
 class Worker:
     def __init__(self):
         self.logger = get_logger("worker")
         self._tasks: List[asyncio.Task] = []
+        self._queues: List[str] = []
+        # 已出队但尚未完成的任务: tid -> (queue_name, task_name) (Drain 时用于释放)
+        self._inflight: Dict[str, Tuple[str, str]] = {}
+        # 执行中的任务: tid -> (执行 Task, 强制取消信号)
+        self._executing: Dict[str, Tuple[asyncio.Task, asyncio.Future]] = {}
+        # 已出队但尚未开始执行时收到的取消请求: tid -> force
+        self._cancel_requested: Dict[str, bool] = {}
+        # 心跳与 Crash Recovery 等后台循环，不参与 Drain 等待
+        self._background: List[asyncio.Task] = []
+        # 已处理任务数 (成功 + 失败)，用于计算吞吐
+        self._processed = 0
+        self._started_at = 0.0
+        # 正在等待新消息的 Worker 循环 (停机时可直接取消)
+        self._idle: Set[asyncio.Task] = set()
         self._running = False
         # 生成唯一的 worker_id: hostname-uuid (截断以适应数据库字段)
         self.worker_id = f"{socket.gethostname()[:80]}-{uuid.uuid4().hex[:8]}"
@@ -23,93 +64,437 @@ class Worker:
         if self._running:
             return
         self._running = True
+        self._queues = list(queues)
+        self._started_at = time.time()
+        # 预解析任务分发表并调用处理函数模块的 warmup() 钩子 (出站连接池、飞书 Session、ScriptRunner)，
+        # 避免首个任务承担导入与建连开销；TASK_WARMUP=0 时连接池在首次请求时创建
+        build_dispatch_table()
+        # 任务生命周期事件批量写库
+        task_persister.start()
+        # 加载 registered_tasks 快照并订阅变更通知
+        task_registry.start()
         loop = asyncio.get_event_loop()
         for q in queues:
             task = loop.create_task(self._run(q))
             self._tasks.append(task)
+        self._background.append(loop.create_task(self._heartbeat_loop()))
+        self._background.append(loop.create_task(self._recovery_loop()))
+        self._background.append(loop.create_task(control_bus.listen()))
+        control_bus.subscribe(self._on_control)
         self.logger.info("Workers started for %s", ",".join(queues))
 
-    async def stop(self):
+    async def stop(self, timeout: Optional[float] = None):
+        """
+        优雅停机 (Drain)：
+        1. 停止拉取新任务
+        2. 在截止时间内等待执行中的任务完成
+        3. 超时仍在执行的任务以及已预取的消息释放回队列，供其他消费者立即接手
+        """
         self._running = False
+        await self._stop_background()
         if not self._tasks:
+            await task_persister.stop()
+            await http_client_pool.aclose()
             return
-        
-        self.logger.info("Stopping workers...")
-        # 取消所有任务
-        for task in self._tasks:
+
+        if timeout is None:
+            timeout = float(config.get("WORKER_DRAIN_TIMEOUT", 30))
+
+        started = time.time()
+        self.logger.info("Draining workers (timeout=%ss, in-flight=%d)...", timeout, len(self._inflight))
+
+        # 空闲循环阻塞在出队上，没有需要等待的任务，直接取消
+        for task in list(self._idle):
             task.cancel()
-        
-        # 等待所有任务结束
-        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        _, pending = await asyncio.wait(self._tasks, timeout=timeout)
+        if pending:
+            self.logger.warning("Drain deadline reached, cancelling %d worker loops", len(pending))
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
         self._tasks.clear()
-        self.logger.info("Workers stopped")
+
+        released = await self._release_inflight()
+
+        elapsed = time.time() - started
+        WORKER_DRAIN_SECONDS.observe(elapsed)
+        self.logger.info("Workers stopped, drained in %.2fs (released=%d)", elapsed, released)
+        # Drain 期间产生的生命周期事件全部落库后再退出
+        await task_persister.stop()
+        await http_client_pool.aclose()
+
+    async def _release_inflight(self) -> int:
+        """
+        将未完成的任务与当前消费者 PEL 中的残留消息归还队列
+        """
+        released = 0
+        for tid, (queue_name, _) in list(self._inflight.items()):
+            try:
+                if await asyncio.to_thread(queue_manager.release, tid):
+                    WORKER_DRAIN_RELEASED_TOTAL.labels(queue=queue_name).inc()
+                    released += 1
+            except Exception as e:
+                self.logger.error("Failed to release task %s: %s", tid, e)
+        self._inflight.clear()
+
+        for queue_name in self._queues:
+            try:
+                n = await asyncio.to_thread(queue_manager.release_pending, queue_name)
+                if n:
+                    WORKER_DRAIN_RELEASED_TOTAL.labels(queue=queue_name).inc(n)
+                    released += n
+            except Exception as e:
+                self.logger.error("Failed to release pending messages of %s: %s", queue_name, e)
+        return released
+
+    async def _stop_background(self):
+        control_bus.unsubscribe(self._on_control)
+        await task_registry.stop()
+        for task in self._background:
+            task.cancel()
+        await asyncio.gather(*self._background, return_exceptions=True)
+        self._background.clear()
+        try:
+            await worker_registry.unregister(self.worker_id)
+        except Exception as e:
+            self.logger.error("Failed to unregister worker heartbeat: %s", e)
+
+    def _heartbeat(self, tps: float, loop_lag: float) -> dict:
+        """
+        构造紧凑的心跳快照
+        """
+        return {
+            "worker_id": self.worker_id,
+            "consumer": getattr(queue_manager.backend, "consumer_name", None),
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "queues": self._queues,
+            "inflight": len(self._inflight),
+            "running": sorted({name for _, name in self._inflight.values()}),
+            "processed": self._processed,
+            "tps": round(tps, 3),
+            "loop_lag_ms": round(loop_lag * 1000, 1),
+            "rss_mb": round(psutil.Process().memory_info().rss / 1048576, 1),
+            "started_at": self._started_at,
+            "ts": time.time(),
+        }
+
+    async def _heartbeat_loop(self):
+        """
+        周期发布心跳；每秒采样一次事件循环延迟，心跳中上报区间内的最大值
+        """
+        loop = asyncio.get_running_loop()
+        tick = 1.0
+        last_ts = loop.time()
+        last_processed = self._processed
+        max_lag = 0.0
+        publish_due = 0.0  # 启动后立即发布一次
+        while True:
+            try:
+                now = loop.time()
+                if now >= publish_due:
+                    elapsed = now - last_ts
+                    tps = (self._processed - last_processed) / elapsed if elapsed > 0 else 0.0
+                    await worker_registry.publish(self._heartbeat(tps, max_lag))
+                    last_ts, last_processed, max_lag = now, self._processed, 0.0
+                    publish_due = now + worker_registry.interval()
+
+                t0 = loop.time()
+                await asyncio.sleep(tick)
+                max_lag = max(max_lag, loop.time() - t0 - tick)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                self.logger.error("Heartbeat error: %s", e)
+                await asyncio.sleep(tick)
+
+    async def _recovery_loop(self):
+        """
+        Crash Recovery：
+        - 每个心跳周期检查存活的消费者，发现有 Worker 消失时立即抢占其 Pending 消息
+        - 每 QUEUE_RECOVERY_INTERVAL 秒执行一次常规的超时抢占
+        """
+        known: Set[str] = set()
+        last_run = 0.0
+        while True:
+            try:
+                alive = await worker_registry.alive_consumers()
+                current = alive or set()
+                gone = known - current
+                known = current
+
+                interval = float(config.get("QUEUE_RECOVERY_INTERVAL", 60))
+                if gone or time.time() - last_run >= interval:
+                    if gone:
+                        self.logger.warning("Workers gone: %s, reclaiming their pending messages", ",".join(sorted(gone)))
+                    last_run = time.time()
+                    for queue_name in self._queues:
+                        await asyncio.to_thread(queue_manager.process_pending, queue_name, alive)
+
+                await asyncio.sleep(worker_registry.interval())
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                self.logger.error("Recovery loop error: %s", e)
+                await asyncio.sleep(worker_registry.interval())
+
+    def _on_control(self, message: dict):
+        if message.get("action") == "cancel" and message.get("tid"):
+            self.cancel(message["tid"], force=bool(message.get("force")))
+
+    def cancel(self, tid: str, force: bool = False) -> bool:
+        """
+        取消本 Worker 执行中的任务 (不属于本 Worker 的任务直接忽略)
+        - 协作式: 取消 asyncio Task，处理函数收到 CancelledError 后自行清理，脚本子进程先 SIGTERM
+        - 强制: 立即 kill 脚本子进程，且不再等待处理函数退出，马上释放执行槽位
+        """
+        entry = self._executing.get(tid)
+        if entry is None:
+            if tid in self._inflight:
+                # 已出队但尚未开始执行，开始前检查
+                self._cancel_requested[tid] = force
+                return True
+            return False
+
+        exec_task, abort = entry
+        self.logger.warning("Cancelling task %s (force=%s)", tid, force)
+        if force:
+            ScriptRunner.get_instance().kill(tid)
+            if not abort.done():
+                abort.set_result(None)
+        exec_task.cancel()
+        return True
+
+    async def _execute_cancellable(self, tid: str, queue_name: str, payload: dict):
+        """
+        在独立的 asyncio Task 中执行任务，使其可以被单独取消
+        """
+        token = current_task_id.set(tid)
+        try:
+            exec_task = asyncio.ensure_future(self._execute(queue_name, payload))
+        finally:
+            current_task_id.reset(token)
+        # 强制取消时不再等待 exec_task，这里消费掉它的结果避免告警
+        exec_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        abort = asyncio.get_running_loop().create_future()
+        self._executing[tid] = (exec_task, abort)
+
+        if tid in self._cancel_requested:
+            self.cancel(tid, force=self._cancel_requested[tid])
+
+        try:
+            await asyncio.wait({exec_task, abort}, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            # Worker 自身被取消 (Drain 超时)，连带取消任务
+            exec_task.cancel()
+            raise
+        finally:
+            self._executing.pop(tid, None)
+
+        if exec_task.done() and not exec_task.cancelled():
+            return exec_task.result()
+        raise TaskCancelledError(f"Task {payload.get('task')} was cancelled")
+
+    async def _execute(self, queue_name: str, payload: dict):
+        """
+        在 registered_tasks.timeout_seconds 的时限内执行任务
+        超时抛出 TaskTimeoutError，与普通失败一样在 _max_retries 内重新入队，用完后标记失败并写入 DLQ
+        超时会取消协程处理函数，脚本任务会终止子进程；线程池 / 进程池中的同步处理函数无法被中断，
+        会继续执行直到返回并占用执行槽位 (见 TaskExecutors.run)
+        """
+        task_name = payload.get("task")
+        timeout = task_registry.get_timeout(task_name)
+        try:
+            return await asyncio.wait_for(handle_task(task_name, payload.get("taskData", {})), timeout=timeout)
+        except asyncio.TimeoutError:
+            if timeout is None:
+                raise
+            TASK_TIMEOUT_TOTAL.labels(queue=queue_name, task_name=task_name or "unknown").inc()
+            raise TaskTimeoutError(f"Task {task_name} timed out after {timeout}s")
+
+    async def _cache_result(self, payload: dict, result):
+        """
+        开启了结果缓存的任务执行成功后写入缓存，后续相同请求在分发时直接命中
+        """
+        task_name = payload.get("task")
+        try:
+            policy = get_cache_policy(task_name)
+            key = result_cache.key_for(task_name, payload.get("taskData"), policy)
+            if key:
+                await result_cache.set(task_name, key, result, policy["ttl"])
+        except Exception as e:
+            self.logger.error("Failed to cache result of %s: %s", task_name, e)
+
+    async def _on_finished(self, tid: str, payload: dict, status: str, result=None, error: Optional[str] = None):
+        """
+        任务进入终态后的编排回调 (工作流节点触发后继 / 任务组计数与 chord 回调)
+        返回是否全部成功；回调是幂等的，失败时由调用方保留消息等待重新投递
+        """
+        ok = True
+        if payload.get("_workflow"):
+            try:
+                await workflow_engine.on_task_finished(payload, status, result=result, error=error)
+            except Exception as e:
+                ok = False
+                self.logger.error("Workflow callback failed for task %s: %s", tid, e)
+        if payload.get("_group"):
+            try:
+                await group_manager.on_task_finished(payload, status, result=result, error=error)
+            except Exception as e:
+                ok = False
+                self.logger.error("Group callback failed for task %s: %s", tid, e)
+        return ok
+
+    async def _hold_for_redelivery(self, tid: str) -> bool:
+        """
+        编排回调失败后是否保留消息 (不 ACK)，由后端退避后重新投递
+        Memory 后端没有重新投递、或失败次数超过 ORCHESTRATION_MAX_ATTEMPTS 时返回 False
+        """
+        if not queue_manager.supports_redelivery():
+            return False
+        try:
+            attempts = await asyncio.to_thread(queue_manager.defer, tid)
+        except Exception as e:
+            self.logger.error("Failed to defer task %s: %s", tid, e)
+            return False
+        return attempts <= int(config.get("ORCHESTRATION_MAX_ATTEMPTS", 5))
 
     async def _run(self, queue_name: str):
         while self._running:
             try:
-                # 使用 to_thread 运行同步的 dequeue 避免阻塞事件循环
-                item = await asyncio.to_thread(queue_manager.dequeue, queue_name)
+                # 事件驱动出队：空闲时挂起，新任务入队后立即唤醒
+                current = asyncio.current_task()
+                self._idle.add(current)
+                try:
+                    item = await queue_manager.adequeue(queue_name)
+                finally:
+                    self._idle.discard(current)
                 if not item:
-                    await asyncio.sleep(0.5)
                     continue
                 
                 tid, payload = item
+                task_name = payload.get("task") or "unknown"
+                self._inflight[tid] = (queue_name, task_name)
+                if not self._running:
+                    # 停机过程中拉取到的消息不再执行，留给 stop() 统一释放
+                    break
+
                 try:
                     # 记录任务开始
-                    await persist_task_start(tid, self.worker_id)
-                    
-                    # handle_task 现在是 async def，所以需要 await
-                    res = await handle_task(payload.get("task"), payload.get("taskData", {}))
-                    
-                    # 同步的标记操作也放入 to_thread
-                    await asyncio.to_thread(queue_manager.mark_done, tid)
-                    
-                    # 记录任务完成 (DB)
-                    await persist_task_finish(tid, "completed", result=res, worker_id=self.worker_id)
+                    await persist_task_start(tid, self.worker_id, queue=queue_name, task_name=task_name)
                     
+                    # 在可取消的独立 Task 中执行
+                    res = await self._execute_cancellable(tid, queue_name, payload)
+
+                    # 编排回调在 ACK 之前执行：回调失败时不 ACK，消息留在 PEL 中退避后重新投递，
+                    # 重复回调幂等地补发尚未入队的后继 / chord 回调 (任务本身按至少一次语义再次执行)
+                    orchestrated = await self._on_finished(tid, payload, "completed", result=res)
+                    if not orchestrated and await self._hold_for_redelivery(tid):
+                        self.logger.error("Task %s left unacknowledged for redelivery", tid)
+                    elif not orchestrated and queue_manager.supports_redelivery():
+                        # 编排回调失败次数用完：标记失败并写入 DLQ，不再重新投递
+                        error = "orchestration callback failed"
+                        try:
+                            await asyncio.to_thread(queue_manager.mark_failed, tid, error, payload)
+                        except Exception:
+                            pass
+                        await persist_task_finish(
+                            tid, "failed", result=res, error=error, worker_id=self.worker_id,
+                            queue=queue_name, task_name=task_name
+                        )
+                        try:
+                            notify(tid, payload.get("task"), payload, "failed", result=res, error=error)
+                        except Exception:
+                            pass
+                        self.logger.error("Task %s moved to DLQ: %s", tid, error)
+                    else:
+                        # 同步的标记操作也放入 to_thread
+                        await asyncio.to_thread(queue_manager.mark_done, tid)
+
+                        # 记录任务完成 (DB)
+                        await persist_task_finish(
+                            tid, "completed", result=res, worker_id=self.worker_id,
+                            queue=queue_name, task_name=task_name
+                        )
+                        await self._cache_result(payload, res)
+
+                        try:
+                            notify(tid, payload.get("task"), payload, "done", result=res, error=None)
+                        except Exception:
+                            pass
+                        self.logger.info("Task %s done", tid)
+                except TaskCancelledError as e:
                     try:
-                        notify(tid, payload.get("task"), payload, "done", result=res, error=None)
+                        await asyncio.to_thread(queue_manager.mark_cancelled, tid, payload)
                     except Exception:
                         pass
-                    self.logger.info("Task %s done", tid)
-                except Exception as e:
+                    await persist_task_finish(
+                        tid, "cancelled", error=str(e), worker_id=self.worker_id,
+                        queue=queue_name, task_name=task_name
+                    )
                     try:
-                        await asyncio.to_thread(queue_manager.mark_failed, tid, str(e), payload)
+                        notify(tid, payload.get("task"), payload, "cancelled", result=None, error=str(e))
                     except Exception:
                         pass
-                    
-                    final = False
-                    try:
-                        info = await asyncio.to_thread(queue_manager.get_task, tid)
-                        if info:
-                            st = info.get("status")
-                            rc = int(info.get("retry_count") or 0)
-                            mr = int(info.get("max_retries") or 0)
-                            final = (st in ("dead", "failed")) and (rc >= mr)
-                        else:
-                            # 注意：这里原代码调用了 queue_manager.status，但 QueueManager 类里似乎只有 status 方法在 backend.get_status
-                            # 统一使用 get_status 或 status
-                            st = await asyncio.to_thread(queue_manager.status, tid)
-                            final = st in ("dead", "failed")
-                    except Exception:
-                        final = True
-                    
-                    # 记录任务失败 (DB)
-                    # 只有当任务彻底失败（进入 dead/failed 且不再重试）或者是每次失败都记录？
-                    # 建议每次失败都记录，status 为 failed，如果重试会再次变成 processing
-                    # 但 persist_task_finish 会覆盖状态。
-                    # 如果只是临时失败，QueueManager 里的状态可能是 queued (for retry)。
-                    # 这里我们简单起见，记录当前错误。
-                    await persist_task_finish(tid, "failed", error=str(e), worker_id=self.worker_id)
-                    
-                    if final:
+                    await self._on_finished(tid, payload, "cancelled", error=str(e))
+                    TASK_CANCELLED_TOTAL.labels(
+                        queue=queue_name,
+                        task_name=payload.get("task") or "unknown",
+                        stage="running"
+                    ).inc()
+                    self.logger.warning("Task %s cancelled", tid)
+                except Exception as e:
+                    # 重试次数 (_max_retries) 在分发时确定：请求指定 > registered_tasks.max_retries > RETRY_MAX
+                    retry_count = int(payload.get("_retry_count") or 0)
+                    max_retries = int(payload.get("_max_retries") or 0)
+                    retried = False
+                    if retry_count < max_retries:
+                        try:
+                            retried = await asyncio.to_thread(
+                                queue_manager.requeue, tid, {**payload, "_retry_count": retry_count + 1}, str(e)
+                            )
+                        except Exception as requeue_error:
+                            self.logger.error("Failed to requeue task %s: %s", tid, requeue_error)
+
+                    if retried:
+                        TASK_RETRIED_TOTAL.labels(queue=queue_name, task_name=task_name).inc()
+                        self.logger.warning(
+                            "Task %s failed (attempt %d/%d), requeued: %s", tid, retry_count + 1, max_retries + 1, e
+                        )
+                    elif not await self._on_finished(tid, payload, "failed", error=str(e)) \
+                            and await self._hold_for_redelivery(tid):
+                        # 编排回调失败：与成功路径一致，不 ACK 等待退避后重新投递 (次数用完后照常写入 DLQ)
+                        self.logger.error("Task %s failed and left unacknowledged for redelivery: %s", tid, e)
+                    else:
+                        # 重试次数用完 (或无法重新入队)：编排回调之后标记失败并写入 DLQ，触发 Webhook
+                        try:
+                            await asyncio.to_thread(queue_manager.mark_failed, tid, str(e), payload)
+                        except Exception:
+                            pass
+                        await persist_task_finish(
+                            tid, "failed", error=str(e), worker_id=self.worker_id,
+                            queue=queue_name, task_name=task_name
+                        )
                         try:
                             notify(tid, payload.get("task"), payload, "failed", result=None, error=str(e))
                         except Exception:
                             pass
-                    
-                    # TASK_FAILED_TOTAL.labels(queue=queue_name, task_name=task_name, error_type=type(e).__name__).inc()
-                    self.logger.error("Task %s failed: %s", tid, e)
+                        self.logger.error("Task %s failed: %s", tid, e)
+
+                    try:
+                        TASK_FAILED_TOTAL.labels(
+                            queue=queue_name,
+                            task_name=payload.get("task") or "unknown",
+                            error_type=type(e).__name__
+                        ).inc()
+                    except Exception:
+                        pass
+
+                # 取消 (Drain 超时) 时不会执行到这里，任务保留在 _inflight 中等待释放
+                self._inflight.pop(tid, None)
+                self._cancel_requested.pop(tid, None)
+                self._processed += 1
             except asyncio.CancelledError:
                 break
             except Exception as e:
@@ -118,3 +503,29 @@ class Worker:
 
 
 worker = Worker()
+
+
+async def _serve(queues: List[str]):
+    """
+    独立 Worker 进程入口：收到 SIGTERM/SIGINT 后执行 Drain 再退出
+    """
+    loop = asyncio.get_running_loop()
+    stop_event = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Windows 不支持 add_signal_handler，依赖 KeyboardInterrupt
+            pass
+
+    worker.start(queues)
+    try:
+        await stop_event.wait()
+    finally:
+        await worker.stop()
+        executors.shutdown()
+
+
+if __name__ == "__main__":
+    import sys
+    asyncio.run(_serve(sys.argv[1:] or ["api", "script"]))
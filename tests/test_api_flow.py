@@ -133,3 +133,285 @@ def test_metrics_endpoint():
     assert "procurator_task_queue_size" in content
     assert "procurator_task_started_total" in content
     assert "procurator_task_execution_seconds" in content
+
+def test_dispatch_uses_registry_defaults(mocker):
+    """
+    未指定 queue / maxRetries 时使用 registered_tasks 快照中的配置
+    """
+    from app.services.task_registry import task_registry
+    mocker.patch.object(task_registry, "_snapshot", {
+        "demo_script": {"default_queue": "script", "max_retries": 2, "timeout_seconds": 60, "is_active": True},
+    })
+    headers = {"X-API-Token": TEST_TOKEN}
+
+    response = client.post("/dispatch", json={"task": "demo_script", "taskData": {}}, headers=headers)
+    assert response.status_code == 200
+    detail = client.get(f"/task/{response.json()['task_id']}/detail", headers=headers).json()
+    assert detail["queue"] == "script"
+    assert detail["payload"]["_max_retries"] == 2
+
+def test_dispatch_rejects_schema_violation_before_enqueue(mocker):
+    """
+    taskData 不符合任务登记的输入模型时返回 422，且不入队
+    """
+    from app.main import queue_manager
+    enqueue = mocker.spy(queue_manager, "enqueue")
+    headers = {"X-API-Token": TEST_TOKEN}
+
+    bad = {"task": "script.execute", "taskData": {"script_name": "../etc/passwd"}}
+    response = client.post("/dispatch", json=bad, headers=headers)
+    assert response.status_code == 422
+    bad = {"task": "proxy_multi_forward", "taskData": {"tasks": [{"method": "GET"}]}}
+    response = client.post("/dispatch", json=bad, headers=headers)
+    assert response.status_code == 422
+    enqueue.assert_not_called()
+
+    ok = {"task": "proxy_multi_forward", "taskData": {"tasks": [{"url": "http://example.com", "method": "get"}]}}
+    response = client.post("/dispatch", json=ok, headers=headers)
+    assert response.status_code == 200
+    detail = client.get(f"/task/{response.json()['task_id']}/detail", headers=headers).json()
+    assert detail["payload"]["taskData"] == {"tasks": [{"url": "http://example.com", "method": "GET"}]}
+
+def test_workflow_submission_rejects_cycles(mocker):
+    """
+    提交含环的工作流返回 422
+    """
+    headers = {"X-API-Token": TEST_TOKEN}
+    body = {
+        "nodes": [{"id": "a", "task": "system.ping"}, {"id": "b", "task": "system.ping"}],
+        "edges": [["a", "b"], ["b", "a"]],
+    }
+    response = client.post("/workflows", json=body, headers=headers)
+    assert response.status_code == 422
+
+def test_dispatch_idempotency_key_returns_original_task():
+    """
+    相同 Idempotency-Key (或 dedupe_key) 的重复请求返回首次入队的 task_id，不重复入队
+    """
+    headers = {"X-API-Token": TEST_TOKEN, "Idempotency-Key": "order-42"}
+    body = {"task": "demo_script", "taskData": {"k": "v"}}
+
+    first = client.post("/dispatch", json=body, headers=headers).json()
+    second = client.post("/dispatch", json=body, headers=headers).json()
+    assert second["task_id"] == first["task_id"]
+    assert second["duplicate"] is True
+
+    headers = {"X-API-Token": TEST_TOKEN}
+    third = client.post("/dispatch", json={**body, "dedupe_key": "order-42"}, headers=headers).json()
+    assert third["task_id"] == first["task_id"]
+    other = client.post("/dispatch", json={**body, "dedupe_key": "order-43"}, headers=headers).json()
+    assert other["task_id"] != first["task_id"]
+
+def test_dispatch_dedupe_runs_before_admission_and_fails_open(mocker):
+    """
+    幂等查询先于准入控制：过载时重试的客户端仍拿回原 task_id，被拒绝的新请求释放占位；
+    幂等存储异常时放行，不返回 500
+    """
+    import time
+    from app.infra.idempotency import idempotency_store
+    from app.queues.admission import admission_controller
+    headers = {"X-API-Token": TEST_TOKEN, "Idempotency-Key": "order-77"}
+    body = {"task": "demo_script", "taskData": {}}
+    first = client.post("/dispatch", json=body, headers=headers).json()
+
+    mocker.patch.dict(admission_controller._refreshed_at, {"api": time.monotonic() + 3600})
+    mocker.patch.dict(admission_controller._drain_rate, {"api": 1000.0})
+    depth = mocker.patch.dict(admission_controller._depth, {"api": 200000})
+    retry = client.post("/dispatch", json=body, headers=headers)
+    assert retry.status_code == 200
+    assert retry.json()["task_id"] == first["task_id"]
+
+    shed_headers = {**headers, "Idempotency-Key": "order-78"}
+    assert client.post("/dispatch", json=body, headers=shed_headers).status_code == 503
+    depth["api"] = 0
+    accepted = client.post("/dispatch", json=body, headers=shed_headers).json()
+    assert accepted["task_id"] != first["task_id"]
+    assert "duplicate" not in accepted
+
+    mocker.patch.object(idempotency_store, "claim", side_effect=ConnectionError("redis down"))
+    response = client.post("/dispatch", json=body, headers={**headers, "Idempotency-Key": "order-79"})
+    assert response.status_code == 200
+    assert response.json()["task_id"]
+
+def test_local_idempotency_store_is_bounded(mocker):
+    """
+    Memory 模式的幂等字典超过 IDEMPOTENCY_LOCAL_MAX_KEYS 时淘汰最早的键
+    """
+    import asyncio
+    from app.infra.idempotency import IdempotencyStore
+    store = IdempotencyStore()
+    store.enabled = False
+    mocker.patch.object(store, "local_max_keys", return_value=2)
+
+    for i in range(3):
+        assert asyncio.run(store.claim(f"k{i}", f"t{i}")) is None
+    assert list(store._local) == ["k1", "k2"]
+    assert asyncio.run(store.claim("k2", "other")) == "t2"
+
+def test_dispatch_serves_cached_results(mocker):
+    """
+    开启 @cacheable 的任务：相同 taskData 的同步/异步分发命中缓存，不再执行也不入队
+    """
+    from app.infra.result_cache import result_cache
+    from app.main import queue_manager
+    result_cache.clear()
+    handler = mocker.patch("app.main.handle_task", new=mocker.AsyncMock(return_value={"tenant_access_token": "t-1"}))
+    enqueue = mocker.spy(queue_manager, "enqueue")
+    headers = {"X-API-Token": TEST_TOKEN}
+    body = {"task": "feishu_get_token", "taskData": {"app_id": "a", "app_secret": "s"}, "async": False}
+
+    first = client.post("/dispatch", json=body, headers=headers).json()
+    assert first["result"] == {"tenant_access_token": "t-1"}
+    assert "cached" not in first
+
+    second = client.post("/dispatch", json={**body, "async": True}, headers=headers).json()
+    assert second["cached"] is True
+    assert second["result"] == {"tenant_access_token": "t-1"}
+    assert handler.await_count == 1
+    enqueue.assert_not_called()
+    # 异步命中同样返回可查询的 task_id
+    status = client.get(f"/task/{second['task_id']}", headers=headers).json()
+    assert status["status"] == "completed"
+
+    # 转发任务不做任务级结果缓存 (GET/HEAD 子请求由 HTTP 响应缓存按 Cache-Control 处理)
+    from app.queues.tasks import get_cache_policy
+    assert get_cache_policy("proxy_multi_forward") is None
+    result_cache.clear()
+
+def test_feishu_token_cache_is_invalidated_by_set_token(mocker):
+    """
+    缓存命中的 get_token 返回剩余有效期；set_token 更新 Token 后缓存失效
+    """
+    from app.infra.result_cache import result_cache
+    result_cache.clear()
+    mocker.patch("app.services.feishu.get_tenant_access_token", return_value=("t-1", 7200))
+    mocker.patch("app.services.feishu.redis_client")
+    headers = {"X-API-Token": TEST_TOKEN}
+    body = {"task": "feishu_get_token", "taskData": {"app_id": "a", "app_secret": "s"}, "async": False}
+
+    first = client.post("/dispatch", json=body, headers=headers).json()
+    assert first["result"] == {"tenant_access_token": "t-1", "expire": 7200}
+
+    # 模拟已缓存 100 秒
+    key = next(iter(result_cache._l1))
+    expires_at, value = result_cache._l1[key]
+    result_cache._l1[key] = (expires_at - 100, value)
+    cached = client.post("/dispatch", json=body, headers=headers).json()
+    assert cached["cached"] is True
+    assert 7099 <= cached["result"]["expire"] <= 7100
+
+    mocker.patch("app.services.feishu.get_tenant_access_token", return_value=("t-2", 7200))
+    manual = {"task": "feishu_set_token", "taskData": {"app_id": "a", "token": "t-2"}, "async": False}
+    assert client.post("/dispatch", json=manual, headers=headers).status_code == 200
+    fresh = client.post("/dispatch", json=body, headers=headers).json()
+    assert "cached" not in fresh
+    assert fresh["result"]["tenant_access_token"] == "t-2"
+    result_cache.clear()
+
+def test_sync_dispatch_pool_saturation_returns_503(mocker):
+    """
+    同步执行池已满时快速失败 (503 + Retry-After)
+    """
+    from app.core.executors import sync_dispatch_pool, PoolSaturatedError
+    mocker.patch.object(sync_dispatch_pool, "acquire", side_effect=PoolSaturatedError("queue_full", 1.0))
+    handler = mocker.patch("app.main.handle_task", new=mocker.AsyncMock(return_value="ok"))
+    headers = {"X-API-Token": TEST_TOKEN}
+
+    response = client.post("/dispatch", json={"task": "demo_script", "taskData": {}, "async": False}, headers=headers)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    handler.assert_not_awaited()
+
+def test_dispatch_admission_sheds_by_priority(mocker):
+    """
+    队列积压超过阈值时按优先级拒绝：low 先于 high，超过高水位时全部 503
+    """
+    import time
+    from app.queues.admission import admission_controller
+    mocker.patch.dict(admission_controller._refreshed_at, {"api": time.monotonic() + 3600})
+    mocker.patch.dict(admission_controller._drain_rate, {"api": 1000.0})
+    depth = mocker.patch.dict(admission_controller._depth, {"api": 9000})
+    enqueue = mocker.patch("app.main.queue_manager.enqueue", return_value="tid-1")
+    mocker.patch("app.main.persist_task_init")
+    headers = {"X-API-Token": TEST_TOKEN}
+
+    def dispatch(priority):
+        body = {"task": "demo_script", "taskData": {}, "priority": priority}
+        return client.post("/dispatch", json=body, headers=headers)
+
+    # 高水位 10000：normal 阈值 8000，high 阈值 10000
+    response = dispatch("low")
+    assert response.status_code == 429
+    # Retry-After = ceil((9000 - 5000 + 1) / 1000 tps)
+    assert response.headers["Retry-After"] == "5"
+    response = dispatch("normal")
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
+    assert dispatch("high").status_code == 200
+    assert enqueue.call_count == 1
+
+    depth["api"] = 200000
+    response = dispatch("high")
+    assert response.status_code == 503
+    # 按上限 ADMISSION_RETRY_AFTER_MAX 截断
+    assert response.headers["Retry-After"] == "60"
+    assert enqueue.call_count == 1
+
+def test_task_detail_serializes_urls_and_models(mocker):
+    """
+    大结果接口走 orjson 响应：HttpUrl / Pydantic 模型 / datetime 无需预先转换
+    """
+    from datetime import datetime
+    from pydantic import BaseModel, HttpUrl, TypeAdapter
+    from app.queues.task_queue import queue_manager
+
+    class Item(BaseModel):
+        url: HttpUrl
+
+    url = TypeAdapter(HttpUrl).validate_python("https://example.com/a")
+    detail = {"status": "completed", "urls": [url], "item": Item(url=url), "at": datetime(2024, 1, 1, 8, 30)}
+    mocker.patch.object(queue_manager.backend, "get_task", return_value=detail)
+
+    response = client.get("/task/tid-1/detail", headers={"X-API-Token": TEST_TOKEN})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.json() == {
+        "status": "completed",
+        "urls": ["https://example.com/a"],
+        "item": {"url": "https://example.com/a"},
+        "at": "2024-01-01T08:30:00",
+    }
+
+def test_sync_proxy_forward_is_concurrent_with_deadline(mocker):
+    """
+    同步 /proxy/forward 并发请求各目标，超过整体截止时间的目标返回部分结果
+    """
+    import asyncio
+    import time
+    mocker.patch.object(config, "get", side_effect=lambda k, default=None: {
+        "API_TOKEN": TEST_TOKEN, "API_ROLE": "admin", "PROXY_SYNC_DEADLINE_SECONDS": 0.5
+    }.get(k, default))
+
+    async def fake_post(url, payload, headers, timeout, response_mode="body", max_bytes=None, follow_redirects=False):
+        # 同步路径沿用 urllib 的重定向跟随
+        assert follow_redirects is True
+        await asyncio.sleep(5 if "slow" in url else 0.2)
+        return {"url": url, "status": 200, "ok": True, "response": {"echo": payload}, "duration_ms": 200}
+
+    mocker.patch("app.services.system._post_json", side_effect=fake_post)
+    urls = ["http://a.example.com", "http://b.example.com", "http://slow.example.com"]
+
+    start = time.perf_counter()
+    response = client.post("/proxy/forward", json={"urls": urls, "data": {"x": 1}},
+                           headers={"X-API-Token": TEST_TOKEN})
+    elapsed = time.perf_counter() - start
+
+    assert response.status_code == 200
+    body = response.json()
+    # 两个 0.2s 的目标并发完成，慢目标在 0.5s 截止时被取消
+    assert elapsed < 2
+    assert body["count"] == 3 and body["ok"] == 2 and body["failed"] == 1 and body["partial"] is True
+    # 保持原有结果格式 (HttpUrl 规范化会补上末尾的 /)
+    assert body["results"][0] == {"url": urls[0] + "/", "code": 200, "ok": True, "ms": 200, "response": {"echo": {"x": 1}}}
+    assert body["results"][2]["error"] == "deadline_exceeded"
+    assert body["results"][2]["code"] is None
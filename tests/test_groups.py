@@ -0,0 +1,147 @@
+import asyncio
+import pytest
+
+from app.queues.task_queue import MemoryBackend
+from app.services.groups import GroupManager
+from app.worker import Worker
+
+
+@pytest.fixture
+def groups(mocker):
+    """
+    Memory 模式的 GroupManager + 独立 MemoryBackend，屏蔽数据库持久化与 Webhook
+    """
+    backend = MemoryBackend()
+    mocker.patch("app.worker.queue_manager.backend", backend)
+    mocker.patch("app.worker.persist_task_start", new=mocker.AsyncMock())
+    mocker.patch("app.worker.persist_task_finish", new=mocker.AsyncMock())
+    mocker.patch("app.worker.notify")
+    mocker.patch("app.services.groups.persist_task_init", new=mocker.AsyncMock())
+    manager = GroupManager()
+    manager.enabled = False
+    mocker.patch("app.worker.group_manager", manager)
+    return manager
+
+
+def _member(i):
+    return {"task": "system.ping", "taskData": {"i": i}, "queue": "api", "_max_retries": None}
+
+
+@pytest.mark.asyncio
+async def test_chord_callback_receives_ordered_results(groups, mocker):
+    """
+    成员乱序完成，回调任务恰好入队一次，结果按成员顺序排列；组级 Webhook 只通知一次
+    """
+    notify = mocker.patch("app.services.groups.notify")
+    callback_data = []
+
+    async def _handler(task_name, task_data):
+        if "_results" in task_data:
+            callback_data.append(task_data)
+            return "aggregated"
+        await asyncio.sleep(0.01 * (5 - task_data["i"]))
+        return task_data["i"] * 10
+
+    mocker.patch("app.worker.handle_task", side_effect=_handler)
+    callback = {"task": "system.ping", "taskData": {}, "queue": "api", "_max_retries": None}
+    gid, tids = await groups.submit([_member(i) for i in range(5)], callback=callback, webhook="http://hook")
+    assert len(tids) == 5
+
+    w = Worker()
+    w.start(["api", "api"])
+    for _ in range(100):
+        if callback_data:
+            break
+        await asyncio.sleep(0.02)
+    await w.stop(timeout=1)
+
+    assert len(callback_data) == 1
+    assert callback_data[0]["_results"] == [0, 10, 20, 30, 40]
+    assert callback_data[0]["_failed"] == []
+    info = await groups.get(gid)
+    assert info["status"] == "completed"
+    assert info["callback_task_id"]
+    assert notify.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_duplicate_and_failed_members(groups, mocker):
+    """
+    重复完成只计一次；失败成员的结果为 None 并记录下标
+    """
+    mocker.patch("app.services.groups.notify")
+    gid, _ = await groups.submit([_member(0), _member(1)])
+
+    await groups.on_task_finished({"_group": {"id": gid, "index": 0}}, "completed", result="a")
+    await groups.on_task_finished({"_group": {"id": gid, "index": 0}}, "completed", result="a")
+    assert (await groups.get(gid))["finished"] == 1
+
+    await groups.on_task_finished({"_group": {"id": gid, "index": 1}}, "failed", error="boom")
+    info = await groups.get(gid, include_results=True)
+    assert info["status"] == "failed"
+    assert info["results"] == ["a", None]
+    assert info["errors"] == {1: "boom"}
+
+
+@pytest.mark.asyncio
+async def test_redelivered_member_enqueues_lost_callback_once(groups, mocker):
+    """
+    fired 之后、回调入队前中断：重新投递的成员完成回调补发回调任务，且只入队一次
+    """
+    from app.services.groups import callback_task_id
+    from app.worker import queue_manager
+
+    mocker.patch("app.services.groups.notify")
+    callback = {"task": "system.ping", "taskData": {}, "queue": "api", "_max_retries": None}
+    gid, _ = await groups.submit([_member(0), _member(1)], callback=callback)
+    await groups.on_task_finished({"_group": {"id": gid, "index": 0}}, "completed", result="a")
+
+    real = queue_manager.enqueue_once
+    calls = []
+
+    def _flaky(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise RuntimeError("redis down")
+        return real(*args)
+
+    mocker.patch.object(queue_manager, "enqueue_once", side_effect=_flaky)
+    payload_1 = {"_group": {"id": gid, "index": 1}}
+    with pytest.raises(RuntimeError):
+        await groups.on_task_finished(payload_1, "completed", result="b")
+    info = await groups.get(gid)
+    assert info["status"] == "running"
+    assert info["callback_task_id"] is None
+
+    await groups.on_task_finished(payload_1, "completed", result="b")
+    await groups.on_task_finished(payload_1, "completed", result="b")
+    tid = callback_task_id(gid)
+    info = await groups.get(gid)
+    assert info["status"] == "completed"
+    assert info["callback_task_id"] == tid
+    assert queue_manager.backend.queues["api"].count(tid) == 1
+    assert queue_manager.backend.get_task(tid)["payload"]["taskData"]["_results"] == ["a", "b"]
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_replayed_finish_does_not_resend_group_webhook(groups, mocker):
+    """
+    最后一个成员的完成回调与其重复投递并发执行 (都看到 fired 且组仍为 running)：回调只入队一次，Webhook 只通知一次
+    """
+    from app.worker import queue_manager
+
+    notify = mocker.patch("app.services.groups.notify")
+    callback = {"task": "system.ping", "taskData": {}, "queue": "api", "_max_retries": None}
+    gid, _ = await groups.submit([_member(0)], callback=callback, webhook="http://hook.example.com")
+
+    payload = {"_group": {"id": gid, "index": 0}}
+    await asyncio.gather(
+        groups.on_task_finished(payload, "completed", result="a"),
+        groups.on_task_finished(payload, "completed", result="a"),
+    )
+
+    info = await groups.get(gid)
+    assert info["status"] == "completed"
+    assert queue_manager.backend.queues["api"].count(info["callback_task_id"]) == 1
+    assert notify.call_count == 1
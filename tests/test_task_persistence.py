@@ -0,0 +1,87 @@
+import asyncio
+import pytest
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app.core.database import Base
+from app.models.task import Task
+from app.services.task_persistence import TaskPersister
+
+
+@pytest_asyncio.fixture
+async def session_factory(mocker):
+    """
+    独立的内存 SQLite 数据库
+    """
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    mocker.patch("app.services.task_persistence.AsyncSessionLocal", factory)
+    yield factory
+    await engine.dispose()
+
+
+async def _row(factory, tid):
+    async with factory() as session:
+        return await session.get(Task, tid)
+
+
+@pytest.mark.asyncio
+async def test_events_coalesce_into_one_upsert(session_factory, mocker):
+    """
+    同一任务的 init / start / finish 在缓冲区内合并，一次刷新写入
+    """
+    persister = TaskPersister()
+    persister.start()
+    write = mocker.spy(persister, "_write")
+
+    await persister.submit("t1", {"queue": "api", "task_name": "system.ping", "payload": {"a": 1}, "status": "pending"})
+    await persister.submit("t1", {"queue": "api", "task_name": "system.ping", "status": "processing", "worker_id": "w1"})
+    await persister.submit("t1", {"queue": "api", "task_name": "system.ping", "status": "completed", "result": "pong"})
+    await persister.stop()
+
+    assert write.await_count == 1
+    row = await _row(session_factory, "t1")
+    assert row.status == "completed"
+    assert row.payload == {"a": 1}
+    assert row.worker_id == "w1"
+    assert row.result == "pong"
+
+
+@pytest.mark.asyncio
+async def test_finish_before_init_is_not_lost(session_factory):
+    """
+    finish 先于 init 落库：之后到达的 init 只补充 payload / 队列，不把终态改回 pending
+    """
+    persister = TaskPersister()
+    await persister.submit("t2", {"queue": "unknown", "task_name": "unknown", "status": "failed", "error": "boom"})
+    await persister.submit("t2", {"queue": "script", "task_name": "demo_script", "payload": {"b": 2}, "status": "pending"})
+
+    row = await _row(session_factory, "t2")
+    assert row.status == "failed"
+    assert row.error == "boom"
+    assert row.queue == "script"
+    assert row.payload == {"b": 2}
+
+
+@pytest.mark.asyncio
+async def test_full_buffer_applies_backpressure(session_factory, mocker):
+    """
+    缓冲区满时新任务的事件等待刷新腾出空间
+    """
+    mocker.patch.object(TaskPersister, "buffer_size", return_value=2)
+    mocker.patch.object(TaskPersister, "interval", return_value=60)
+    persister = TaskPersister()
+    persister.start()
+
+    await persister.submit("a", {"queue": "api", "task_name": "x", "status": "pending"})
+    await persister.submit("b", {"queue": "api", "task_name": "x", "status": "pending"})
+    blocked = asyncio.ensure_future(persister.submit("c", {"queue": "api", "task_name": "x", "status": "pending"}))
+    await asyncio.sleep(0.1)
+    # 背压唤醒刷新循环，写入 a / b 后 c 进入缓冲区
+    assert blocked.done()
+    assert await _row(session_factory, "a") is not None
+    await persister.stop()
+    assert await _row(session_factory, "c") is not None
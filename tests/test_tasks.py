@@ -0,0 +1,525 @@
+import asyncio
+import threading
+import time
+import pytest
+
+from app.core.executors import cpu_bound
+from app.queues.tasks import ALLOWED_TASKS, handle_task
+
+
+def _blocking_handler(data: dict):
+    time.sleep(data.get("sleep", 0))
+    return threading.current_thread().name
+
+
+@cpu_bound
+def _cpu_handler(data: dict):
+    return sum(i * i for i in range(data.get("n", 0)))
+
+
+@pytest.fixture
+def sync_tasks(mocker):
+    mocker.patch.dict(ALLOWED_TASKS, {
+        "test.blocking": f"{__name__}._blocking_handler",
+        "test.cpu": f"{__name__}._cpu_handler",
+    })
+
+
+@pytest.mark.asyncio
+async def test_sync_handler_runs_off_event_loop(sync_tasks):
+    """
+    同步处理函数在线程池中执行，不阻塞事件循环
+    """
+    ticks = 0
+
+    async def _ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    ticker = asyncio.create_task(_ticker())
+    thread_name = await handle_task("test.blocking", {"sleep": 0.2})
+    ticker.cancel()
+
+    assert thread_name.startswith("task")
+    assert ticks >= 5
+
+
+@pytest.mark.asyncio
+async def test_timed_out_sync_handler_is_tracked_as_abandoned(sync_tasks):
+    """
+    超时无法中断线程池中的同步处理函数：运行期间计入 abandoned，返回后归还
+    """
+    from app.core.metrics import TASK_POOL_ABANDONED
+    gauge = TASK_POOL_ABANDONED.labels(pool="thread")
+    before = gauge._value.get()
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(handle_task("test.blocking", {"sleep": 0.3}), timeout=0.05)
+    assert gauge._value.get() == before + 1
+    await asyncio.sleep(0.4)
+    assert gauge._value.get() == before
+
+
+@pytest.mark.asyncio
+async def test_cpu_bound_handler_runs_in_process_pool(sync_tasks):
+    """
+    标记 @cpu_bound 的处理函数在进程池中执行并返回结果
+    """
+    assert await handle_task("test.cpu", {"n": 1000}) == sum(i * i for i in range(1000))
+
+
+def test_dispatch_table_resolves_all_handlers():
+    """
+    分发表在启动时解析全部 ALLOWED_TASKS
+    """
+    from app.queues.tasks import build_dispatch_table
+
+    table = build_dispatch_table(warmup=False)
+    assert set(table) == set(ALLOWED_TASKS)
+    func, kind = table["system.ping"]
+    assert func.__name__ == "ping" and kind is None
+
+
+def test_dispatch_table_warmup_runs_module_hooks(mocker):
+    """
+    预热时每个处理函数模块的 warmup() 只调用一次：出站连接池、飞书 Session、ScriptRunner 单例
+    """
+    from app.queues.tasks import build_dispatch_table
+    from app.core.script_runner import ScriptRunner
+    from app.infra import feishu_client
+
+    start = mocker.patch("app.services.system.http_client_pool.start")
+    mocker.patch.object(feishu_client, "_session", None)
+    mocker.patch.object(ScriptRunner, "_instance", None)
+
+    build_dispatch_table(warmup=True)
+    start.assert_called_once_with()
+    assert feishu_client._session is not None
+    assert ScriptRunner._instance is not None
+
+
+@pytest.mark.asyncio
+async def test_unknown_task_raises_at_dispatch():
+    with pytest.raises(ValueError):
+        await handle_task("no.such.task", {})
+
+
+def test_registry_snapshot_controls_allowed_tasks(mocker):
+    """
+    registered_tasks 中停用的任务被拒绝，未注册的任务由 ALLOWED_TASKS 决定
+    """
+    from app.queues.tasks import is_allowed
+    from app.services.task_registry import task_registry
+
+    mocker.patch.object(task_registry, "_snapshot", {
+        "system.ping": {"default_queue": "api", "max_retries": 3, "timeout_seconds": 5, "is_active": False},
+    })
+    assert is_allowed("system.ping", "api", "admin") is False
+    assert is_allowed("demo_script", "api", "admin") is True
+    assert is_allowed("unknown.task", "api", "admin") is False
+    assert task_registry.get_timeout("system.ping") == 5.0
+
+
+@pytest.mark.asyncio
+async def test_webhook_config_snapshot_caches_and_invalidates(mocker):
+    """
+    Webhook 配置快照：TTL 内的命中与未命中 (负缓存) 都不查询数据库，变更通知后重新加载
+    """
+    from app.queues.control import control_bus
+    from app.services.webhook_config import WebhookConfigCache, WEBHOOKS_CHANGED_ACTION
+
+    cache = WebhookConfigCache()
+    control_bus.unsubscribe(cache._on_control)
+    snapshots = [{"proxy_forward": "http://hook/a"}, {"proxy_forward": "http://hook/b"}]
+
+    async def _reload():
+        cache._snapshot = snapshots.pop(0)
+        cache._loaded_at = time.monotonic()
+
+    reload = mocker.patch.object(cache, "_reload", side_effect=_reload)
+    assert await cache.get("proxy_forward") == "http://hook/a"
+    assert await cache.get("system.ping") is None
+    assert await cache.get("proxy_forward") == "http://hook/a"
+    assert reload.await_count == 1
+
+    cache._on_control({"action": WEBHOOKS_CHANGED_ACTION})
+    assert await cache.get("proxy_forward") == "http://hook/b"
+    assert reload.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_singleflight_shares_one_execution():
+    """
+    并发的相同请求共享一次执行；执行结束后的新请求重新执行；异常同样传给所有调用方
+    """
+    from app.infra.singleflight import SingleFlight
+
+    flight = SingleFlight()
+    calls = []
+
+    async def _fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"token": len(calls)}
+
+    results = await asyncio.gather(*[flight.do("k", _fetch, task_name="t") for _ in range(10)])
+    assert len(calls) == 1
+    assert all(r == {"token": 1} for r in results)
+    assert flight.inflight() == 0
+
+    assert await flight.do("k", _fetch) == {"token": 2}
+
+    async def _boom():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    results = await asyncio.gather(*[flight.do("e", _boom) for _ in range(3)], return_exceptions=True)
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+@pytest.mark.asyncio
+async def test_sync_dispatch_pool_rejects_when_saturated(mocker):
+    """
+    同步分发池：并发达到上限后，排队人数超限立即拒绝，排队超时同样拒绝
+    """
+    from app.core.executors import SyncDispatchPool, PoolSaturatedError
+
+    pool = SyncDispatchPool()
+    mocker.patch.object(pool, "size", return_value=1)
+    mocker.patch.object(pool, "max_queue", return_value=1)
+    mocker.patch.object(pool, "queue_timeout", return_value=0.05)
+
+    await pool.acquire()
+    waiter = asyncio.ensure_future(pool.acquire())
+    await asyncio.sleep(0)
+    with pytest.raises(PoolSaturatedError) as e:
+        await pool.acquire()
+    assert e.value.reason == "queue_full"
+    with pytest.raises(PoolSaturatedError) as e:
+        await waiter
+    assert e.value.reason == "queue_timeout"
+
+    pool.release()
+    await pool.acquire()
+    pool.release()
+
+
+@pytest.mark.asyncio
+async def test_shared_http_client_reuses_connections():
+    """
+    共享连接池：同一主机的后续请求复用 keep-alive 连接，并记录复用指标
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from prometheus_client import REGISTRY
+    from app.infra.http_client import HttpClientPool
+
+    class _Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            body = b'{"ok": true}'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/hook"
+
+    def _count(result):
+        return REGISTRY.get_sample_value("procurator_http_client_connections_total", {"result": result}) or 0
+
+    pool = HttpClientPool()
+    new_before, reused_before = _count("new"), _count("reused")
+    try:
+        for _ in range(3):
+            resp = await pool.request("POST", url, json={"x": 1}, timeout=5)
+            assert resp.json() == {"ok": True}
+    finally:
+        await pool.aclose()
+        server.shutdown()
+
+    assert _count("new") - new_before == 1
+    assert _count("reused") - reused_before == 2
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_opens_and_recovers_through_half_open(mocker):
+    """
+    熔断器：窗口内错误率超限后打开 (快速失败)，冷却后放行单个探测请求，探测成功后关闭
+    """
+    from app.core.config import config
+    from app.infra.circuit_breaker import (
+        circuit_breakers, CircuitBreakerRegistry, CircuitOpenError, STATE_OPEN, STATE_HALF_OPEN, STATE_CLOSED,
+        _broadcasts,
+    )
+    settings = {"CIRCUIT_MIN_REQUESTS": 4, "CIRCUIT_ERROR_RATE": 0.5, "CIRCUIT_OPEN_SECONDS": 0.05}
+    mocker.patch.object(config, "get", side_effect=lambda k, default=None: settings.get(k, default))
+
+    host = "breaker-test.example.com"
+    breaker = circuit_breakers.get(host)
+    # 另一个进程的熔断器：通过控制通道同步状态 (Memory 模式下直接分发)
+    peer = CircuitBreakerRegistry()
+    try:
+        for ok in (True, False, True):
+            breaker.record(ok, 0.01)
+        assert breaker.state == STATE_CLOSED
+        breaker.record(False, 0.01)
+        assert breaker.state == STATE_OPEN
+        with pytest.raises(CircuitOpenError):
+            breaker.before()
+        await asyncio.sleep(0)
+        assert peer.get(host).state == STATE_OPEN
+
+        await asyncio.sleep(0.06)
+        assert breaker.before() is True
+        assert breaker.state == STATE_HALF_OPEN
+        # 探测进行中，其他请求继续快速失败
+        with pytest.raises(CircuitOpenError):
+            breaker.before()
+        breaker.record(True, 0.01, probe=True)
+        assert breaker.state == STATE_CLOSED
+        assert breaker.before() is False
+        await asyncio.sleep(0)
+        assert peer.get(host).state == STATE_CLOSED
+        # 广播任务完成后不再持有引用
+        await asyncio.sleep(0)
+        assert not _broadcasts
+    finally:
+        from app.queues.control import control_bus
+        control_bus.unsubscribe(peer._on_control)
+        circuit_breakers.reset()
+
+
+BIG_BODY = b"0123456789abcdef" * 16384
+
+
+@pytest.fixture
+def flaky_server():
+    """
+    本地 HTTP 服务：/flaky 前两次返回 503；/slow 第一次请求延迟 1 秒；/big 返回 256KB 文本；
+    /fresh 可缓存 60 秒；/etag 每次需重新验证，If-None-Match 匹配时返回 304；/redirect 302 到 /fresh
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    hits = {}
+
+    class _Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            n = hits[self.path] = hits.get(self.path, 0) + 1
+            if self.path == "/redirect":
+                self.send_response(302)
+                self.send_header("Location", "/fresh")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 503 if self.path == "/flaky" and n <= 2 else 200
+            if self.path == "/slow" and n == 1:
+                time.sleep(1)
+            body = f'{{"n": {n}}}'.encode() if self.path != "/big" else BIG_BODY
+            if self.path == "/etag" and self.headers.get("If-None-Match") == '"v1"':
+                self.send_response(304)
+                self.send_header("ETag", '"v1"')
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(status)
+            if self.path == "/fresh":
+                self.send_header("Cache-Control", "max-age=60")
+            if self.path == "/etag":
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("ETag", '"v1"')
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", hits
+    server.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_retry_policy_retries_transient_failures_within_budget(flaky_server, mocker):
+    """
+    幂等请求遇到 503 时按次数重试；重试预算耗尽时不再重试
+    """
+    from app.infra.http_client import http_client_pool
+    from app.infra.retry_policy import request_with_policy, retry_budget
+    mocker.patch("app.infra.retry_policy._backoff", return_value=0)
+    base, hits = flaky_server
+    try:
+        stats = {}
+        resp = await request_with_policy("GET", f"{base}/flaky", retries=3, stats=stats, timeout=5)
+        assert resp.status_code == 200 and stats["attempts"] == 3
+
+        mocker.patch.object(retry_budget, "withdraw", return_value=False)
+        hits.clear()
+        stats = {}
+        resp = await request_with_policy("GET", f"{base}/flaky", retries=3, stats=stats, timeout=5)
+        assert resp.status_code == 503 and stats["attempts"] == 1
+    finally:
+        await http_client_pool.aclose()
+
+
+@pytest.mark.asyncio
+async def test_hedged_get_takes_first_response(flaky_server, mocker):
+    """
+    GET 超过 p95 延迟未返回时发送对冲请求，先返回的响应胜出
+    """
+    from app.infra.http_client import http_client_pool
+    from app.infra.retry_policy import request_with_policy
+    mocker.patch("app.infra.retry_policy.hedge_delay", return_value=0.1)
+    base, hits = flaky_server
+    try:
+        stats = {}
+        start = time.perf_counter()
+        resp = await request_with_policy("GET", f"{base}/slow", hedge=True, stats=stats, timeout=5)
+        assert time.perf_counter() - start < 0.9
+        assert resp.json() == {"n": 2}
+        assert stats["hedged"] is True
+    finally:
+        await http_client_pool.aclose()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_hedge_wait_cancels_primary(mocker):
+    """
+    调用方在对冲等待期间被取消 (例如转发截止时间到期) 时，主请求随之取消，不会遗留孤儿请求
+    """
+    from app.infra import retry_policy
+    started, cancelled = asyncio.Event(), asyncio.Event()
+
+    async def _hang(method, url, **kwargs):
+        started.set()
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    mocker.patch.object(retry_policy.http_client_pool, "request", side_effect=_hang)
+    mocker.patch.object(retry_policy, "hedge_delay", return_value=10)
+    caller = asyncio.ensure_future(retry_policy._hedged("GET", "http://hedge.example.com/", {}))
+    await asyncio.wait_for(started.wait(), 1)
+
+    caller.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await caller
+    assert cancelled.is_set()
+
+
+@pytest.mark.asyncio
+async def test_host_slot_wait_is_bounded_by_request_timeout(flaky_server, mocker):
+    """
+    主机并发槽位已满时，等待槽位超过请求超时抛出 PoolTimeoutError，不计入熔断统计
+    """
+    from app.infra.circuit_breaker import circuit_breakers
+    from app.infra.http_client import http_client_pool, PoolTimeoutError
+    mocker.patch.object(http_client_pool, "max_per_host", return_value=1)
+    base, hits = flaky_server
+    circuit_breakers.reset()
+    try:
+        first = asyncio.ensure_future(http_client_pool.request("GET", f"{base}/slow", timeout=5))
+        await asyncio.sleep(0.1)
+        start = time.perf_counter()
+        with pytest.raises(PoolTimeoutError):
+            await http_client_pool.request("GET", f"{base}/slow", timeout=0.2)
+        assert time.perf_counter() - start < 0.5
+        assert (await first).status_code == 200
+        assert [ok for _, ok, _ in circuit_breakers.get("127.0.0.1")._window] == [True]
+        # 槽位释放后正常发送
+        assert (await http_client_pool.request("GET", f"{base}/slow", timeout=5)).status_code == 200
+    finally:
+        circuit_breakers.reset()
+        await http_client_pool.aclose()
+
+
+@pytest.mark.asyncio
+async def test_proxy_response_is_streamed_with_byte_cap(flaky_server):
+    """
+    响应体按字节上限流式读取：超限即中止并标记 truncated；hash 模式只返回完整响应体的摘要
+    """
+    import hashlib
+    from prometheus_client import REGISTRY
+    from app.infra.http_client import http_client_pool
+    from app.services.system import proxy_multi_forward
+    base, _ = flaky_server
+
+    def _aborted():
+        return REGISTRY.get_sample_value("procurator_http_client_response_aborted_total") or 0
+
+    aborted_before = _aborted()
+    try:
+        result = await proxy_multi_forward({"tasks": [
+            {"url": f"{base}/big", "method": "GET", "max_response_bytes": 1024},
+            {"url": f"{base}/big", "method": "GET", "response_mode": "hash"},
+        ]})
+    finally:
+        await http_client_pool.aclose()
+
+    capped, hashed = result["results"]
+    assert capped["truncated"] is True
+    assert capped["response"] == BIG_BODY[:500].decode()
+    assert _aborted() - aborted_before == 1
+    assert hashed["response"] == {"sha256": hashlib.sha256(BIG_BODY).hexdigest(), "size": len(BIG_BODY)}
+
+
+@pytest.mark.asyncio
+async def test_http_cache_serves_fresh_and_revalidates_stale(flaky_server):
+    """
+    HTTP 响应缓存：新鲜期内不访问网络；no-cache + ETag 时条件请求，304 复用缓存内容
+    """
+    from app.infra.http_client import http_client_pool
+    from app.infra.http_cache import http_response_cache
+    from app.services.system import proxy_multi_forward
+    base, hits = flaky_server
+    batch = {"cache": True, "tasks": [
+        {"url": f"{base}/fresh", "method": "GET"},
+        {"url": f"{base}/etag", "method": "GET"},
+        {"url": f"{base}/fresh", "method": "GET", "cache": False},
+    ]}
+    try:
+        first = await proxy_multi_forward(batch)
+        second = await proxy_multi_forward(batch)
+    finally:
+        await http_client_pool.aclose()
+        http_response_cache.clear()
+
+    assert [r["cache"] for r in first["results"][:2]] == ["miss", "miss"]
+    assert "cache" not in first["results"][2]
+    fresh, etag, uncached = second["results"]
+    assert fresh["cache"] == "hit" and fresh["response"] == first["results"][0]["response"]
+    assert etag["cache"] == "revalidated" and etag["status"] == 200 and etag["response"] == {"n": 1}
+    # /fresh 只有关闭缓存的子请求访问了网络；/etag 两次都访问 (第二次为条件请求)
+    assert hits["/fresh"] == 3 and hits["/etag"] == 2
+
+
+@pytest.mark.asyncio
+async def test_redirects_are_followed_only_on_request(flaky_server):
+    """
+    共享连接池默认不跟随重定向 (转发任务原有行为)，follow_redirects=True 时跟随 (同步 /proxy/forward)
+    """
+    base, hits = flaky_server
+    from app.infra.http_client import http_client_pool
+    try:
+        assert (await http_client_pool.request("GET", f"{base}/redirect")).status_code == 302
+        assert "/fresh" not in hits
+        resp = await http_client_pool.request("GET", f"{base}/redirect", follow_redirects=True)
+        assert resp.status_code == 200
+        assert hits["/fresh"] == 1
+    finally:
+        await http_client_pool.aclose()
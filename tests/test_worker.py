@@ -0,0 +1,315 @@
+import asyncio
+import pytest
+
+from app.queues.task_queue import MemoryBackend
+from app.worker import Worker
+
+
+@pytest.fixture
+def memory_queue(mocker):
+    """
+    使用独立的 MemoryBackend，并屏蔽数据库持久化与 Webhook
+    """
+    backend = MemoryBackend()
+    mocker.patch("app.worker.queue_manager.backend", backend)
+    mocker.patch("app.worker.persist_task_start", new=mocker.AsyncMock())
+    mocker.patch("app.worker.persist_task_finish", new=mocker.AsyncMock())
+    mocker.patch("app.worker.notify")
+    return backend
+
+
+@pytest.mark.asyncio
+async def test_drain_waits_for_inflight_task(memory_queue, mocker):
+    """
+    Drain 截止时间内完成的任务正常标记为 completed
+    """
+    async def _quick(task_name, task_data):
+        await asyncio.sleep(0.2)
+        return "ok"
+
+    mocker.patch("app.worker.handle_task", side_effect=_quick)
+    tid = memory_queue.enqueue("api", {"task": "system.ping", "taskData": {}})
+
+    w = Worker()
+    w.start(["api"])
+    await asyncio.sleep(0.05)
+    assert tid in w._inflight
+
+    await w.stop(timeout=2)
+    assert memory_queue.get_task(tid)["status"] == "completed"
+    assert not w._inflight
+
+
+@pytest.mark.asyncio
+async def test_drain_releases_task_after_deadline(memory_queue, mocker):
+    """
+    超过 Drain 截止时间的任务被释放回队首，状态恢复为 pending
+    """
+    async def _hang(task_name, task_data):
+        await asyncio.sleep(30)
+
+    mocker.patch("app.worker.handle_task", side_effect=_hang)
+    tid = memory_queue.enqueue("api", {"task": "system.ping", "taskData": {}})
+    other = memory_queue.enqueue("api", {"task": "system.ping", "taskData": {}})
+
+    w = Worker()
+    w.start(["api"])
+    await asyncio.sleep(0.05)
+
+    await w.stop(timeout=0.1)
+    assert memory_queue.get_task(tid)["status"] == "pending"
+    assert memory_queue.queues["api"] == [tid, other]
+
+
+@pytest.mark.asyncio
+async def test_task_timeout_goes_through_failure_path(memory_queue, mocker):
+    """
+    超过 timeout_seconds 的任务以 TaskTimeoutError 失败，并计入超时指标
+    """
+    from app.core.metrics import TASK_TIMEOUT_TOTAL
+
+    async def _hang(task_name, task_data):
+        await asyncio.sleep(30)
+
+    mocker.patch("app.worker.handle_task", side_effect=_hang)
+    mocker.patch("app.worker.task_registry.get_timeout", return_value=0.1)
+    finish = mocker.patch("app.worker.persist_task_finish", new=mocker.AsyncMock())
+    counter = TASK_TIMEOUT_TOTAL.labels(queue="api", task_name="system.ping")
+    before = counter._value.get()
+
+    tid = memory_queue.enqueue("api", {"task": "system.ping", "taskData": {}})
+    w = Worker()
+    w.start(["api"])
+    await asyncio.sleep(0.3)
+    await w.stop(timeout=1)
+
+    info = memory_queue.get_task(tid)
+    assert info["status"] == "failed"
+    assert "timed out" in info["error"]
+    assert finish.await_args.args[1] == "failed"
+    assert counter._value.get() == before + 1
+
+
+@pytest.mark.asyncio
+async def test_idle_worker_wakes_on_enqueue(memory_queue, mocker):
+    """
+    空闲 Worker 挂起等待，新任务入队后立即被唤醒执行
+    """
+    started = asyncio.Event()
+
+    async def _record(task_name, task_data):
+        started.set()
+        return "ok"
+
+    mocker.patch("app.worker.handle_task", side_effect=_record)
+    mocker.patch("app.worker.task_registry.get_timeout", return_value=None)
+
+    w = Worker()
+    w.start(["api"])
+    await asyncio.sleep(0.05)
+    assert len(w._idle) == 1
+
+    memory_queue.enqueue("api", {"task": "system.ping", "taskData": {}})
+    await asyncio.wait_for(started.wait(), timeout=0.1)
+
+    await w.stop(timeout=1)
+    assert not w._idle
+
+
+@pytest.mark.asyncio
+async def test_heartbeat_published_and_removed_on_stop(memory_queue):
+    """
+    Worker 启动后发布心跳，正常停机后立即注销
+    """
+    from app.infra.worker_registry import worker_registry
+
+    w = Worker()
+    w.start(["api", "script"])
+    await asyncio.sleep(0.05)
+
+    workers = {hb["worker_id"]: hb for hb in await worker_registry.list_workers()}
+    hb = workers[w.worker_id]
+    assert hb["queues"] == ["api", "script"]
+    assert hb["inflight"] == 0
+    assert hb["rss_mb"] > 0
+
+    await w.stop(timeout=1)
+    assert w.worker_id not in {hb["worker_id"] for hb in await worker_registry.list_workers()}
+
+
+@pytest.mark.asyncio
+async def test_cancel_pending_task_is_skipped(memory_queue, mocker):
+    """
+    排队中的任务取消后不会被执行
+    """
+    handler = mocker.patch("app.worker.handle_task", new=mocker.AsyncMock(return_value="ok"))
+    tid = memory_queue.enqueue("api", {"task": "system.ping", "taskData": {}})
+    assert memory_queue.cancel(tid) == "pending"
+
+    w = Worker()
+    w.start(["api"])
+    await asyncio.sleep(0.05)
+    await w.stop(timeout=1)
+
+    assert memory_queue.get_task(tid)["status"] == "cancelled"
+    handler.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("force", [False, True])
+async def test_cancel_running_task_via_control_bus(memory_queue, mocker, force):
+    """
+    执行中的任务通过控制通道取消，Worker 立即释放执行槽位并标记 cancelled
+    """
+    from app.queues.control import control_bus
+
+    async def _hang(task_name, task_data):
+        await asyncio.sleep(30)
+
+    mocker.patch("app.worker.handle_task", side_effect=_hang)
+    mocker.patch("app.worker.task_registry.get_timeout", return_value=None)
+    tid = memory_queue.enqueue("api", {"task": "system.ping", "taskData": {}})
+
+    w = Worker()
+    w.start(["api"])
+    await asyncio.sleep(0.05)
+    assert memory_queue.cancel(tid) == "processing"
+    await control_bus.publish({"action": "cancel", "tid": tid, "force": force})
+    await asyncio.sleep(0.05)
+
+    assert memory_queue.get_task(tid)["status"] == "cancelled"
+    assert not w._inflight
+    await w.stop(timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_redis_reclaim_wakes_blocked_dequeue(mocker):
+    """
+    Redis 模式：抢占死亡 Worker 的消息要求空闲超过心跳 TTL；抢占后唤醒阻塞中的 XREADGROUP，立即处理
+    """
+    from app.queues.backends.redis_stream import RedisStreamBackend
+    backend = RedisStreamBackend()
+    backend._initialized_queues.add("api")
+    backend._check_own_pending["api"] = False
+
+    backend.client = mocker.Mock()
+    backend.client.xpending_range.return_value = [
+        # 心跳短暂中断的 Worker 刚投递的消息：空闲时间不足心跳 TTL，不抢占
+        {"message_id": "1-0", "consumer": "worker_b", "times_delivered": 1, "time_since_delivered": 2000},
+        {"message_id": "2-0", "consumer": "worker_a", "times_delivered": 1, "time_since_delivered": 20000},
+    ]
+    backend.client.xclaim.return_value = [("2-0", {"tid": "t-2"})]
+
+    async def xreadgroup(group, consumer, streams, count=1, block=None):
+        if list(streams.values())[0] == ">":
+            await asyncio.sleep(30)
+            return []
+        return [("procurator:queue:api", [("2-0", {"tid": "t-2"})])]
+
+    backend._async_client = mocker.Mock(xreadgroup=xreadgroup)
+    backend._claim_script = mocker.AsyncMock(return_value=["processing", '{"task": "echo"}'])
+
+    dequeue = asyncio.ensure_future(backend.adequeue("api"))
+    await asyncio.sleep(0.05)
+    assert not dequeue.done()
+
+    claimed = await asyncio.to_thread(backend.process_pending, "api", {backend.consumer_name})
+    assert claimed == 1
+    assert [c.kwargs["message_ids"] for c in backend.client.xclaim.call_args_list] == [["2-0"]]
+    assert backend.client.xclaim.call_args.kwargs["min_idle_time"] >= 15000
+
+    # 被唤醒的出队放弃本次阻塞，下一次出队立即处理抢占的消息
+    assert await asyncio.wait_for(dequeue, 1) is None
+    assert await asyncio.wait_for(backend.adequeue("api"), 1) == ("t-2", {"task": "echo"})
+
+
+@pytest.mark.asyncio
+async def test_failed_task_is_retried_up_to_max_retries(memory_queue, mocker):
+    """
+    失败的任务在 _max_retries 次数内重新入队，用完后才标记失败并触发 Webhook
+    """
+    attempts = []
+
+    async def _flaky(task_name, task_data):
+        attempts.append(task_name)
+        raise RuntimeError("boom")
+
+    mocker.patch("app.worker.handle_task", side_effect=_flaky)
+    mocker.patch("app.worker.task_registry.get_timeout", return_value=None)
+    notify = mocker.patch("app.worker.notify")
+
+    tid = memory_queue.enqueue("api", {"task": "system.ping", "taskData": {}, "_max_retries": 2})
+    w = Worker()
+    w.start(["api"])
+    await asyncio.sleep(0.3)
+    await w.stop(timeout=1)
+
+    assert len(attempts) == 3
+    info = memory_queue.get_task(tid)
+    assert info["status"] == "failed"
+    assert info["retry_count"] == 2
+    assert notify.call_count == 1
+    assert notify.call_args.args[3] == "failed"
+
+
+@pytest.mark.asyncio
+async def test_redis_deferred_pending_message_is_not_reread_until_backoff(mocker):
+    """
+    Redis 模式：编排回调失败的消息留在自己的 PEL 中，退避期间不会被反复读取，到期后唤醒重新投递
+    """
+    from app.queues.backends.redis_stream import RedisStreamBackend
+    backend = RedisStreamBackend()
+    backend._initialized_queues.add("api")
+
+    backend.client = mocker.Mock()
+    backend.client.hmget.return_value = ["api", "1-0"]
+    backend.client.hincrby.return_value = 1
+    mocker.patch("app.queues.backends.redis_stream.config.get",
+                 side_effect=lambda k, default=None: 0.2 if k == "ORCHESTRATION_RETRY_DELAY" else default)
+
+    reads = []
+
+    async def xreadgroup(group, consumer, streams, count=1, block=None):
+        start = list(streams.values())[0]
+        reads.append(start)
+        if start == ">":
+            await asyncio.sleep(30)
+            return []
+        if start == "0":
+            return [("procurator:queue:api", [("1-0", {"tid": "t-1"})])]
+        return []
+
+    backend._async_client = mocker.Mock(xreadgroup=xreadgroup)
+    backend._claim_script = mocker.AsyncMock(return_value=["processing", '{"task": "echo"}'])
+
+    assert backend.defer("t-1") == 1
+    # 退避中：读取一次自己的 PEL 后转入阻塞读取新消息，不会反复重新投递
+    dequeue = asyncio.ensure_future(backend.adequeue("api"))
+    await asyncio.sleep(0.05)
+    assert not dequeue.done()
+    assert reads == ["0", "1-0", ">"]
+
+    # 退避到期：唤醒阻塞中的出队，下一次出队重新投递该消息
+    assert await asyncio.wait_for(dequeue, 1) is None
+    assert await asyncio.wait_for(backend.adequeue("api"), 1) == ("t-1", {"task": "echo"})
+
+
+def test_redis_release_pending_skips_finished_tasks(mocker):
+    """
+    Redis 模式停机释放 PEL：已完成 / 已取消的任务只 ACK，不重新入队也不覆盖终态
+    """
+    from app.queues.backends.redis_stream import RedisStreamBackend
+    backend = RedisStreamBackend()
+    backend._initialized_queues.add("api")
+
+    backend.client = mocker.Mock()
+    backend.client.xpending_range.return_value = [{"message_id": f"{i}-0"} for i in range(3)]
+    backend.client.xrange.side_effect = lambda key, min, max, count: [(min, {"tid": f"t-{min[0]}"})]
+    statuses = {"t-0": "processing", "t-1": "completed", "t-2": "cancelled"}
+    backend.client.hget.side_effect = lambda key, field: statuses[key.rsplit(":", 1)[1]]
+    pipeline = backend.client.pipeline.return_value
+
+    assert backend.release_pending("api") == 1
+    pipeline.xadd.assert_called_once_with("procurator:queue:api", {"tid": "t-0"})
+    pipeline.hset.assert_called_once_with("procurator:task:t-0", "status", "pending")
+    assert pipeline.xack.call_count == 3
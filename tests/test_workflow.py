@@ -0,0 +1,162 @@
+import asyncio
+import pytest
+
+from app.queues.task_queue import MemoryBackend
+from app.services.workflow import WorkflowEngine, validate_dag
+from app.worker import Worker
+
+
+@pytest.fixture
+def engine(mocker):
+    """
+    Memory 模式的工作流引擎 + 独立 MemoryBackend，屏蔽数据库持久化与 Webhook
+    """
+    backend = MemoryBackend()
+    mocker.patch("app.worker.queue_manager.backend", backend)
+    mocker.patch("app.worker.persist_task_start", new=mocker.AsyncMock())
+    mocker.patch("app.worker.persist_task_finish", new=mocker.AsyncMock())
+    mocker.patch("app.worker.notify")
+    mocker.patch("app.services.workflow.persist_task_init", new=mocker.AsyncMock())
+    mocker.patch("app.services.workflow.persist_workflow", new=mocker.AsyncMock())
+    mocker.patch("app.services.workflow.notify")
+    wf = WorkflowEngine()
+    wf.enabled = False
+    mocker.patch("app.worker.workflow_engine", wf)
+    return wf
+
+
+def _node(task="system.ping", **task_data):
+    return {"task": task, "taskData": task_data, "queue": "api", "_max_retries": None}
+
+
+def test_validate_dag_rejects_cycles_and_unknown_nodes():
+    successors, predecessors = validate_dag(["a", "b", "c"], [("a", "b"), ("a", "c"), ("b", "c")])
+    assert successors["a"] == ["b", "c"]
+    assert predecessors["c"] == ["a", "b"]
+
+    with pytest.raises(ValueError):
+        validate_dag(["a", "b"], [("a", "b"), ("b", "a")])
+    with pytest.raises(ValueError):
+        validate_dag(["a"], [("a", "x")])
+    with pytest.raises(ValueError):
+        validate_dag(["a", "a"], [])
+
+
+@pytest.mark.asyncio
+async def test_diamond_workflow_passes_upstream_results(engine, mocker):
+    """
+    a -> (b, c) -> d：d 只在 b、c 都完成后入队一次，并收到两者的结果
+    """
+    seen = {}
+
+    async def _handler(task_name, task_data):
+        seen[task_data["name"]] = task_data.get("_upstream")
+        return f"{task_data['name']}-done"
+
+    mocker.patch("app.worker.handle_task", side_effect=_handler)
+    nodes = {n: _node(name=n) for n in "abcd"}
+    wid = await engine.submit(nodes, [("a", "b"), ("a", "c"), ("b", "d"), ("c", "d")])
+
+    w = Worker()
+    w.start(["api"])
+    for _ in range(50):
+        info = await engine.get(wid)
+        if info["status"] != "running":
+            break
+        await asyncio.sleep(0.02)
+    await w.stop(timeout=1)
+
+    assert info["status"] == "completed"
+    assert info["finished"] == 4
+    assert seen["a"] is None
+    assert seen["b"] == {"a": "a-done"}
+    assert seen["d"] == {"b": "b-done", "c": "c-done"}
+    assert info["nodes"]["d"]["result"] == "d-done"
+
+
+@pytest.mark.asyncio
+async def test_duplicate_completion_and_failure(engine, mocker):
+    """
+    同一节点重复完成只计一次；节点失败后工作流标记为 failed，不再触发后继
+    """
+    enqueue = mocker.spy(engine, "_enqueue_node")
+    wid = await engine.submit({"a": _node(), "b": _node(), "c": _node()}, [("a", "c"), ("b", "c")])
+    assert enqueue.call_count == 2
+
+    payload_a = {"_workflow": {"id": wid, "node": "a"}}
+    await engine.on_task_finished(payload_a, "completed", result=1)
+    await engine.on_task_finished(payload_a, "completed", result=1)
+    info = await engine.get(wid)
+    assert info["finished"] == 1
+    assert info["nodes"]["c"]["state"] == "waiting"
+
+    await engine.on_task_finished({"_workflow": {"id": wid, "node": "b"}}, "failed", error="boom")
+    info = await engine.get(wid)
+    assert info["status"] == "failed"
+    assert enqueue.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_redelivered_completion_enqueues_lost_successor_once(engine, mocker):
+    """
+    节点完成后、后继入队前中断：重新投递的完成回调补发后继，且只入队一次
+    """
+    from app.services.workflow import node_task_id
+    from app.worker import queue_manager
+
+    wid = await engine.submit({"a": _node(), "b": _node()}, [("a", "b")])
+    real = queue_manager.enqueue_once
+    calls = []
+
+    def _flaky(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise RuntimeError("redis down")
+        return real(*args)
+
+    mocker.patch.object(queue_manager, "enqueue_once", side_effect=_flaky)
+
+    payload_a = {"_workflow": {"id": wid, "node": "a"}}
+    with pytest.raises(RuntimeError):
+        await engine.on_task_finished(payload_a, "completed", result=1)
+    info = await engine.get(wid)
+    assert info["nodes"]["b"]["state"] == "queued"
+    assert info["nodes"]["b"]["task_id"] is None
+
+    await engine.on_task_finished(payload_a, "completed", result=1)
+    await engine.on_task_finished(payload_a, "completed", result=1)
+    tid = node_task_id(wid, "b")
+    assert (await engine.get(wid))["nodes"]["b"]["task_id"] == tid
+    assert queue_manager.backend.queues["api"].count(tid) == 1
+    assert queue_manager.backend.get_task(tid)["payload"]["taskData"]["_upstream"] == {"a": 1}
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("attempts, status", [(1, "processing"), (6, "failed")])
+async def test_failed_orchestration_is_held_then_dead_lettered(engine, mocker, attempts, status):
+    """
+    编排回调失败时 Worker 不 ACK (Redis 模式消息留在 PEL 中退避后重新投递)；
+    失败次数超过 ORCHESTRATION_MAX_ATTEMPTS (默认 5) 后标记失败写入 DLQ
+    """
+    from app.worker import queue_manager
+
+    mocker.patch("app.worker.handle_task", new=mocker.AsyncMock(return_value="ok"))
+    mocker.patch.object(engine, "on_task_finished", side_effect=RuntimeError("redis down"))
+    mocker.patch.object(queue_manager, "supports_redelivery", return_value=True)
+    defer = mocker.patch.object(queue_manager, "defer", return_value=attempts)
+    mark_done = mocker.spy(queue_manager, "mark_done")
+
+    tid = queue_manager.enqueue("api", {"task": "system.ping", "taskData": {}, "_workflow": {"id": "w", "node": "a"}})
+    w = Worker()
+    w.start(["api"])
+    await asyncio.sleep(0.05)
+    await w.stop(timeout=1)
+
+    engine.on_task_finished.assert_awaited_once()
+    defer.assert_called_once_with(tid)
+    mark_done.assert_not_called()
+    info = queue_manager.get_task(tid)
+    assert info["status"] == status
+    if status == "failed":
+        assert info["error"] == "orchestration callback failed"
@@ -0,0 +1,37 @@
+import sys
+import os
+import time
+import importlib
+
+# 确保能导入 app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.queues.tasks import ALLOWED_TASKS, build_dispatch_table, get_handler
+
+
+def _legacy_lookup(task_name: str):
+    # 旧的分发方式：每次调用都 rsplit + import_module + getattr
+    module_name, func_name = ALLOWED_TASKS[task_name].rsplit(".", 1)
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+def bench(fn, task_name: str, n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        fn(task_name)
+    return (time.perf_counter() - start) / n * 1e9
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    build_dispatch_table(warmup=False)
+
+    print(f"{'task':<24}{'legacy (ns)':>14}{'table (ns)':>14}")
+    for task_name in ALLOWED_TASKS:
+        legacy = bench(_legacy_lookup, task_name, n)
+        table = bench(get_handler, task_name, n)
+        print(f"{task_name:<24}{legacy:>14.1f}{table:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import sys
+import os
+import json
+import time
+from datetime import datetime
+
+# 确保能导入 app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import JSONResponse
+from pydantic import HttpUrl, TypeAdapter
+from app.core.serialization import FastJSONResponse
+
+
+def legacy_to_json_compatible(obj):
+    # 原 /dispatch 中的递归转换 (已移除)，保留在此作为对比基线
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump(mode="json")
+    if hasattr(obj, "dict"):
+        return obj.dict()
+    if isinstance(obj, list):
+        return [legacy_to_json_compatible(item) for item in obj]
+    if isinstance(obj, dict):
+        return {k: legacy_to_json_compatible(v) for k, v in obj.items()}
+    if hasattr(obj, "__str__") and not isinstance(obj, (int, float, bool, type(None), str)):
+        return str(obj)
+    return obj
+
+
+def _payloads(n_items: int):
+    url = TypeAdapter(HttpUrl).validate_python("https://api.example.com/items")
+    # proxy_multi_forward 的同步结果：每个子请求一条带响应体的结果
+    multi = {
+        "accepted": True,
+        "status": "completed",
+        "result": [
+            {
+                "url": f"https://api.example.com/items/{i}",
+                "code": 200,
+                "ok": True,
+                "response": {"id": i, "name": f"item-{i}", "tags": ["a", "b", "c"], "meta": {"k": "v" * 32}},
+                "ms": 12,
+            }
+            for i in range(n_items)
+        ],
+    }
+    # /task/{tid}/detail：payload + result，包含 HttpUrl 与时间
+    detail = {
+        "id": "550e8400-e29b-41d4-a716-446655440000",
+        "status": "completed",
+        "payload": {"task": "proxy_forward", "taskData": {"urls": [url] * 16, "data": {"rows": list(range(n_items))}}},
+        "result": {"rows": [{"id": i, "value": "x" * 64, "at": datetime(2024, 1, 1)} for i in range(n_items)]},
+    }
+    # (名称, 内容, 旧路径是否先经过 to_json_compatible：只有 /dispatch 会)
+    return [("proxy_multi_forward", multi, True), ("task_detail", detail, False)]
+
+
+def bench_legacy(content, walk: bool, n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        # 旧路径：(to_json_compatible) -> FastAPI jsonable_encoder -> starlette JSONResponse (json.dumps)
+        JSONResponse(jsonable_encoder(legacy_to_json_compatible(content) if walk else content))
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def bench_fast(content, n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        FastJSONResponse(content)
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+
+    print(f"{'payload':<24}{'items':>8}{'legacy (us)':>16}{'orjson (us)':>16}{'speedup':>10}")
+    for n_items in (10, 100, 1000):
+        for name, content, walk in _payloads(n_items):
+            # 两条路径的输出应当等价
+            assert json.loads(FastJSONResponse(content).body) == json.loads(
+                JSONResponse(jsonable_encoder(content)).body
+            )
+            legacy = bench_legacy(content, walk, n)
+            fast = bench_fast(content, n)
+            print(f"{name:<24}{n_items:>8}{legacy:>16.1f}{fast:>16.1f}{legacy / fast:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()